@@ -0,0 +1,283 @@
+# agent/backends.py
+"""
+LLM backends: several API keys and/or OpenAI-compatible endpoints behind one client.
+
+A backend is one (key, endpoint) pair. DebugConfig.LLM_BACKENDS lists them as
+`key@https://host/openai/v1`. It can also come from `GROQ_API_KEYS` (several
+keys, one endpoint), or from the single GROQ_API_KEY. Any OpenAI-compatible
+server works, including the bundled `mock_llm_server.py`.
+
+Routing happens below the provider SDK, in the shared httpx client's
+transport (`RoutingTransport`). Each request goes to the least-loaded healthy
+backend: the fewest requests in flight, then the fewest sent in the last
+minute, so per-key rate limits fill evenly. Its URL and Authorization header
+are rewritten on the way. The SDK's own retries, and hedged requests, land on
+another key without any help.
+
+Health is tracked passively and actively. The provider's
+`x-ratelimit-remaining/reset-requests` headers, or a 429 and its Retry-After,
+pause a key until its window resets. When every key is paused, requests wait
+for the first one to recover instead of collecting more 429s. A rejected
+key, or repeated 5xx or connection errors, take a backend out of rotation.
+The health-check thread probes it back in (`GET <endpoint>/models`).
+`agent.llm.backend_metrics()` reports load, errors and latency per backend.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import httpx
+
+from agent.cancellation import check_cancelled
+from debug_config import DebugConfig
+
+_SDK_PREFIX = "/openai/v1"  # the path the Groq SDK puts before every OpenAI-compatible route
+_RATE_WINDOW = 60.0
+_WAIT_SLICE = 0.1  # how quickly a request waiting for a cooled-down backend notices cancellation
+
+
+@dataclass
+class Backend:
+    url: str  # OpenAI-compatible base, e.g. https://api.groq.com/openai/v1
+    api_key: str
+    in_flight: int = 0
+    requests: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    consecutive_failures: int = 0
+    healthy: bool = True
+    cooldown_until: float = 0.0
+    # Requests the provider says are left in this window (None: unknown)
+    remaining: Optional[int] = None
+    latency_ewma: Optional[float] = None
+    recent: deque = field(default_factory=deque)  # send times within the last minute
+
+    @property
+    def name(self) -> str:
+        # Never expose the key itself in metrics.
+        return f"{self.url}#{hashlib.sha256(self.api_key.encode()).hexdigest()[:8]}"
+
+    def available(self, now: float) -> bool:
+        if not self.healthy or now < self.cooldown_until:
+            return False
+        return self.remaining is None or self.in_flight < self.remaining
+
+    def target(self, url: httpx.URL) -> httpx.URL:
+        """Map an SDK request URL onto this backend."""
+        base = httpx.URL(self.url)
+        path = url.path[len(_SDK_PREFIX):] if url.path.startswith(_SDK_PREFIX) else url.path
+        return url.copy_with(scheme=base.scheme, host=base.host, port=base.port,
+                             path=base.path.rstrip("/") + path)
+
+
+def backends_from_config() -> list[Backend]:
+    # Read at call time: llm.py loads .env after DebugConfig was imported.
+    default_url = (os.getenv("GROQ_API_BASE") or "https://api.groq.com").rstrip("/") + _SDK_PREFIX
+    spec = os.getenv("LLM_BACKENDS", DebugConfig.LLM_BACKENDS)
+    if spec:
+        backends = []
+        for item in spec.split(","):
+            key, sep, url = item.strip().partition("@")
+            backends.append(Backend(url=url.rstrip("/") if sep else default_url, api_key=key))
+        return backends
+    keys = os.getenv("GROQ_API_KEYS", DebugConfig.GROQ_API_KEYS) or os.getenv("GROQ_API_KEY") or ""
+    return [Backend(url=default_url, api_key=k.strip()) for k in keys.split(",") if k.strip()] or [
+        Backend(url=default_url, api_key="")]
+
+
+def _seconds(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After / rate-limit reset value: "2", "0.5s", "250ms" or "1m30.5s"."""
+    if not value:
+        return None
+    match = re.fullmatch(r"(?:(\d+)m(?!s))?(?:([\d.]+)(s|ms)?)?", value.strip())
+    if not match or not any(match.groups()):
+        return None
+    minutes, amount, unit = match.groups()
+    seconds = float(amount or 0) / (1000 if unit == "ms" else 1)
+    return 60 * int(minutes or 0) + seconds
+
+
+class BackendPool:
+    """Least-loaded selection and health bookkeeping for a set of backends."""
+
+    def __init__(self, backends: Optional[list[Backend]] = None):
+        self.backends = backends or backends_from_config()
+        # Set by agent.llm to share its connection pool
+        self.probe_client: Optional[httpx.Client] = None
+        # A condition so that waiting requests wake as soon as release() frees a slot
+        self._lock = threading.Condition()
+        self._checker: Optional[threading.Thread] = None
+
+    def configure(self, backends: list[Backend]) -> None:
+        with self._lock:
+            self.backends = backends
+            self._lock.notify_all()
+
+    def acquire(self, exclude: tuple[Backend, ...] = ()) -> Backend:
+        """Reserve the least-loaded backend, waiting out rate-limit cooldowns if all are in one."""
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                for backend in self.backends:
+                    while backend.recent and backend.recent[0] < now - _RATE_WINDOW:
+                        backend.recent.popleft()
+                    if backend.remaining == 0 and now >= backend.cooldown_until:
+                        # Window over: one request finds out the new allowance
+                        backend.remaining = 1
+                pool = [b for b in self.backends if b not in exclude] or self.backends
+                candidates = [b for b in pool if b.available(now)]
+                if not candidates:
+                    healthy = [b for b in pool if b.healthy]
+                    if healthy:
+                        # All rate limited (a request sent now would only earn another 429),
+                        # or every remaining slot is taken and only release() can free one.
+                        wait = min(b.cooldown_until for b in healthy) - now
+                    else:
+                        candidates, wait = list(pool), 0.0  # all failing: let the request report it
+                if candidates:
+                    backend = min(candidates, key=lambda b: (b.in_flight, len(b.recent)))
+                    backend.in_flight += 1
+                    backend.requests += 1
+                    backend.recent.append(now)
+                    return backend
+                check_cancelled()
+                self._lock.wait(min(wait, _WAIT_SLICE) if wait > 0 else _WAIT_SLICE)
+
+    def release(self, backend: Backend, started: float, response: Optional[httpx.Response]) -> None:
+        """Account for a finished request; `response` is None when the connection failed."""
+        elapsed = time.monotonic() - started
+        status = response.status_code if response is not None else None
+        with self._lock:
+            backend.in_flight -= 1
+            self._lock.notify_all()
+            if status == 429:
+                backend.rate_limited += 1
+                backend.remaining = 0
+                wait = _seconds(response.headers.get("retry-after"))
+                backend.cooldown_until = time.monotonic() + (
+                    DebugConfig.LLM_BACKEND_COOLDOWN_SECONDS if wait is None else wait)
+            elif status in (401, 403):
+                backend.errors += 1
+                backend.healthy = False  # bad key: only a successful probe brings it back
+                self._start_health_checks()
+            elif status is None or status >= 500:
+                backend.errors += 1
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= DebugConfig.LLM_BACKEND_MAX_FAILURES:
+                    backend.healthy = False
+                    self._start_health_checks()
+            else:
+                backend.consecutive_failures = 0
+                backend.healthy = True  # it answered: whatever took it out of rotation has passed
+                backend.latency_ewma = elapsed if backend.latency_ewma is None else (
+                    0.8 * backend.latency_ewma + 0.2 * elapsed)
+                # Groq (like OpenAI) reports the request allowance; stop before the provider
+                # has to refuse.
+                remaining = response.headers.get("x-ratelimit-remaining-requests")
+                if remaining is not None and remaining.isdigit():
+                    backend.remaining = int(remaining)
+                    reset = _seconds(response.headers.get("x-ratelimit-reset-requests"))
+                    if backend.remaining == 0 and reset is not None:
+                        backend.cooldown_until = time.monotonic() + reset
+
+    # --- active health checks ---
+    def probe(self, backend: Backend) -> bool:
+        """GET <endpoint>/models; healthy if it answers without a server or auth error."""
+        if self.probe_client is None:
+            self.probe_client = httpx.Client()
+        try:
+            response = self.probe_client.get(
+                f"{backend.url}/models",
+                headers={"Authorization": f"Bearer {backend.api_key}"},
+                timeout=DebugConfig.HTTP_CONNECT_TIMEOUT,
+            )
+            ok = response.status_code < 500 and response.status_code not in (401, 403)
+        except httpx.HTTPError:
+            ok = False
+        with self._lock:
+            backend.healthy = ok
+            if ok:
+                backend.consecutive_failures = 0
+                self._lock.notify_all()
+            else:
+                # e.g. down at warm-up: keep probing until it comes back
+                self._start_health_checks()
+        return ok
+
+    def _start_health_checks(self) -> None:
+        if self._checker is None or not self._checker.is_alive():
+            self._checker = threading.Thread(target=self._check_loop, name="llm-health",
+                                             daemon=True)
+            self._checker.start()
+
+    def _check_loop(self) -> None:
+        while True:
+            time.sleep(DebugConfig.LLM_HEALTH_CHECK_SECONDS)
+            with self._lock:
+                down = [b for b in self.backends if not b.healthy]
+            if not down:
+                return  # restarted by the next failure
+            for backend in down:
+                self.probe(backend)
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "backend": b.name,
+                    "healthy": b.healthy,
+                    "cooling_down_seconds": round(max(0.0, b.cooldown_until - now), 1),
+                    "in_flight": b.in_flight,
+                    "requests": b.requests,
+                    "requests_last_minute": len(b.recent),
+                    "errors": b.errors,
+                    "rate_limited": b.rate_limited,
+                    "avg_latency_ms": (round(1000 * b.latency_ewma, 1)
+                                       if b.latency_ewma is not None else None),
+                }
+                for b in self.backends
+            ]
+
+
+class RoutingTransport(httpx.BaseTransport):
+    """httpx transport that sends each request to the pool's least-loaded backend."""
+
+    def __init__(self, pool: BackendPool, inner: httpx.BaseTransport):
+        self.pool = pool
+        self.inner = inner
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        url = request.url
+        tried: list[Backend] = []
+        while True:
+            backend = self.pool.acquire(tuple(tried))
+            tried.append(backend)
+            request.url = backend.target(url)
+            request.headers["Host"] = request.url.netloc.decode("ascii")
+            request.headers["Authorization"] = f"Bearer {backend.api_key}"
+            # Requests that never reached a model (refused connection, rejected key) move to the
+            # next backend.
+            last = len(tried) >= len(self.pool.backends)
+            started = time.monotonic()
+            try:
+                response = self.inner.handle_request(request)
+            except httpx.TransportError as e:
+                self.pool.release(backend, started, None)
+                if last or not isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+                    raise
+                continue
+            self.pool.release(backend, started, response)
+            if last or response.status_code not in (401, 403):
+                return response
+            response.close()
+
+    def close(self) -> None:
+        self.inner.close()
@@ -0,0 +1,132 @@
+# agent/budget.py
+"""
+Per-run token and wall-time budget.
+
+`RunBudget` is a LangChain callback handler: pass it in the run config's
+`callbacks` and it accumulates provider usage from every LLM call in every
+node. Nodes read it from `config["configurable"]["budget"]` and degrade as it
+runs low: cheaper model first, then skipping optional tasks, then stopping
+cleanly with whatever has been written so far.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.runnables import RunnableConfig
+
+from debug_config import DebugConfig
+
+OK = "ok"
+LOW = "low"            # switch to the cheaper model
+CRITICAL = "critical"  # also skip optional tasks
+EXHAUSTED = "exhausted"  # stop scheduling LLM work
+
+
+def _usage_from_result(response: LLMResult) -> tuple[int, int, int]:
+    """(input_tokens, output_tokens, cached_input_tokens) the provider reported for one LLM call."""
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        return (int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0),
+                int(cached or 0))
+    inp = out = cached = 0
+    for generations in response.generations:
+        for gen in generations:
+            meta = getattr(getattr(gen, "message", None), "usage_metadata", None) or {}
+            inp += int(meta.get("input_tokens") or 0)
+            out += int(meta.get("output_tokens") or 0)
+            cached += int((meta.get("input_token_details") or {}).get("cache_read") or 0)
+    return inp, out, cached
+
+
+class RunBudget(BaseCallbackHandler):
+    """Tracks input/output tokens and wall time for one run against fixed limits."""
+
+    def __init__(
+        self,
+        max_input_tokens: Optional[int] = None,
+        max_output_tokens: Optional[int] = None,
+        max_seconds: Optional[float] = None,
+    ) -> None:
+        self.max_input_tokens = max_input_tokens or DebugConfig.BUDGET_MAX_INPUT_TOKENS
+        self.max_output_tokens = max_output_tokens or DebugConfig.BUDGET_MAX_OUTPUT_TOKENS
+        self.max_seconds = max_seconds or DebugConfig.BUDGET_MAX_SECONDS
+        self.input_tokens = 0
+        self.output_tokens = 0
+        # Part of input_tokens the provider served from its prompt cache
+        self.cached_input_tokens = 0
+        self.llm_calls = 0
+        self.started_at = time.monotonic()
+        self.model_downgraded = False
+        self.skipped_steps: list[str] = []
+        self.stopped_early = False
+        self._lock = threading.Lock()
+
+    # --- callback hooks ---
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        inp, out, cached = _usage_from_result(response)
+        with self._lock:
+            self.input_tokens += inp
+            self.output_tokens += out
+            self.cached_input_tokens += cached
+            self.llm_calls += 1
+
+    # --- budget queries ---
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining_fraction(self) -> float:
+        """Smallest remaining share across the three limits (0.0 = spent)."""
+        with self._lock:
+            shares = [
+                1 - self.input_tokens / self.max_input_tokens,
+                1 - self.output_tokens / self.max_output_tokens,
+                1 - self.elapsed() / self.max_seconds,
+            ]
+        return max(0.0, min(shares))
+
+    def level(self) -> str:
+        left = self.remaining_fraction()
+        if left <= 0:
+            return EXHAUSTED
+        if left <= DebugConfig.BUDGET_CRITICAL_FRACTION:
+            return CRITICAL
+        if left <= DebugConfig.BUDGET_LOW_FRACTION:
+            return LOW
+        return OK
+
+    def status(self) -> dict:
+        """Snapshot suitable for the final graph state."""
+        return {
+            "level": self.level(),
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_input_tokens": self.cached_input_tokens,
+            "cache_hit_rate": (round(self.cached_input_tokens / self.input_tokens, 3)
+                               if self.input_tokens else None),
+            "llm_calls": self.llm_calls,
+            "elapsed_seconds": round(self.elapsed(), 2),
+            "limits": {
+                "input_tokens": self.max_input_tokens,
+                "output_tokens": self.max_output_tokens,
+                "seconds": self.max_seconds,
+            },
+            "model_downgraded": self.model_downgraded,
+            "skipped_steps": list(self.skipped_steps),
+            "stopped_early": self.stopped_early,
+        }
+
+    def run_config(self, **extra: Any) -> RunnableConfig:
+        """Graph config that attaches this budget to every node and LLM call."""
+        config: RunnableConfig = {"callbacks": [self], "configurable": {"budget": self}}
+        config.update(extra)  # type: ignore[typeddict-item]
+        return config
+
+
+def get_budget(config: Optional[RunnableConfig]) -> Optional[RunBudget]:
+    """The RunBudget attached to a graph run, if any."""
+    return ((config or {}).get("configurable") or {}).get("budget")
@@ -0,0 +1,170 @@
+# agent/cancellation.py
+"""
+Cooperative cancellation and per-node deadlines for a graph run.
+
+A run carries one `CancelToken`, installed with `use_token()` so it follows the
+run into LangGraph/LangChain worker threads the same way the project root
+does. Whoever owns the run may cancel it: the job worker when
+`DELETE /jobs/{id}` sets the store's cancel flag, the UI when its client goes
+away or submits a newer prompt.
+
+Nothing new starts once a run is cancelled: `cancel_callback` (attached to the
+run config next to the budget) checks the token before every LLM and tool
+call, and `write_file` checks it before touching the workspace. `run_node()`
+runs a node's LLM work on a helper thread with a deadline from
+DebugConfig.NODE_TIMEOUT_SECONDS and stops waiting as soon as the run is
+cancelled or the deadline passes. The abandoned work keeps a child token that
+is cancelled at that moment, so it cannot write into the workspace later;
+files are replaced atomically, so whatever was written before is complete.
+"""
+from __future__ import annotations
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from debug_config import DebugConfig
+
+T = TypeVar("T")
+
+_WAIT_SLICE = 0.1  # how quickly a waiting node notices cancellation
+
+
+class Cancelled(Exception):
+    """Raised inside a run once its token has been cancelled."""
+
+
+class NodeTimeout(TimeoutError):
+    """Raised when a node's work outlives its deadline."""
+
+
+class CancelToken:
+    """A cancellation flag; a child token is also cancelled when its parent is."""
+
+    def __init__(self, parent: Optional[CancelToken] = None):
+        self.parent = parent
+        self._reason: Optional[str] = None
+        self._event = threading.Event()
+
+    def cancel(self, reason: str = "Cancelled.") -> None:
+        if not self._event.is_set():
+            self._reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    @property
+    def reason(self) -> Optional[str]:
+        if self.parent is not None and self.parent.cancelled:
+            return self.parent.reason
+        return self._reason
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise Cancelled(self.reason)
+
+    def sleep(self, seconds: float) -> None:
+        """Sleep, but raise Cancelled as soon as the token is cancelled."""
+        deadline = time.monotonic() + seconds
+        while (left := deadline - time.monotonic()) > 0:
+            self.check()
+            self._event.wait(min(left, _WAIT_SLICE))
+        self.check()
+
+
+_current: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar(
+    "cancel_token", default=None
+)
+_node: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("graph_node", default=None)
+
+
+def current_token() -> Optional[CancelToken]:
+    return _current.get()
+
+
+def current_node() -> Optional[str]:
+    """Name of the node whose `run_node()` work is executing (for per-node LLM statistics)."""
+    return _node.get()
+
+
+@contextmanager
+def use_token(token: CancelToken) -> Iterator[CancelToken]:
+    """Make `token` the active run's token for the duration of the block."""
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+def check_cancelled() -> None:
+    """Raise Cancelled if the active run (or the node it is in) was cancelled."""
+    token = _current.get()
+    if token is not None:
+        token.check()
+
+
+class _CancelCallback(BaseCallbackHandler):
+    """Refuses to start LLM and tool calls for a cancelled run."""
+
+    raise_error = True  # LangChain swallows callback errors otherwise
+
+    def on_llm_start(self, *args: Any, **kwargs: Any) -> None:
+        check_cancelled()
+
+    def on_chat_model_start(self, *args: Any, **kwargs: Any) -> None:
+        check_cancelled()
+
+    def on_tool_start(self, *args: Any, **kwargs: Any) -> None:
+        check_cancelled()
+
+
+cancel_callback = _CancelCallback()
+
+
+def run_node(node: str, fn: Callable[[], T], timeout: Optional[float] = None) -> T:
+    """
+    Run `fn` under a child of the active token with the node's deadline.
+    Raises Cancelled when the run is cancelled and NodeTimeout when the
+    deadline passes, without waiting for `fn` to notice.
+    """
+    parent = _current.get()
+    if parent is not None:
+        parent.check()
+    scope = CancelToken(parent)
+    if timeout is None:
+        timeout = DebugConfig.NODE_TIMEOUT_SECONDS.get(node)
+    outcome: dict[str, Any] = {}
+    done = threading.Event()
+    context = contextvars.copy_context()  # project root, workspace, parent run config
+
+    def scoped() -> T:
+        _current.set(scope)
+        _node.set(node)
+        return fn()
+
+    def target() -> None:
+        try:
+            outcome["value"] = context.run(scoped)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=target, name=f"node-{node}", daemon=True).start()
+    deadline = time.monotonic() + timeout if timeout else None
+    while not done.wait(_WAIT_SLICE):
+        if scope.cancelled:
+            raise Cancelled(scope.reason)
+        if deadline is not None and time.monotonic() >= deadline:
+            scope.cancel(f"{node} timed out after {timeout:.0f}s.")
+            raise NodeTimeout(scope.reason)
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["value"]
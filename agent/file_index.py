@@ -0,0 +1,244 @@
+# agent/file_index.py
+"""
+Incrementally maintained file index behind the `list_files` tool.
+
+Each project root gets one index of relative path -> (size, mtime). The
+first listing walks the tree once, pruning ignored directories (so
+`node_modules/` or `dist/` are never traversed). Later listings only re-read
+directories whose mtime changed, and `write_file` records its writes
+directly, so listing a large project costs a stat per directory instead of a
+full walk.
+
+Ignore rules are a gitignore-style subset: DebugConfig.LIST_FILES_IGNORE plus
+the project's own `.gitignore` (`#` comments, `!` negation, trailing `/` for
+directories, leading `/` to anchor at the root, `*`/`?`/`**` wildcards).
+"""
+from __future__ import annotations
+
+import fnmatch
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+from typing import Optional
+
+from debug_config import DebugConfig
+
+
+@cache
+def _path_glob(pattern: str) -> re.Pattern[str]:
+    """A glob over relative paths: `*` and `?` stay within one segment, `**` spans any."""
+    out, i = [], 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif pattern[i] in "*?":
+            out.append("[^/]*" if pattern[i] == "*" else "[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            out.append(fnmatch.translate(pattern[i:end + 1])[4:-3])  # the class, unwrapped
+            i = end + 1
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile("".join(out))
+
+
+@dataclass(frozen=True)
+class _Rule:
+    pattern: str
+    negate: bool
+    dir_only: bool
+    anchored: bool
+
+    def matches(self, rel: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if self.anchored:
+            return _path_glob(self.pattern).fullmatch(rel) is not None
+        return fnmatch.fnmatchcase(rel.rsplit("/", 1)[-1], self.pattern)
+
+
+def parse_ignore(lines: list[str]) -> list[_Rule]:
+    rules = []
+    for raw in lines:
+        line = raw.strip()
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        line = line.removeprefix("!")
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        anchored = "/" in line  # gitignore: a slash anywhere but the end anchors the pattern
+        line = line.lstrip("/")
+        if line:
+            rules.append(_Rule(line, negate, dir_only, anchored))
+    return rules
+
+
+def is_ignored(rules: list[_Rule], rel: str, is_dir: bool) -> bool:
+    ignored = False
+    for rule in rules:  # last matching rule wins, as in gitignore
+        if rule.matches(rel, is_dir):
+            ignored = not rule.negate
+    return ignored
+
+
+class FileIndex:
+    """Index of one project root, refreshed per changed directory."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.files: dict[str, tuple[int, float]] = {}
+        self.dir_mtimes: dict[str, int] = {}  # "" is the root
+        self.pruned: set[str] = set()  # ignored directories that were not traversed
+        self.rules: list[_Rule] = []
+        self._gitignore_mtime: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _load_rules(self) -> None:
+        gitignore = self.root / ".gitignore"
+        try:
+            mtime = gitignore.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._gitignore_mtime and self.rules:
+            return
+        lines = list(DebugConfig.LIST_FILES_IGNORE)
+        if mtime is not None:
+            lines += gitignore.read_text(encoding="utf-8", errors="replace").splitlines()
+        self.rules = parse_ignore(lines)
+        if self._gitignore_mtime != mtime:
+            # Different rules: start over.
+            self.files.clear()
+            self.dir_mtimes.clear()
+            self.pruned.clear()
+        self._gitignore_mtime = mtime
+
+    def _scan_dir(self, rel_dir: str) -> None:
+        """(Re)read one directory's entries; new subdirectories are scanned recursively."""
+        path = self.root / rel_dir if rel_dir else self.root
+        prefix = f"{rel_dir}/" if rel_dir else ""
+        try:
+            self.dir_mtimes[rel_dir] = path.stat().st_mtime_ns
+            entries = list(os.scandir(path))
+        except FileNotFoundError:
+            self._forget_dir(rel_dir)
+            return
+        seen_files, seen_dirs = set(), set()
+        for entry in entries:
+            rel = prefix + entry.name
+            if entry.name.startswith(".") and entry.name.endswith(".tmp"):
+                continue  # atomic write in progress
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if is_ignored(self.rules, rel, is_dir):
+                if is_dir:
+                    self.pruned.add(rel)
+                continue
+            if is_dir:
+                seen_dirs.add(rel)
+                if rel not in self.dir_mtimes:
+                    self._scan_dir(rel)
+            elif entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                self.files[rel] = (st.st_size, st.st_mtime)
+                seen_files.add(rel)
+        # Drop entries of this directory that disappeared.
+        gone = [f for f in self.files if f.rpartition("/")[0] == rel_dir and f not in seen_files]
+        for rel in gone:
+            del self.files[rel]
+        gone = [d for d in self.dir_mtimes
+                if d and d.rpartition("/")[0] == rel_dir and d not in seen_dirs]
+        for rel in gone:
+            self._forget_dir(rel)
+
+    def _forget_dir(self, rel_dir: str) -> None:
+        prefix = f"{rel_dir}/"
+        self.dir_mtimes.pop(rel_dir, None)
+        for d in [d for d in self.dir_mtimes if d.startswith(prefix)]:
+            del self.dir_mtimes[d]
+        for f in [f for f in self.files if f.startswith(prefix)]:
+            del self.files[f]
+
+    def refresh(self) -> None:
+        with self._lock:
+            self._load_rules()
+            if not self.dir_mtimes:
+                self._scan_dir("")
+                return
+            for rel_dir, mtime in list(self.dir_mtimes.items()):
+                if rel_dir not in self.dir_mtimes:
+                    continue  # forgotten while refreshing a parent
+                path = self.root / rel_dir if rel_dir else self.root
+                try:
+                    changed = path.stat().st_mtime_ns != mtime
+                except FileNotFoundError:
+                    changed = True
+                if changed:
+                    self._scan_dir(rel_dir)
+
+    def note_write(self, path: Path) -> None:
+        """Record a file the tools just wrote (keeps the index fresh without a rescan)."""
+        with self._lock:
+            if not self.dir_mtimes:
+                return  # not scanned yet; the first listing will see it
+            try:
+                rel = Path(path).relative_to(self.root).as_posix()
+                st = Path(path).stat()
+            except (ValueError, FileNotFoundError):
+                return
+            parts = rel.split("/")
+            for depth in range(1, len(parts)):  # a file inside an ignored directory is ignored too
+                ancestor = "/".join(parts[:depth])
+                if ancestor in self.pruned or is_ignored(self.rules, ancestor, True):
+                    return
+            if not is_ignored(self.rules, rel, False):
+                self.files[rel] = (st.st_size, st.st_mtime)
+
+    def query(
+        self, pattern: Optional[str] = None, max_depth: Optional[int] = None
+    ) -> list[tuple[str, int, float]]:
+        """Sorted (path, size, mtime) for indexed files matching `pattern` within `max_depth`."""
+        self.refresh()
+        with self._lock:
+            items = sorted(self.files.items())
+        out = []
+        for rel, (size, mtime) in items:
+            if max_depth is not None and rel.count("/") >= max_depth:
+                continue
+            if pattern and not _glob_match(rel, pattern):
+                continue
+            out.append((rel, size, mtime))
+        return out
+
+
+def _glob_match(rel: str, pattern: str) -> bool:
+    pattern = pattern.removeprefix("./")
+    if "/" not in pattern:
+        return fnmatch.fnmatchcase(rel.rsplit("/", 1)[-1], pattern)
+    return _path_glob(pattern).fullmatch(rel) is not None
+
+
+_indexes: OrderedDict[str, FileIndex] = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def index_for(root: Path) -> FileIndex:
+    """The shared index for `root` (a few recent roots are kept)."""
+    key = str(Path(root).resolve())
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = FileIndex(Path(key))
+        _indexes.move_to_end(key)
+        while len(_indexes) > DebugConfig.LIST_FILES_INDEX_CACHE:
+            _indexes.popitem(last=False)
+        return index
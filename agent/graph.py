@@ -1,102 +1,328 @@
-from dotenv import load_dotenv
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from langchain.globals import set_debug, set_verbose
 from langchain.tools.render import render_text_description
-from langchain_groq.chat_models import ChatGroq
+from langchain_core.runnables import RunnableConfig
 from langgraph.constants import END
 from langgraph.graph import StateGraph
-from langgraph.prebuilt import create_react_agent
-
-from agent.prompts import architect_prompt, coder_system_prompt, planner_prompt
-from agent.states import CoderState, Plan, TaskPlan
-from agent.tools import get_current_directory, list_files, read_file, write_file
 
-_ = load_dotenv()
+from agent import llm as llms
+from agent.budget import CRITICAL, EXHAUSTED, OK, RunBudget, get_budget
+from agent.cancellation import Cancelled, NodeTimeout, check_cancelled, run_node
+from agent.file_index import index_for
+from agent.profiling import profiled
+from agent.prompts import (
+    architect_prompt,
+    coder_system_prompt,
+    coder_user_prompt,
+    contract_prompt,
+    file_tasks_prompt,
+    planner_prompt,
+    refine_planner_prompt,
+)
+from agent.refine import diff_plans, estimate_savings, remove_files, split_task_plan
+from agent.repair import invoke_structured, prebuild_validators
+from agent.run_state import RunState
+from agent.states import AgentState, CoderState, Contract, ImplementationTask, Plan, TaskPlan
+from agent.tools import get_current_directory, get_project_root, list_files, read_file, write_file
+from agent.validation import validate_project
+from agent.workspace import publish_step
+from debug_config import DebugConfig
 
 set_debug(True)
 set_verbose(True)
 
-llm = ChatGroq(model="openai/gpt-oss-120b")
+# Tools available to the coder agent
+coder_tools = [read_file, write_file, list_files, get_current_directory]
+
+# Structured-output runnables and coder agents are built once, not per call.
+llms.prebuild([Plan, TaskPlan, Contract], coder_tools)
+prebuild_validators([Plan, TaskPlan, Contract])
+
+# Rendered once: the identical system prompt opens every coder call, so the provider can cache it.
+CODER_SYSTEM_PROMPT = coder_system_prompt(tools=render_text_description(coder_tools))
+
+
+def _pick_llm(budget: RunBudget | None):
+    """The main model while the budget is healthy, the cheaper one once it runs low."""
+    if budget is None or budget.level() == OK:
+        return llms.llm
+    budget.model_downgraded = True
+    return llms.cheap_llm
+
+
+def _budget_update(budget: RunBudget | None) -> dict:
+    return {"budget_status": budget.status()} if budget is not None else {}
 
 
-def planner_agent(state: dict) -> dict:
+def planner_agent(state: dict, config: RunnableConfig | None = None) -> dict:
     """Converts user prompt into a structured Plan."""
+    budget = get_budget(config)
     user_prompt = state["user_prompt"]
-    resp = llm.with_structured_output(Plan).invoke(
-        planner_prompt(user_prompt)
-    )
-    if resp is None:
-        raise ValueError("Planner did not return a valid response.")
-    return {"plan": resp}
+    previous_plan: Plan | None = state.get("previous_plan")
+    if previous_plan is not None:
+        prompt = refine_planner_prompt(user_prompt, previous_plan.model_dump_json())
+    else:
+        prompt = planner_prompt(user_prompt)
+    resp = run_node("planner", lambda: invoke_structured(Plan, _pick_llm(budget), prompt))
+    return {"plan": resp, **_budget_update(budget)}
 
 
-def architect_agent(state: dict) -> dict:
+def architect_agent(state: dict, config: RunnableConfig | None = None) -> dict:
     """Creates TaskPlan from Plan."""
+    budget = get_budget(config)
     plan: Plan = state["plan"]
-    resp = llm.with_structured_output(TaskPlan).invoke(
-        architect_prompt(plan=plan.model_dump_json())
-    )
-    if resp is None:
-        raise ValueError("Architect did not return a valid response.")
+    previous_task_plan: TaskPlan | None = state.get("previous_task_plan")
+    if state.get("previous_plan") is not None and previous_task_plan is not None:
+        update = _refine_architect(state, plan, previous_task_plan, budget)
+        return {**update, **_budget_update(budget)}
 
+    resp, report = _architect_tasks(plan, budget)
     resp.plan = plan
-    return {"task_plan": resp}
+    return {"task_plan": resp, **report, **_budget_update(budget)}
+
+
+def _architect_tasks(
+    plan: Plan, budget: RunBudget | None, only_files: list[str] | None = None
+) -> tuple[TaskPlan, dict]:
+    """
+    Tasks for `only_files` (default: every file in the plan), plus the state
+    update reporting a fan-out. Small plans take one TaskPlan call; from
+    ARCHITECT_FANOUT_MIN_FILES files on, a contract call is followed by one
+    call per file, run in parallel.
+    """
+    files = only_files or [f.path for f in plan.files]
+    if len(files) >= DebugConfig.ARCHITECT_FANOUT_MIN_FILES:
+        return _fanout_architect(plan, files, budget)
+    prompt = architect_prompt(plan=plan.model_dump_json(), only_files=only_files)
+    resp = run_node("architect", lambda: invoke_structured(TaskPlan, _pick_llm(budget), prompt))
+    return resp, {}
+
+
+def _fanout_architect(
+    plan: Plan, files: list[str], budget: RunBudget | None
+) -> tuple[TaskPlan, dict]:
+    """
+    Contract first, then each file's tasks in parallel calls sharing it, merged
+    in the contract's build order. A file whose call fails is retried on its
+    own and, failing that, gets one task built from its plan entry and
+    contract, so one bad response never discards the others.
+    """
+    started = time.monotonic()
+    model = _pick_llm(budget)
+    plan_json = plan.model_dump_json()
+    contract = run_node(
+        "architect", lambda: invoke_structured(Contract, model, contract_prompt(plan_json))
+    )
+    contract_json = contract.model_dump_json()
+    retried: list[str] = []
+    fallback: list[str] = []
+    seconds: dict[str, float] = {}
+
+    def expand(path: str) -> list[ImplementationTask]:
+        file_started = time.monotonic()
+        prompt = file_tasks_prompt(plan_json, contract_json, path)
+        try:
+            for attempt in range(1 + DebugConfig.ARCHITECT_FILE_RETRIES):
+                if attempt:
+                    retried.append(path)
+                try:
+                    resp = run_node("architect", lambda: invoke_structured(TaskPlan, model, prompt))
+                except NodeTimeout:
+                    break  # a retry would wait just as long
+                except Cancelled:
+                    raise
+                except Exception:
+                    # Not even a correction prompt gave valid tasks: ask again for this file only
+                    continue
+                steps = [s for s in resp.implementation_steps if _same_path(s.filepath, path)]
+                if steps:
+                    for step in steps:
+                        step.filepath = path
+                    return steps
+            fallback.append(path)
+            return [_contract_task(plan, contract, path)]
+        finally:
+            seconds[path] = time.monotonic() - file_started
+
+    workers = min(len(files), DebugConfig.ARCHITECT_FANOUT_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Each call gets its own copy of the context: project root, cancel token, run config.
+        futures = {path: pool.submit(contextvars.copy_context().run, expand, path)
+                   for path in files}
+        per_file = {path: future.result() for path, future in futures.items()}
 
+    order = [p for p in dict.fromkeys(contract.build_order) if p in per_file]
+    order += [p for p in files if p not in order]
+    task_plan = TaskPlan(implementation_steps=[step for path in order for step in per_file[path]])
+    report = {
+        "files": len(files),
+        "retried_files": sorted(set(retried)),
+        "fallback_files": sorted(fallback),
+        "slowest_file_seconds": round(max(seconds.values(), default=0.0), 2),
+        "seconds": round(time.monotonic() - started, 2),
+    }
+    return task_plan, {"architect_report": report}
 
-def coder_agent(state: dict) -> dict:
+
+def _same_path(a: str, b: str) -> bool:
+    return a.strip().removeprefix("./") == b.strip().removeprefix("./")
+
+
+def _contract_task(plan: Plan, contract: Contract, path: str) -> ImplementationTask:
+    purpose = next((f.purpose for f in plan.files if f.path == path), "")
+    entry = next((f for f in contract.files if _same_path(f.path, path)), None)
+    description = f"Implement {path}: {purpose}."
+    if entry is not None:
+        if entry.defines:
+            description += " Define exactly: " + "; ".join(entry.defines) + "."
+        if entry.uses:
+            description += " Use from other files: " + "; ".join(entry.uses) + "."
+    description += f" Data flow: {contract.data_flow}"
+    return ImplementationTask(filepath=path, task_description=description)
+
+
+def _refine_architect(
+    state: dict, plan: Plan, previous_task_plan: TaskPlan, budget: RunBudget | None
+) -> dict:
+    """Schedules coder work only for files the revised plan adds or changes, features included."""
+    diff = diff_plans(state["previous_plan"], plan, previous_task_plan)
+    affected = diff.affected_files
+    remove_files(get_project_root(), diff.removed_files)
+
+    scheduled = TaskPlan(implementation_steps=[])
+    architect_update: dict = {}
+    if affected:
+        resp, architect_update = _architect_tasks(plan, budget, only_files=affected)
+        scheduled, _ = split_task_plan(resp, affected)
+
+    untouched = [f for f in diff.unchanged_files if f not in affected]
+    kept, _ = split_task_plan(previous_task_plan, untouched)
+    task_plan = TaskPlan(
+        implementation_steps=kept.implementation_steps + scheduled.implementation_steps
+    )
+    task_plan.plan = plan
+
+    system_prompt_chars = len(CODER_SYSTEM_PROMPT)
+    report = {
+        "files_total": len(plan.files),
+        "files_regenerated": len(affected),
+        "files_removed": len(diff.removed_files),
+        "steps_scheduled": len(scheduled.implementation_steps),
+        **estimate_savings(get_project_root(), kept, system_prompt_chars),
+    }
+    return {
+        "task_plan": task_plan,
+        "coder_state": CoderState(task_plan=scheduled),
+        "plan_diff": diff,
+        "refine_report": report,
+        **architect_update,
+    }
+
+
+def coder_agent(state: dict, config: RunnableConfig | None = None) -> dict:
     """LangGraph tool-using coder agent."""
+    budget = get_budget(config)
     coder_state: CoderState = state.get("coder_state")
     if coder_state is None:
         coder_state = CoderState(task_plan=state["task_plan"], current_step_idx=0)
 
     steps = coder_state.task_plan.implementation_steps
     if coder_state.current_step_idx >= len(steps):
-        return {"coder_state": coder_state, "status": "DONE"}
+        return {"coder_state": coder_state, "status": "DONE", **_budget_update(budget)}
 
     current_task = steps[coder_state.current_step_idx]
-    
-    # Define the tools available to the coder agent
-    coder_tools = [read_file, write_file, list_files, get_current_directory]
-
-    # Render the tool descriptions into a string that the LLM can understand.
-    # This is the crucial step that solves the problem.
-    tool_description_string = render_text_description(coder_tools)
-
-    # Update the system prompt to include the precise tool descriptions.
-    system_prompt = coder_system_prompt(tools=tool_description_string)
-
-    # Read existing file content *after* defining tools, to keep logic clean.
-    existing_content = read_file.run(current_task.filepath)
-
-    user_prompt = (
-        f"Here is the task you must perform:\n"
-        f"Task: {current_task.task_description}\n"
-        f"File to modify: {current_task.filepath}\n\n"
-        f"Here is the current content of that file:\n"
-        f"---BEGIN CURRENT CONTENT---\n{existing_content}\n---END CURRENT CONTENT---\n\n"
-        "Use the provided tools to accomplish the task by writing the complete, final content to the file."
+
+    if budget is not None:
+        level = budget.level()
+        if level == EXHAUSTED:
+            # Stop cleanly: everything written so far stays as partial output.
+            budget.stopped_early = True
+            budget.skipped_steps.extend(s.filepath for s in steps[coder_state.current_step_idx:])
+            coder_state.current_step_idx = len(steps)
+            return {"coder_state": coder_state, "status": "DONE", **_budget_update(budget)}
+        if level == CRITICAL and current_task.optional:
+            budget.skipped_steps.append(current_task.filepath)
+            coder_state.current_step_idx += 1
+            return {"coder_state": coder_state, **_budget_update(budget)}
+
+    # Stable prefix first (system prompt, plan, file list), this step's file and task last.
+    plan: Plan | None = state.get("plan")
+    files = [rel for rel, _, _ in index_for(get_project_root()).query()]
+    user_prompt = coder_user_prompt(
+        plan=plan.model_dump_json() if plan is not None else "",
+        files=files[:DebugConfig.LIST_FILES_PAGE_SIZE],
+        filepath=current_task.filepath,
+        task=current_task.task_description,
+        content=read_file.run(current_task.filepath),
     )
 
-    react_agent = create_react_agent(llm, coder_tools)
+    react_agent = llms.react_agent(coder_tools, _pick_llm(budget))
 
-    react_agent.invoke({"messages": [{"role": "system", "content": system_prompt},
-                                     {"role": "user", "content": user_prompt}]})
+    try:
+        messages = [{"role": "system", "content": CODER_SYSTEM_PROMPT},
+                    {"role": "user", "content": user_prompt}]
+        run_node("coder", lambda: react_agent.invoke({"messages": messages}))
+    except NodeTimeout:
+        # The file keeps its last complete version; the validator may still re-queue it.
+        if budget is not None:
+            budget.skipped_steps.append(current_task.filepath)
+    publish_step()  # the preview shows each finished file, never a half-written one
 
     coder_state.current_step_idx += 1
-    return {"coder_state": coder_state}
+    return {"coder_state": coder_state, **_budget_update(budget)}
+
+
+def validator_agent(state: dict, config: RunnableConfig | None = None) -> dict:
+    """Runs local static checks and re-queues only the failing files to the coder."""
+    budget = get_budget(config)
+    check_cancelled()  # a cancelled run must not queue repair rounds
+    issues = validate_project(get_project_root())
+    attempts = state.get("validation_attempts", 0)
+    out_of_budget = budget is not None and budget.level() in (CRITICAL, EXHAUSTED)
+    if not issues or attempts >= DebugConfig.VALIDATION_MAX_RETRIES or out_of_budget:
+        return {"validation_issues": issues, "status": "DONE", **_budget_update(budget)}
+
+    coder_state: CoderState = state["coder_state"]
+    for filepath, problems in issues.items():
+        diagnostics = "\n".join(f"- {p}" for p in problems)
+        coder_state.task_plan.implementation_steps.append(
+            ImplementationTask(
+                filepath=filepath,
+                task_description=(
+                    "Static validation found these problems in this file. Fix them, keeping "
+                    "everything else intact, and write the complete corrected file:\n"
+                    f"{diagnostics}"
+                ),
+            )
+        )
+    return {
+        "coder_state": coder_state,
+        "validation_issues": issues,
+        "validation_attempts": attempts + 1,
+        "status": "REPAIR",
+    }
 
 
 # Define the graph structure
-graph = StateGraph(dict)
+graph = StateGraph(AgentState)
 
-graph.add_node("planner", planner_agent)
-graph.add_node("architect", architect_agent)
-graph.add_node("coder", coder_agent)
+graph.add_node("planner", profiled("planner")(planner_agent))
+graph.add_node("architect", profiled("architect")(architect_agent))
+graph.add_node("coder", profiled("coder")(coder_agent))
+graph.add_node("validator", profiled("validator")(validator_agent))
 
 graph.add_edge("planner", "architect")
 graph.add_edge("architect", "coder")
 graph.add_conditional_edges(
     "coder",
-    lambda s: END if s.get("status") == "DONE" else "coder",
+    lambda s: "validator" if s.get("status") == "DONE" else "coder",
+)
+graph.add_conditional_edges(
+    "validator",
+    lambda s: "coder" if s.get("status") == "REPAIR" else END,
 )
 
 graph.set_entry_point("planner")
@@ -105,5 +331,5 @@ agent = graph.compile()
 
 if __name__ == "__main__":
     result = agent.invoke({"user_prompt": "Build a colourful modern todo app in html css and js"},
-                          {"recursion_limit": 100})
-    print("Final State:", result)
+                          RunBudget().run_config(recursion_limit=100))
+    print(RunState.from_graph(result).summary())
@@ -0,0 +1,223 @@
+# agent/hedging.py
+"""
+Opt-in request hedging for provider calls (DebugConfig.HEDGE_ENABLED).
+
+`HedgedChatModel` wraps a chat model. Each call goes to the primary model.
+If no answer has arrived after the node's hedge delay, a second identical
+request is sent, to the same model or, with HEDGE_TO_FALLBACK, to the fallback
+model. The first valid response wins. The hedge delay is the
+HEDGE_PERCENTILE latency of that node's recent calls, so only the slow tail
+is hedged. Hedging waits until a node has HEDGE_MIN_SAMPLES calls on record,
+and it is capped by a budget of HEDGE_BUDGET_FRACTION of the calls in the
+last minute, so it cannot double the request rate against the provider's
+limits.
+
+Hedging happens per LLM call, never per coder step, so tool calls (file
+writes) are never duplicated. A losing request that has not started is
+cancelled outright. One already on the wire cannot be aborted from another
+thread, so it is abandoned: it finishes in the background on the pooled
+client, its answer is discarded, and its tokens are counted as hedge overhead
+in `hedge_metrics()`. The provider bills them all the same, so they are also
+charged to the call's RunBudget, and through it to the tenant's quota (a
+loser that answers after its run has finished is only counted here).
+"""
+from __future__ import annotations
+
+import contextvars
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult, LLMResult
+
+from agent.budget import RunBudget
+from agent.cancellation import current_node
+from debug_config import DebugConfig
+
+_BUDGET_WINDOW = 60.0  # seconds the hedge budget looks back
+
+
+class HedgeStats:
+    """Per-node latency samples (for the hedge delay) and hedge counters."""
+
+    def __init__(self) -> None:
+        self.latencies: dict[str, deque[float]] = defaultdict(
+            lambda: deque(maxlen=DebugConfig.HEDGE_WINDOW)
+        )
+        self.counters: dict[str, dict[str, int]] = defaultdict(
+            lambda: {"calls": 0, "hedged": 0, "hedge_wins": 0, "wasted_tokens": 0}
+        )
+        self._recent_calls: deque[float] = deque()
+        self._recent_hedges: deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def observe(self, node: str, seconds: float) -> None:
+        with self._lock:
+            self.latencies[node].append(seconds)
+
+    def delay(self, node: str) -> Optional[float]:
+        """Seconds to wait before hedging a call in `node`; None until enough samples exist."""
+        with self._lock:
+            samples = sorted(self.latencies[node])
+        if len(samples) < DebugConfig.HEDGE_MIN_SAMPLES:
+            return None
+        rank = max(0, math.ceil(DebugConfig.HEDGE_PERCENTILE / 100 * len(samples)) - 1)
+        return max(DebugConfig.HEDGE_MIN_DELAY_SECONDS, samples[rank])
+
+    def start_call(self, node: str) -> None:
+        with self._lock:
+            self.counters[node]["calls"] += 1
+            self._recent_calls.append(time.monotonic())
+
+    def try_hedge(self, node: str) -> bool:
+        """Spend one unit of the hedge budget; False when the budget is used up."""
+        now = time.monotonic()
+        with self._lock:
+            for recent in (self._recent_calls, self._recent_hedges):
+                while recent and recent[0] < now - _BUDGET_WINDOW:
+                    recent.popleft()
+            allowed = max(1, int(DebugConfig.HEDGE_BUDGET_FRACTION * len(self._recent_calls)))
+            if len(self._recent_hedges) >= allowed:
+                return False
+            self._recent_hedges.append(now)
+            self.counters[node]["hedged"] += 1
+            return True
+
+    def record(self, node: str, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[node][key] += amount
+
+    def report(self) -> dict[str, Any]:
+        with self._lock:
+            nodes = {node: dict(c) for node, c in self.counters.items()}
+        for node, c in nodes.items():
+            c["hedge_rate"] = round(c["hedged"] / c["calls"], 3) if c["calls"] else None
+            c["win_rate"] = round(c["hedge_wins"] / c["hedged"], 3) if c["hedged"] else None
+            delay = self.delay(node)
+            c["hedge_delay_seconds"] = round(delay, 2) if delay is not None else None
+        return nodes
+
+
+hedge_stats = HedgeStats()
+# Abandoned losers keep their thread until the provider answers (bounded by the request timeout).
+_pool = ThreadPoolExecutor(max_workers=DebugConfig.HEDGE_MAX_THREADS,
+                           thread_name_prefix="llm-hedge")
+
+
+def _tokens(result: ChatResult) -> int:
+    usage = (result.llm_output or {}).get("token_usage") or {}
+    return int(usage.get("prompt_tokens") or 0) + int(usage.get("completion_tokens") or 0)
+
+
+def _budgets(run_manager: Any) -> list[RunBudget]:
+    """The RunBudgets among a call's callback handlers."""
+    handlers = [*getattr(run_manager, "handlers", []),
+                *getattr(run_manager, "inheritable_handlers", [])]
+    return list({id(h): h for h in handlers if isinstance(h, RunBudget)}.values())
+
+
+def _charge_waste(node: str, budgets: list[RunBudget], result: ChatResult) -> None:
+    hedge_stats.record(node, "wasted_tokens", _tokens(result))
+    for budget in budgets:
+        budget.on_llm_end(LLMResult(generations=[result.generations],
+                                    llm_output=result.llm_output))
+
+
+def _count_waste(node: str, budgets: list[RunBudget]):
+    def done(future: Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            _charge_waste(node, budgets, future.result())
+    return done
+
+
+def _valid(result: ChatResult, kwargs: dict[str, Any]) -> bool:
+    """A response is usable if it has a message, and tool calls when the request forced one."""
+    if not result.generations:
+        return False
+    forced = kwargs.get("tool_choice") not in (None, "auto", "none")
+    return not forced or bool(getattr(result.generations[0].message, "tool_calls", None))
+
+
+class HedgedChatModel(BaseChatModel):
+    """A chat model that sends a second request when the first is slower than the node's tail."""
+
+    primary: BaseChatModel
+    hedge: Optional[BaseChatModel] = None  # defaults to the primary model
+
+    @property
+    def _llm_type(self) -> str:
+        return f"hedged-{self.primary._llm_type}"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {"primary": self.primary._identifying_params,
+                "hedge": (self.hedge or self.primary)._identifying_params}
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> Any:
+        # Let the wrapped model format the tools; its kwargs are passed through to both requests.
+        return self.bind(**self.primary.bind_tools(tools, **kwargs).kwargs)
+
+    def _timed(self, model: BaseChatModel, node: str, messages: list[BaseMessage],
+               stop: Optional[list[str]], kwargs: dict[str, Any]) -> ChatResult:
+        started = time.monotonic()
+        result = model._generate(messages, stop=stop, **kwargs)
+        hedge_stats.observe(node, time.monotonic() - started)
+        return result
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        node = current_node() or "other"
+        hedge_stats.start_call(node)
+        delay = hedge_stats.delay(node)
+        if delay is None:
+            return self._timed(self.primary, node, messages, stop, kwargs)
+
+        def submit(model: BaseChatModel) -> Future:
+            context = contextvars.copy_context()
+            return _pool.submit(context.run, self._timed, model, node, messages, stop, kwargs)
+
+        first = submit(self.primary)
+        done, _ = wait([first], timeout=delay)
+        if done or not hedge_stats.try_hedge(node):
+            return first.result()
+
+        second = submit(self.hedge or self.primary)
+        budgets = _budgets(run_manager)
+        pending = {first, second}
+        invalid: list[Future] = []
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                result = future.result()
+                if not _valid(result, kwargs):
+                    invalid.append(future)
+                    continue
+                if future is second:
+                    hedge_stats.record(node, "hedge_wins")
+                for loser in invalid:
+                    _charge_waste(node, budgets, loser.result())
+                for loser in pending:
+                    if not loser.cancel():  # already on the wire: count what it costs
+                        loser.add_done_callback(_count_waste(node, budgets))
+                return result
+        # No valid answer: raise, or let the caller's parser complain about the first one
+        for future in invalid:
+            if error is not None or future is not first:
+                _charge_waste(node, budgets, future.result())
+        if error is not None:
+            raise error
+        return first.result()
+
+
+def hedge_metrics() -> dict[str, Any]:
+    """Per-node calls, hedge rate and win rate, current hedge delay and tokens spent on losers."""
+    return {"enabled": DebugConfig.HEDGE_ENABLED, "nodes": hedge_stats.report()}
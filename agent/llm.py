@@ -0,0 +1,178 @@
+# agent/llm.py
+"""
+LLM clients shared by every node.
+
+All ChatGroq instances send their requests through one pooled, keep-alive
+httpx client, so connections (and their TLS sessions) are reused across the
+planner, architect and coder instead of being set up per call. Structured-output
+runnables are built once per (model, schema) and the coder's ReAct agent once
+per model. `warm_up()` opens a pooled connection ahead of the first real
+request; `connection_metrics()` reports reuse rate and connect/TLS times.
+
+The client's transport routes every request to one of the configured
+backends, the least-loaded healthy (API key, endpoint) pair (see
+agent.backends). `backend_metrics()` reports their load and health.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Optional
+
+import httpx
+from dotenv import load_dotenv
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.runnables import Runnable
+from langchain_groq.chat_models import ChatGroq
+from langgraph.prebuilt import create_react_agent
+
+from agent.backends import BackendPool, RoutingTransport
+from debug_config import DebugConfig
+
+_ = load_dotenv()
+
+
+class ConnectionStats:
+    """Counts requests and fresh connections from httpcore trace events."""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.new_connections = 0
+        self.connect_seconds = 0.0
+        self.tls_seconds = 0.0
+        self.warm_up_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def on_request(self, request: httpx.Request) -> None:
+        """httpx request hook: attach a per-request tracer."""
+        started: dict[str, float] = {}
+
+        def trace(event: str, info: dict) -> None:
+            step, _, phase = event.rpartition(".")
+            if phase == "started":
+                started[step] = time.perf_counter()
+                return
+            if phase != "complete" or step not in started:
+                return
+            elapsed = time.perf_counter() - started.pop(step)
+            with self._lock:
+                if step == "connection.connect_tcp":
+                    self.new_connections += 1
+                    self.connect_seconds += elapsed
+                elif step == "connection.start_tls":
+                    self.tls_seconds += elapsed
+
+        request.extensions["trace"] = trace
+        with self._lock:
+            self.requests += 1
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            reused = max(0, self.requests - self.new_connections)
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": reused,
+                "reuse_rate": round(reused / self.requests, 3) if self.requests else None,
+                "avg_connect_ms": round(1000 * self.connect_seconds / self.new_connections, 1)
+                if self.new_connections else None,
+                "avg_tls_ms": round(1000 * self.tls_seconds / self.new_connections, 1)
+                if self.new_connections else None,
+                "warm_up_ms": round(1000 * self.warm_up_seconds, 1)
+                if self.warm_up_seconds is not None else None,
+            }
+
+
+connection_stats = ConnectionStats()
+
+backend_pool = BackendPool()
+
+# One keep-alive pool for every provider call in this process.
+_transport = httpx.HTTPTransport(
+    limits=httpx.Limits(
+        max_connections=DebugConfig.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=DebugConfig.HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=DebugConfig.HTTP_KEEPALIVE_EXPIRY,
+    ),
+)
+_timeout = httpx.Timeout(DebugConfig.HTTP_READ_TIMEOUT, connect=DebugConfig.HTTP_CONNECT_TIMEOUT)
+http_client = httpx.Client(
+    transport=RoutingTransport(backend_pool, _transport),
+    timeout=_timeout,
+    event_hooks={"request": [connection_stats.on_request]},
+)
+# Warm-up and health probes address one backend each, over the same connections.
+backend_pool.probe_client = httpx.Client(
+    transport=_transport, timeout=_timeout, event_hooks={"request": [connection_stats.on_request]}
+)
+
+# The transport sets each request's key; the SDK only needs one to construct.
+_sdk_key = backend_pool.backends[0].api_key or None
+# request_timeout bounds each LLM call; node deadlines (agent.cancellation) bound the whole node.
+llm = ChatGroq(model=DebugConfig.DEFAULT_MODEL, http_client=http_client, api_key=_sdk_key,
+               request_timeout=DebugConfig.TIMEOUT_SECONDS)
+cheap_llm = ChatGroq(model=DebugConfig.FALLBACK_MODEL, http_client=http_client, api_key=_sdk_key,
+                     request_timeout=DebugConfig.TIMEOUT_SECONDS)
+
+if DebugConfig.HEDGE_ENABLED:
+    from agent.hedging import HedgedChatModel
+
+    _main, _fallback = llm, cheap_llm
+    llm = HedgedChatModel(primary=_main, hedge=_fallback if DebugConfig.HEDGE_TO_FALLBACK else None)
+    cheap_llm = HedgedChatModel(primary=_fallback)
+
+_structured: dict[tuple[int, type], tuple[BaseChatModel, Runnable]] = {}
+_react_agents: dict[tuple[int, int], tuple[BaseChatModel, Runnable]] = {}
+_cache_lock = threading.Lock()
+
+
+def structured(schema: type, model: Optional[BaseChatModel] = None) -> Runnable:
+    """
+    The prebuilt `model.with_structured_output(schema, include_raw=True)`
+    runnable: it returns `{"raw", "parsed", "parsing_error"}` so a failed
+    parse can be repaired (agent/repair.py) instead of discarded.
+    """
+    model = model or llm
+    key = (id(model), schema)
+    with _cache_lock:
+        if key not in _structured:
+            _structured[key] = (model, model.with_structured_output(schema, include_raw=True))
+        return _structured[key][1]
+
+
+def react_agent(tools: list, model: Optional[BaseChatModel] = None) -> Runnable:
+    """The prebuilt ReAct agent for `model` with `tools` bound."""
+    model = model or llm
+    key = (id(model), id(tools))
+    with _cache_lock:
+        if key not in _react_agents:
+            _react_agents[key] = (model, create_react_agent(model, tools))
+        return _react_agents[key][1]
+
+
+def prebuild(schemas: list[type], tools: list) -> None:
+    """Build the structured-output runnables and coder agents for both models up front."""
+    for model in (llm, cheap_llm):
+        for schema in schemas:
+            structured(schema, model)
+        react_agent(tools, model)
+
+
+def warm_up() -> bool:
+    """Open a pooled (TLS) connection to every backend before the first real request."""
+    started = time.perf_counter()
+    healthy = [backend_pool.probe(backend) for backend in backend_pool.backends]
+    if not any(healthy):
+        return False
+    connection_stats.warm_up_seconds = time.perf_counter() - started
+    return True
+
+
+def connection_metrics() -> dict[str, Any]:
+    """Connection-level metrics for the shared provider pool."""
+    return connection_stats.snapshot()
+
+
+def backend_metrics() -> list[dict[str, Any]]:
+    """Load, health, errors and latency per backend (API key / endpoint)."""
+    return backend_pool.snapshot()
@@ -0,0 +1,571 @@
+# agent/optimizer.py
+"""
+Optional build stage for a finished site (DebugConfig.OPTIMIZE_BUILD, or
+`"optimize": true` per job).
+
+It runs on the staged tree before it is published and zipped, in this order:
+
+1. relink: a page references a missing stylesheet or script, and exactly one
+   file of that type is unreferenced (the coder wrote `app.js`, the page
+   loads `script.js`). The page is pointed at that file.
+2. bundle: a page's consecutive local stylesheets become one file.
+3. dedupe: files with identical content are served under one name.
+4. prune: stylesheets, scripts, images and fonts that no page reaches are
+   removed. A page can reach a file directly or through a reached CSS/JS
+   file. A file counts as reached if its name appears there, which errs on
+   the side of keeping it.
+5. minify: CSS, JS and HTML, stdlib only. The minifiers are conservative.
+   JS keeps its line breaks, so automatic semicolon insertion is
+   unaffected. HTML whitespace is collapsed, never removed. Comments go,
+   except `/*! ... */` licences and conditional comments. A file whose
+   minified form fails the validator's checks where the original passed is
+   left as it was.
+6. defer: external classic scripts get `defer` when nothing on the page
+   could depend on them running during parsing.
+
+Scripts are never concatenated. Joining classic scripts can change their
+meaning: a leading 'use strict' would apply to all of them, and a syntax
+error in one would stop the others. `optimize_site()` returns a report with
+the page weight (bytes, gzip bytes, requests) before and after.
+
+    python -m agent.optimizer generated_site [--dry-run]
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import hashlib
+import json
+import posixpath
+import re
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Optional
+from urllib.parse import unquote, urlsplit
+
+from agent.validation import check_css, check_js
+from agent.workspace import atomic_write_text
+
+_PAGE_SUFFIXES = (".html", ".htm")
+_STYLE_SUFFIXES = (".css",)
+_SCRIPT_SUFFIXES = (".js", ".mjs")
+_ASSET_SUFFIXES = (
+    *_STYLE_SUFFIXES, *_SCRIPT_SUFFIXES,
+    ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".avif", ".ico",
+    ".woff", ".woff2", ".ttf", ".otf", ".eot",
+)
+_TEXT_SUFFIXES = (
+    *_PAGE_SUFFIXES, *_STYLE_SUFFIXES, *_SCRIPT_SUFFIXES, ".svg", ".json", ".webmanifest",
+)
+_EXTERNAL_PREFIXES = (
+    "http:", "https:", "//", "data:", "mailto:", "tel:", "javascript:", "#", "blob:",
+)
+_JS_TYPES = ("", "text/javascript", "application/javascript", "module")
+
+_HTML_TOKENS = re.compile(
+    r"<!--.*?-->|<(script|style|pre|textarea)\b[^>]*>.*?</\1\s*>|<[^>]*>|[^<]+|<", re.S | re.I
+)
+_TAG_NAME = re.compile(r"<\s*([a-zA-Z][\w-]*)")
+_ATTR = re.compile(r"""\s([\w:-]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>"']+)))?""")
+_REF_ATTR = re.compile(r"""(\s(?:href|src)\s*=\s*)(?:"([^"]*)"|'([^']*)'|([^\s>"']+))""", re.I)
+_CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)|@import\s+(['"])([^'"]+)\3""", re.I)
+_REGEX_PRECEDERS = "(,=:[!&|?{};+-*%<>~^"
+_REGEX_KEYWORDS = re.compile(
+    r"\b(?:return|typeof|case|do|else|in|of|void|yield|await|delete|throw|new)\s*$"
+)
+
+
+# --- tokenizers ---------------------------------------------------------------
+def _segments(source: str, *, js: bool) -> Optional[list[tuple[str, str]]]:
+    """
+    Split source into ("code" | "literal" | "comment", text) segments, or None
+    when it cannot be tokenized with confidence (then it is left alone).
+    """
+    out: list[tuple[str, str]] = []
+    i = start = 0
+    n = len(source)
+    prev = ""
+
+    def take(kind: str, end: int) -> None:
+        nonlocal i, start
+        if i > start:
+            out.append(("code", source[start:i]))
+        out.append((kind, source[i:end]))
+        i = start = end
+
+    while i < n:
+        ch = source[i]
+        if js and source.startswith("//", i):
+            end = source.find("\n", i)
+            take("comment", n if end == -1 else end)
+            continue
+        if source.startswith("/*", i):
+            end = source.find("*/", i + 2)
+            if end == -1:
+                return None
+            take("comment", end + 2)
+            continue
+        if ch in "'\"" or (js and ch == "`"):
+            j = i + 1
+            while j < n and source[j] != ch:
+                if source[j] == "\\":
+                    j += 1
+                elif source[j] == "\n" and ch != "`":
+                    break
+                elif ch == "`" and source.startswith("${", j):
+                    return None  # nested expressions may hold backticks: not worth the risk
+                j += 1
+            if j >= n or source[j] != ch:
+                return None
+            take("literal", j + 1)
+            prev = ch
+            continue
+        if js and ch == "/" and (not prev or prev in _REGEX_PRECEDERS
+                                 or _REGEX_KEYWORDS.search(source, max(0, i - 12), i)):
+            j, in_class = i + 1, False
+            while j < n and source[j] != "\n":
+                c = source[j]
+                if c == "\\":
+                    j += 1
+                elif c == "[":
+                    in_class = True
+                elif c == "]":
+                    in_class = False
+                elif c == "/" and not in_class:
+                    break
+                j += 1
+            if j < n and source[j] == "/":
+                j += 1
+                while j < n and (source[j].isalnum() or source[j] == "_"):  # flags
+                    j += 1
+                take("literal", j)
+                prev = "/"
+                continue
+        if not ch.isspace():
+            prev = ch
+        i += 1
+    if n > start:
+        out.append(("code", source[start:]))
+    return out
+
+
+def _join(segments: list[tuple[str, str]], squeeze: Callable[[str], str]) -> str:
+    """Drop comments (keeping /*! licences), merge the code around them and squeeze it."""
+    merged: list[tuple[str, str]] = []
+    for kind, text in segments:
+        if kind == "comment":
+            if text.startswith("/*!"):
+                kind = "literal"
+            else:
+                kind, text = "code", ("\n" if "\n" in text or text.startswith("//") else " ")
+        if kind == "code" and merged and merged[-1][0] == "code":
+            merged[-1] = ("code", merged[-1][1] + text)
+        else:
+            merged.append((kind, text))
+    return "".join(squeeze(text) if kind == "code" else text for kind, text in merged).strip()
+
+
+# --- minifiers ----------------------------------------------------------------
+def _squeeze_css(code: str) -> str:
+    code = re.sub(r"\s+", " ", code)
+    # Never around ':' before a selector (`a :hover` != `a:hover`) or '+'/'-' (calc()).
+    code = re.sub(r" ?([{};,>]) ?", r"\1", code)
+    code = re.sub(r": ", ":", code)
+    return code.replace(";}", "}")
+
+
+def _squeeze_js(code: str) -> str:
+    code = re.sub(r"[ \t\r\f\v]*\n\s*", "\n", code)  # line breaks stay: ASI must see them
+    code = re.sub(r"[ \t\r\f\v]+", " ", code)
+    if "<!--" in code or "-->" in code:
+        return code  # HTML-like comments in the source: only whitespace is safe to touch
+    code = re.sub(r" ?([{}()\[\];,=:<>!?&|*^%~]) ?", r"\1", code)
+    # `a < !--b` and `a-- > b` must not become `<!--` / `-->`, which start a comment.
+    return code.replace("<!--", "<! --").replace("-->", "-- >")
+
+
+def minify_css(source: str) -> str:
+    segments = _segments(source, js=False)
+    if segments is None:
+        return source
+    out = _join(segments, _squeeze_css)
+    return out if len(check_css(out)) <= len(check_css(source)) else source
+
+
+def minify_js(source: str) -> str:
+    segments = _segments(source, js=True)
+    if segments is None:
+        return source
+    out = _join(segments, _squeeze_js)
+    return out if len(check_js(out)) <= len(check_js(source)) else source
+
+
+def minify_html(source: str) -> str:
+    out: list[str] = []
+    for m in _HTML_TOKENS.finditer(source):
+        token, raw = m.group(0), (m.group(1) or "").lower()
+        if token.startswith("<!--"):
+            if token.startswith("<!--[if") or token.startswith("<!--<!"):
+                out.append(token)  # conditional comments are markup
+        elif raw in ("script", "style"):
+            open_end = token.index(">") + 1
+            close_start = token.lower().rindex("</")
+            body = token[open_end:close_start]
+            attrs = _attrs(token[:open_end])
+            if raw == "style":
+                body = minify_css(body)
+            elif "src" not in attrs and attrs.get("type", "").lower() in _JS_TYPES:
+                body = minify_js(body)
+            out.append(token[:open_end] + body + token[close_start:])
+        elif raw or token.startswith("<"):
+            out.append(token)  # tags, <pre>, <textarea>: verbatim
+        else:
+            out.append(re.sub(r"\s+", lambda w: "\n" if "\n" in w.group(0) else " ", token))
+    return "".join(out).strip() + "\n"
+
+
+_MINIFIERS: dict[str, Callable[[str], str]] = {
+    **dict.fromkeys(_STYLE_SUFFIXES, minify_css),
+    **dict.fromkeys(_SCRIPT_SUFFIXES, minify_js),
+    **dict.fromkeys(_PAGE_SUFFIXES, minify_html),
+}
+
+
+# --- references ---------------------------------------------------------------
+def _attrs(tag: str) -> dict[str, str]:
+    name = _TAG_NAME.match(tag)
+    return {m.group(1).lower(): next((g for g in m.groups()[1:] if g is not None), "")
+            for m in _ATTR.finditer(tag, name.end() if name else 0)}
+
+
+def _tag_name(token: str) -> str:
+    m = _TAG_NAME.match(token)
+    return m.group(1).lower() if m else ""
+
+
+def _resolve(ref: str, base_dir: str) -> Optional[str]:
+    """Root-relative path of a local reference from a file in `base_dir`, or None."""
+    ref = ref.strip()
+    if not ref or ref.lower().startswith(_EXTERNAL_PREFIXES):
+        return None
+    path = unquote(urlsplit(ref).path)
+    if not path:
+        return None
+    full = posixpath.normpath(
+        path.lstrip("/") if path.startswith("/") else posixpath.join(base_dir, path)
+    )
+    return None if full.startswith("..") else full
+
+
+def _relative(target: str, base_dir: str) -> str:
+    return posixpath.relpath(target, base_dir or ".")
+
+
+def _page_refs(html: str, page_dir: str) -> list[tuple[str, str, dict[str, str]]]:
+    """(tag, root-relative path, attributes) for each local href/src in a page."""
+    refs = []
+    for m in _HTML_TOKENS.finditer(html):
+        token = m.group(0)
+        if not token.startswith("<") or token.startswith("<!--"):
+            continue
+        open_tag = token[: token.index(">") + 1] if ">" in token else token
+        attrs = _attrs(open_tag)
+        for name in ("href", "src"):
+            target = _resolve(attrs.get(name, ""), page_dir) if name in attrs else None
+            if target:
+                refs.append((_tag_name(open_tag), target, attrs))
+    return refs
+
+
+def _rewrite_refs(html: str, page_dir: str, mapping: dict[str, str]) -> str:
+    """Point href/src attributes at new root-relative paths (`mapping`: old -> new)."""
+    def attr(m: re.Match[str]) -> str:
+        value = next(g for g in m.groups()[1:] if g is not None)
+        target = _resolve(value, page_dir)
+        if target not in mapping:
+            return m.group(0)
+        return f'{m.group(1)}"{_relative(mapping[target], page_dir)}"'
+
+    def token(m: re.Match[str]) -> str:
+        text = m.group(0)
+        if not text.startswith("<") or text.startswith("<!--"):
+            return text
+        end = text.index(">") + 1 if ">" in text else len(text)
+        return _REF_ATTR.sub(attr, text[:end]) + text[end:]
+
+    return _HTML_TOKENS.sub(token, html)
+
+
+# --- the build ----------------------------------------------------------------
+class _Site:
+    def __init__(self, root: Path):
+        self.root = root
+        self.files = sorted(p.relative_to(root).as_posix() for p in root.rglob("*")
+                            if p.is_file() and not p.name.startswith("."))
+        self._text: dict[str, str] = {}
+
+    def pages(self) -> list[str]:
+        return [f for f in self.files if f.lower().endswith(_PAGE_SUFFIXES)]
+
+    def read(self, rel: str) -> str:
+        if rel not in self._text:
+            self._text[rel] = (self.root / rel).read_text(encoding="utf-8", errors="replace")
+        return self._text[rel]
+
+    def write(self, rel: str, text: str) -> None:
+        # By rename: staged files may be hardlinks into a release
+        atomic_write_text(self.root / rel, text)
+        self._text[rel] = text
+        if rel not in self.files:
+            self.files = sorted([*self.files, rel])
+
+    def remove(self, rel: str) -> None:
+        (self.root / rel).unlink(missing_ok=True)
+        self.files.remove(rel)
+        self._text.pop(rel, None)
+
+    def reachable(self) -> set[str]:
+        """Pages, plus every file whose name a reached page, stylesheet or script mentions."""
+        reached = set(self.pages())
+        frontier = list(reached)
+        while frontier:
+            rel = frontier.pop()
+            text = self.read(rel)
+            base = posixpath.dirname(rel)
+            for other in self.files:
+                if other in reached:
+                    continue
+                mentioned = (rel.lower().endswith(_PAGE_SUFFIXES)
+                             and any(t == other for _, t, _ in _page_refs(text, base)))
+                if mentioned or posixpath.basename(other) in text:
+                    reached.add(other)
+                    if other.lower().endswith(_TEXT_SUFFIXES):
+                        frontier.append(other)
+        return reached
+
+
+def _relink(site: _Site, report: dict[str, Any]) -> None:
+    reached = site.reachable()
+    for page in site.pages():
+        base = posixpath.dirname(page)
+        mapping = {}
+        for _, target, _ in _page_refs(site.read(page), base):
+            suffix = posixpath.splitext(target)[1].lower()
+            if target in site.files or suffix not in (*_STYLE_SUFFIXES, *_SCRIPT_SUFFIXES):
+                continue
+            orphans = [f for f in site.files if f not in reached and f.lower().endswith(suffix)]
+            if len(orphans) == 1:
+                mapping[target] = orphans[0]
+        if mapping:
+            site.write(page, _rewrite_refs(site.read(page), base, mapping))
+            report["relinked"].update({f"{page}: {old}": new for old, new in mapping.items()})
+
+
+def _bundle_styles(site: _Site, report: dict[str, Any]) -> None:
+    for page in site.pages():
+        html, base = site.read(page), posixpath.dirname(page)
+        tokens = [m.group(0) for m in _HTML_TOKENS.finditer(html)]
+        runs: list[list[int]] = []
+        current: list[int] = []
+        for i, token in enumerate(tokens):
+            attrs = _attrs(token) if _tag_name(token) == "link" else {}
+            target = _resolve(attrs.get("href", ""), base) if attrs else None
+            bundleable = (
+                "stylesheet" in attrs.get("rel", "").lower().split()
+                and attrs.get("media", "all").lower() == "all"
+                and "integrity" not in attrs
+                and target in site.files
+            )
+            if bundleable:
+                current.append(i)
+            elif token.strip():  # anything but whitespace ends a run: cascade order must not change
+                if len(current) > 1:
+                    runs.append(current)
+                current = []
+        if len(current) > 1:
+            runs.append(current)
+        changed = False
+        for run in runs:
+            targets = [_resolve(_attrs(tokens[i])["href"], base) for i in run]
+            folder = posixpath.dirname(targets[0])
+            sources = [site.read(t) for t in targets]
+            # url() paths are relative to the stylesheet, and @import/@charset must come first.
+            if any(posixpath.dirname(t) != folder for t in targets) or any(
+                re.search(r"@(import|charset)\b", s, re.I) for s in sources[1:]
+            ):
+                continue
+            content = "\n".join(sources)
+            digest = hashlib.sha256(content.encode()).hexdigest()[:8]
+            name = posixpath.join(folder, f"bundle.{digest}.css")
+            site.write(name, content)
+            tokens[run[0]] = re.sub(r"""href\s*=\s*("[^"]*"|'[^']*'|[^\s>]+)""",
+                                    f'href="{_relative(name, base)}"', tokens[run[0]], count=1)
+            for i in range(run[0] + 1, run[-1] + 1):
+                tokens[i] = ""
+            report["bundled"][name] = targets
+            changed = True
+        if changed:
+            site.write(page, "".join(tokens))
+
+
+def _dedupe(site: _Site, report: dict[str, Any]) -> None:
+    by_hash: dict[str, list[str]] = {}
+    for rel in site.reachable():  # unreached copies are left to _prune
+        if rel.lower().endswith(_ASSET_SUFFIXES):
+            digest = hashlib.sha256((site.root / rel).read_bytes()).hexdigest()
+            by_hash.setdefault(digest, []).append(rel)
+    mapping = {}
+    for same in by_hash.values():
+        keep = min(same, key=lambda r: (len(r), r))
+        mapping.update({other: keep for other in same if other != keep})
+    if not mapping:
+        return
+    for page in site.pages():
+        html = site.read(page)
+        updated = _rewrite_refs(html, posixpath.dirname(page), mapping)
+        if updated != html:
+            site.write(page, updated)
+    report["deduplicated"].update(mapping)
+
+
+def _prune(site: _Site, report: dict[str, Any]) -> None:
+    reached = site.reachable()
+    for rel in list(site.files):
+        if rel not in reached and rel.lower().endswith(_ASSET_SUFFIXES):
+            site.remove(rel)
+            report["removed"].append(rel)
+
+
+def _minify(site: _Site, report: dict[str, Any]) -> None:
+    for rel in site.files:
+        suffix = posixpath.splitext(rel)[1].lower()
+        if suffix not in _MINIFIERS or ".min." in rel.lower():
+            continue
+        before = site.read(rel)
+        after = _MINIFIERS[suffix](before)
+        if len(after) < len(before):
+            site.write(rel, after)
+            report["minified"][rel] = {"before": len(before.encode()), "after": len(after.encode())}
+
+
+def _defer(site: _Site, report: dict[str, Any]) -> None:
+    for page in site.pages():
+        html, base = site.read(page), posixpath.dirname(page)
+        tokens = [m.group(0) for m in _HTML_TOKENS.finditer(html)]
+        candidates = []
+        safe = True
+        for i, token in enumerate(tokens):
+            tag = _tag_name(token)
+            if not tag:
+                continue
+            open_tag = token[: token.index(">") + 1] if ">" in token else token
+            attrs = _attrs(open_tag)
+            if tag != "body" and ("onload" in attrs or "onerror" in attrs):
+                safe = False  # may fire before deferred scripts have run
+            if tag != "script" or attrs.get("type", "").lower() not in _JS_TYPES:
+                continue
+            if "src" not in attrs:
+                safe = False  # inline code may use what the external scripts define
+                continue
+            if attrs.get("type", "").lower() == "module" or "async" in attrs or "defer" in attrs:
+                continue
+            target = _resolve(attrs["src"], base)
+            if target is None or target not in site.files or "document.write" in site.read(target):
+                safe = False  # external, or writes into the document while it is parsed
+                continue
+            candidates.append(i)
+        if not safe or not candidates:
+            continue
+        for i in candidates:
+            tokens[i] = re.sub(r"<script\b", "<script defer", tokens[i], count=1, flags=re.I)
+        site.write(page, "".join(tokens))
+        report["deferred"][page] = len(candidates)
+
+
+def page_weight(root: Path) -> dict[str, Any]:
+    """
+    Bytes, gzip bytes and local requests per page (the page plus everything it
+    references), and totals.
+    """
+    root = Path(root)
+    site = _Site(root)
+    sizes = {rel: ((root / rel).stat().st_size, len(gzip.compress((root / rel).read_bytes(), 9)))
+             for rel in site.files}
+    pages = {}
+    for page in site.pages():
+        refs = {t for tag, t, _ in _page_refs(site.read(page), posixpath.dirname(page))
+                if tag != "a" and t in sizes}
+        loaded = [page, *sorted(refs)]
+        pages[page] = {
+            "bytes": sum(sizes[r][0] for r in loaded),
+            "gzip_bytes": sum(sizes[r][1] for r in loaded),
+            "requests": len(loaded),
+        }
+    return {
+        "files": len(site.files),
+        "bytes": sum(s for s, _ in sizes.values()),
+        "gzip_bytes": sum(g for _, g in sizes.values()),
+        "pages": pages,
+    }
+
+
+def optimize_site(root: Path) -> dict[str, Any]:
+    """Run every build step over the site at `root` in place; returns the report."""
+    root = Path(root)
+    report: dict[str, Any] = {
+        "before": page_weight(root),
+        "relinked": {}, "bundled": {}, "deduplicated": {}, "removed": [], "minified": {},
+        "deferred": {},
+    }
+    site = _Site(root)
+    for step in (_relink, _bundle_styles, _dedupe, _prune, _minify, _defer):
+        step(site, report)
+    report["after"] = page_weight(root)
+    before, after = report["before"]["bytes"], report["after"]["bytes"]
+    report["saved_bytes"] = before - after
+    report["saved_fraction"] = round(1 - after / before, 3) if before else None
+    return report
+
+
+def _requests(weight: dict[str, Any]) -> int:
+    return sum(page["requests"] for page in weight["pages"].values())
+
+
+def summary(report: dict[str, Any]) -> str:
+    """One log line for a build report."""
+    before, after = report["before"], report["after"]
+    line = (
+        f"📦 Build: {before['bytes']:,} → {after['bytes']:,} bytes "
+        f"({before['gzip_bytes']:,} → {after['gzip_bytes']:,} gzipped), "
+        f"{_requests(before)} → {_requests(after)} requests"
+    )
+    extras = [f"{len(report[k])} {label}" for k, label in (
+        ("removed", "unused removed"), ("bundled", "bundles"),
+        ("deduplicated", "duplicates merged"),
+        ("relinked", "references repaired"), ("deferred", "pages with deferred scripts"),
+    ) if report[k]]
+    return line + (" · " + ", ".join(extras) if extras else "")
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Minify, bundle and dedupe a generated site in place")
+    parser.add_argument("root")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Work on a copy and only print the report")
+    args = parser.parse_args()
+    root = Path(args.root)
+    if args.dry_run:
+        with tempfile.TemporaryDirectory() as tmp:
+            copy = Path(tmp) / root.name
+            shutil.copytree(root, copy)
+            report = optimize_site(copy)
+    else:
+        report = optimize_site(root)
+    print(summary(report))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,177 @@
+# agent/profiling.py
+"""
+Opt-in per-node / per-tool memory profiling with tracemalloc.
+
+Graph nodes and tools are wrapped with `profiled(...)`; the wrapper is a plain
+pass-through until the shared profiler is started (DebugConfig.PROFILE_MEMORY
+or `get_profiler().start()`). While running it records, per call, the peak
+traced memory, the net allocation and the top allocation sites taken from a
+snapshot diff. `record_run()` samples traced memory between whole runs so the
+report can flag steady growth across repeated runs.
+
+tracemalloc is process-global, so numbers for calls that overlap in time on
+different threads include each other's allocations.
+"""
+from __future__ import annotations
+
+import functools
+import gc
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from debug_config import DebugConfig
+
+_KB = 1024
+# Keep the profiler's own bookkeeping out of the allocation-site lists.
+_IGNORE = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__))
+
+
+class _Frame:
+    __slots__ = ("peak_so_far",)
+
+    def __init__(self) -> None:
+        self.peak_so_far = 0
+
+
+class MemoryProfiler:
+    """Collects tracemalloc statistics per named node/tool and per run."""
+
+    def __init__(self, top_n: int = 5, frames: int = 10) -> None:
+        self.top_n = top_n
+        self.frames = frames
+        self.enabled = False
+        self.stats: dict[str, dict[str, Any]] = {}
+        self.runs: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.enabled = True
+
+    def stop(self) -> None:
+        self.enabled = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _stack(self) -> list[_Frame]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def track(self, name: str, kind: str = "node") -> Iterator[None]:
+        if not self.enabled or not tracemalloc.is_tracing():
+            yield
+            return
+        stack = self._stack()
+        if stack:
+            # Keep the enclosing call's peak before resetting it for this one.
+            stack[-1].peak_so_far = max(stack[-1].peak_so_far, tracemalloc.get_traced_memory()[1])
+        frame = _Frame()
+        stack.append(frame)
+        before = tracemalloc.take_snapshot().filter_traces(_IGNORE)
+        start_current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, frame.peak_so_far)
+            after = tracemalloc.take_snapshot().filter_traces(_IGNORE)
+            stack.pop()
+            if stack:
+                stack[-1].peak_so_far = max(stack[-1].peak_so_far, peak)
+            top = [
+                {
+                    "site": str(stat.traceback[0]),
+                    "size_diff_kb": round(stat.size_diff / _KB, 1),
+                    "count_diff": stat.count_diff,
+                }
+                for stat in after.compare_to(before, "lineno")[: self.top_n]
+            ]
+            self._record(name, kind, peak - start_current, current - start_current, top)
+
+    def _record(self, name: str, kind: str, peak: int, net: int, top: list[dict]) -> None:
+        with self._lock:
+            entry = self.stats.setdefault(
+                name,
+                {"kind": kind, "calls": 0, "max_peak_kb": 0.0, "total_net_kb": 0.0,
+                 "net_kb_per_call": []},
+            )
+            entry["calls"] += 1
+            entry["max_peak_kb"] = max(entry["max_peak_kb"], round(peak / _KB, 1))
+            entry["total_net_kb"] = round(entry["total_net_kb"] + net / _KB, 1)
+            entry["net_kb_per_call"] = (entry["net_kb_per_call"] + [round(net / _KB, 1)])[-50:]
+            entry["top_allocations"] = top
+
+    def wrap(self, name: str, fn: Callable, kind: str = "node") -> Callable:
+        """Wrap `fn` so each call is tracked; signature is preserved for LangGraph/LangChain."""
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not self.enabled:
+                return fn(*args, **kwargs)
+            with self.track(name, kind):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    def record_run(self, label: str) -> dict[str, Any]:
+        """Sample traced memory after a whole run (post-GC) for the leak check."""
+        gc.collect()
+        current = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        sample = {"label": label, "traced_kb": round(current / _KB, 1)}
+        with self._lock:
+            self.runs.append(sample)
+        return sample
+
+    def leak_check(self) -> dict[str, Any]:
+        """Flag steady growth of retained memory across repeated runs."""
+        threshold = DebugConfig.LEAK_THRESHOLD_KB
+        sizes = [r["traced_kb"] for r in self.runs]
+        if len(sizes) >= 4:
+            sizes = sizes[1:]  # the first run fills caches and import-time state
+        growth = round(sizes[-1] - sizes[0], 1) if len(sizes) >= 2 else 0.0
+        monotonic = len(sizes) >= 3 and all(b >= a for a, b in zip(sizes, sizes[1:], strict=False))
+        growing = sorted(
+            name
+            for name, s in self.stats.items()
+            if len(s["net_kb_per_call"]) >= 3 and min(s["net_kb_per_call"]) > 0
+            and sum(s["net_kb_per_call"]) > threshold
+        )
+        return {
+            "runs": len(self.runs),
+            "growth_kb": growth,
+            "threshold_kb": threshold,
+            "suspected_leak": monotonic and growth > threshold,
+            "always_growing": growing,
+        }
+
+    def report(self) -> dict[str, Any]:
+        with self._lock:
+            nodes = {k: dict(v) for k, v in self.stats.items() if v["kind"] == "node"}
+            tools = {k: dict(v) for k, v in self.stats.items() if v["kind"] == "tool"}
+            runs = list(self.runs)
+        return {"nodes": nodes, "tools": tools, "runs": runs, "leak_check": self.leak_check()}
+
+
+_profiler: Optional[MemoryProfiler] = None
+
+
+def get_profiler() -> MemoryProfiler:
+    """The process-wide profiler; started automatically when DebugConfig.PROFILE_MEMORY is set."""
+    global _profiler
+    if _profiler is None:
+        _profiler = MemoryProfiler(top_n=DebugConfig.PROFILE_TOP_N)
+        if DebugConfig.PROFILE_MEMORY:
+            _profiler.start()
+    return _profiler
+
+
+def profiled(name: str, kind: str = "node") -> Callable[[Callable], Callable]:
+    """Decorator form of MemoryProfiler.wrap for nodes and tools."""
+    return lambda fn: get_profiler().wrap(name, fn, kind)
@@ -1,15 +1,29 @@
-def planner_prompt(user_prompt: str) -> str:
-    PLANNER_PROMPT = f"""
+"""
+Prompt builders.
+
+Providers cache prompts by prefix, so every prompt is laid out from most to
+least stable: fixed instructions first, then run-wide context (the project
+plan, the files on disk), and the per-call content (user request, task, file
+contents) last. The instruction blocks are constants and must not take
+variable content, or no two calls would share a cached prefix.
+"""
+
+PLANNER_INSTRUCTIONS = """
 You are the PLANNER agent. Convert the user prompt into a COMPLETE engineering project plan.
+"""
 
-User request:
-{user_prompt}
-    """
-    return PLANNER_PROMPT
+REFINE_PLANNER_INSTRUCTIONS = """
+You are the PLANNER agent. The project below already exists.
+Revise its plan to satisfy the new user request.
 
+RULES:
+- Keep every file that does not need to change with EXACTLY the same path and purpose text.
+- For each file that must change, rewrite its purpose to describe the new behaviour.
+- Add or remove files only when the request requires it.
+- Keep the tech stack unless the request explicitly changes it.
+"""
 
-def architect_prompt(plan: str) -> str:
-    ARCHITECT_PROMPT = f"""
+ARCHITECT_INSTRUCTIONS = """
 You are the ARCHITECT agent. Given this project plan, break it down into explicit engineering tasks.
 
 RULES:
@@ -20,20 +34,38 @@ RULES:
     * Mention how this task depends on or will be used by previous tasks.
     * Include integration details: imports, expected function signatures, data flow.
 - Order tasks so that dependencies are implemented first.
+- Mark purely cosmetic or nice-to-have tasks as optional; the app must work without them.
 - Each step must be SELF-CONTAINED but also carry FORWARD the relevant context from earlier tasks.
+"""
 
-Project Plan:
-{plan}
-    """
-    return ARCHITECT_PROMPT
+CONTRACT_INSTRUCTIONS = """
+You are the ARCHITECT agent.
+The tasks for each file of this project will be written separately, in parallel.
+First fix the CONTRACT every file must agree on.
 
+RULES:
+- For each FILE in the plan, list the exact names it defines that other files rely on
+  (functions with their signatures, classes, exported variables, DOM ids, CSS classes, events)
+  and the names it uses from other files.
+- Describe the data flow between the files in a few sentences.
+- Give a build order with dependencies first.
+- Be brief: names and signatures only, no implementation.
+"""
 
-def coder_system_prompt(tools: str) -> str:
-    """
-    The system prompt for the coder agent.
-    It now includes the tool descriptions to ensure the LLM uses the correct tool names.
-    """
-    CODER_SYSTEM_PROMPT = f"""
+FILE_TASKS_INSTRUCTIONS = ARCHITECT_INSTRUCTIONS + """
+- Create tasks ONLY for the one file named at the end; other files are planned separately.
+- Use the names in the contract EXACTLY: define what the contract says this file defines
+  and rely only on what the contract says other files define.
+"""
+
+CORRECTION_INSTRUCTIONS = """
+Your previous answer to the request above could not be used.
+Answer the same request again, in full, fixing the problems listed below.
+Return only the tool call, with valid JSON arguments that match its schema.
+If the previous answer was cut off, keep descriptions shorter so the whole answer fits.
+"""
+
+CODER_INSTRUCTIONS = """
 You are the CODER agent.
 You are a world-class software engineer tasked with implementing a specific engineering task.
 You have access to the following tools to read and write files.
@@ -43,8 +75,75 @@ Always:
 - Implement the FULL file content, integrating with other modules.
 - Maintain consistent naming of variables, functions, and imports.
 - When a module is imported from another file, ensure it exists and is implemented as described.
-
-Available tools (you MUST use these exact names):
-{tools}
+- Use the provided tools to accomplish the task by writing the complete, final content to the file.
 """
-    return CODER_SYSTEM_PROMPT
+
+
+def planner_prompt(user_prompt: str) -> str:
+    return f"{PLANNER_INSTRUCTIONS}\nUser request:\n{user_prompt}\n"
+
+
+def refine_planner_prompt(user_prompt: str, previous_plan: str) -> str:
+    return (
+        f"{REFINE_PLANNER_INSTRUCTIONS}\nPrevious plan:\n{previous_plan}\n\n"
+        f"New user request:\n{user_prompt}\n"
+    )
+
+
+def architect_prompt(plan: str, only_files: list[str] | None = None) -> str:
+    prompt = f"{ARCHITECT_INSTRUCTIONS}\nProject Plan:\n{plan}\n"
+    if only_files:
+        prompt += (
+            "\nThe other files already exist and must not change. "
+            "Create tasks ONLY for these files: " + ", ".join(only_files) + "\n"
+        )
+    return prompt
+
+
+def contract_prompt(plan: str) -> str:
+    return f"{CONTRACT_INSTRUCTIONS}\nProject Plan:\n{plan}\n"
+
+
+def file_tasks_prompt(plan: str, contract: str, filepath: str) -> str:
+    """Plan and contract are shared by every file's call; only the file name at the end differs."""
+    return (
+        f"{FILE_TASKS_INSTRUCTIONS}\nProject Plan:\n{plan}\n\nContract:\n{contract}\n\n"
+        f"File: {filepath}\n"
+    )
+
+
+def correction_prompt(prompt: str, answer: str, problems: list[str]) -> str:
+    """
+    The original prompt unchanged (so its cached prefix is reused), then what
+    was wrong with the answer.
+    """
+    listed = "\n".join(f"- {p}" for p in problems)
+    return (
+        f"{prompt}\n{CORRECTION_INSTRUCTIONS}\nProblems:\n{listed}\n\n"
+        f"Previous answer:\n{answer}\n"
+    )
+
+
+def coder_system_prompt(tools: str) -> str:
+    """
+    The system prompt for the coder agent: the instructions plus the rendered
+    tool descriptions, so the LLM uses the correct tool names. It is the same
+    for every step of every run.
+    """
+    return f"{CODER_INSTRUCTIONS}\nAvailable tools (you MUST use these exact names):\n{tools}\n"
+
+
+def coder_user_prompt(plan: str, files: list[str], filepath: str, task: str, content: str) -> str:
+    """
+    One coder step: the run-wide context (plan, then the files on disk)
+    before this step's file, its current content and the task.
+    """
+    return (
+        f"Project plan:\n{plan}\n\n"
+        f"Project files:\n" + ("\n".join(files) or "(none yet)") + "\n\n"
+        f"File to modify: {filepath}\n\n"
+        f"Here is the current content of that file:\n"
+        f"---BEGIN CURRENT CONTENT---\n{content}\n---END CURRENT CONTENT---\n\n"
+        f"Here is the task you must perform:\n"
+        f"Task: {task}\n"
+    )
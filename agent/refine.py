@@ -0,0 +1,149 @@
+# agent/refine.py
+"""
+Incremental regeneration ("refine" mode).
+
+A finished run leaves a small record next to its workspace: its compact
+`RunState`, including the Plan and TaskPlan it used. When the user iterates
+on the prompt, the new plan is diffed against that record and only added or
+affected files are scheduled for the coder; unchanged files stay untouched
+on disk.
+"""
+from __future__ import annotations
+
+import re
+from pathlib import Path
+from typing import Optional
+
+from agent.run_state import RunState
+from agent.states import Plan, PlanDiff, TaskPlan
+from agent.workspace import atomic_write_text
+
+# Rough conversion used for savings estimates when no usage data is available.
+CHARS_PER_TOKEN = 4
+# Model turns a coder step usually takes (write the file, then confirm).
+TURNS_PER_STEP = 2
+# Words too common in feature lists to tie a feature to a file.
+_FILLER = {"able", "allow", "allows", "each", "from", "have", "into", "page", "show", "shows",
+           "support", "supports", "that", "their", "them", "then", "this", "user", "users",
+           "using", "when", "with", "your"}
+
+
+def _norm(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _rel(path: str) -> str:
+    return path.removeprefix("./").lstrip("/")
+
+
+def _words(text: str) -> set[str]:
+    return {w for w in re.findall(r"[a-z0-9]+", text.lower()) if len(w) > 3 and w not in _FILLER}
+
+
+def _carriers(feature: str, texts: dict[str, set[str]]) -> list[str]:
+    """Files whose purpose or tasks mention at least half of a feature's significant words."""
+    wanted = _words(feature)
+    if not wanted:
+        return []
+    return [path for path, words in texts.items() if 2 * len(wanted & words) >= len(wanted)]
+
+
+def run_record_path(root: Path) -> Path:
+    """The record lives beside the workspace so it is never previewed or zipped."""
+    return root.parent / f".{root.name}.last_run.json"
+
+
+def save_run_record(root: Path, state: RunState) -> Path:
+    """Persist a finished run (its plan and task plan above all) for the next refine."""
+    path = run_record_path(root)
+    atomic_write_text(path, state.dumps())
+    return path
+
+
+def load_run_record(root: Path) -> Optional[tuple[Plan, TaskPlan]]:
+    """Return (plan, task_plan) from the last run in `root`, or None if there is none."""
+    path = run_record_path(root)
+    if not path.exists() or not root.exists():
+        return None
+    try:
+        state = RunState.loads(path.read_text(encoding="utf-8"))
+    except (ValueError, KeyError, AttributeError):
+        return None
+    if state.plan is None or state.task_plan is None:
+        return None
+    return state.plan, state.task_plan
+
+
+def diff_plans(old: Plan, new: Plan, old_tasks: Optional[TaskPlan] = None) -> PlanDiff:
+    """
+    Structural diff of two plans by file path/purpose and feature list. A feature
+    added or removed marks the files that carry it (by their purposes and, from
+    `old_tasks`, their previous tasks); one no file carries invalidates them all.
+    """
+    old_files = {_rel(f.path): f for f in old.files}
+    new_files = {_rel(f.path): f for f in new.files}
+    diff = PlanDiff(techstack_changed=_norm(old.techstack) != _norm(new.techstack))
+    for path, f in new_files.items():
+        if path not in old_files:
+            diff.added_files.append(path)
+        elif _norm(old_files[path].purpose) != _norm(f.purpose):
+            diff.changed_files.append(path)
+        else:
+            diff.unchanged_files.append(path)
+    diff.removed_files = [p for p in old_files if p not in new_files]
+    old_features = {_norm(x) for x in old.features}
+    new_features = {_norm(x) for x in new.features}
+    diff.added_features = [x for x in new.features if _norm(x) not in old_features]
+    diff.removed_features = [x for x in old.features if _norm(x) not in new_features]
+
+    texts = {path: _words(f.purpose) for path, f in {**old_files, **new_files}.items()}
+    for step in old_tasks.implementation_steps if old_tasks is not None else []:
+        texts.setdefault(_rel(step.filepath), set()).update(_words(step.task_description))
+    carriers: set[str] = set()
+    for feature in diff.added_features + diff.removed_features:
+        found = _carriers(feature, texts)
+        if not found:
+            diff.unmapped_features.append(feature)
+        carriers.update(found)
+    diff.feature_files = [p for p in diff.unchanged_files if p in carriers]
+    return diff
+
+
+def split_task_plan(task_plan: TaskPlan, affected: list[str]) -> tuple[TaskPlan, TaskPlan]:
+    """Split steps into (scheduled, skipped) by whether their file is affected."""
+    wanted = {_rel(p) for p in affected}
+    scheduled, skipped = [], []
+    for step in task_plan.implementation_steps:
+        (scheduled if _rel(step.filepath) in wanted else skipped).append(step)
+    return TaskPlan(implementation_steps=scheduled), TaskPlan(implementation_steps=skipped)
+
+
+def estimate_savings(root: Path, skipped: TaskPlan, system_prompt_chars: int = 0) -> dict:
+    """
+    Estimate the coder work avoided by not re-running `skipped` steps:
+    each step would have re-sent the system prompt, task and current file
+    and re-generated the file.
+    """
+    input_chars = output_chars = 0
+    for step in skipped.implementation_steps:
+        path = root / step.filepath
+        content_chars = path.stat().st_size if path.is_file() else 0
+        prompt_chars = system_prompt_chars + len(step.task_description) + content_chars
+        input_chars += TURNS_PER_STEP * prompt_chars
+        output_chars += content_chars
+    return {
+        "steps_skipped": len(skipped.implementation_steps),
+        "estimated_input_tokens_saved": input_chars // CHARS_PER_TOKEN,
+        "estimated_output_tokens_saved": output_chars // CHARS_PER_TOKEN,
+    }
+
+
+def remove_files(root: Path, paths: list[str]) -> list[str]:
+    """Delete files the new plan dropped; returns the ones actually removed."""
+    removed = []
+    for rel in paths:
+        p = (root / rel).resolve()
+        if root.resolve() in p.parents and p.is_file():
+            p.unlink()
+            removed.append(rel)
+    return removed
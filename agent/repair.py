@@ -0,0 +1,404 @@
+"""
+Local repair of structured LLM output.
+
+`invoke_structured(schema, model, prompt)` replaces a bare
+`with_structured_output(schema).invoke(prompt)`. When the provider's answer
+does not validate, it is repaired here before anything is sent again:
+
+- lenient JSON: Markdown fences and prose around the object, trailing
+  commas, and output cut off mid-array (the unfinished item is dropped)
+- coercion against the schema: wrapper objects (`{"TaskPlan": {...}}`), a
+  bare list for the schema's one list field, key case and spelling
+  (`File_Path`), a single object where a list is expected, numbers and lists
+  where text is expected, missing lists of strings
+- salvage: list items that still fail validation (wrong type, bad values)
+  are dropped, as long as every list of objects (files, steps) keeps at
+  least one item; an item missing a required field (a file without its
+  purpose) is not guessed away, the model is asked again
+
+Groq rejects a tool call whose arguments are not valid JSON with a 400
+`tool_use_failed` error that carries the generation; that text is repaired
+too. Only when repair fails is the model asked again, with one short
+correction prompt naming the problems, not the whole run.
+"""
+from __future__ import annotations
+
+import json
+import re
+import threading
+import types
+import typing
+from collections import defaultdict
+from functools import cache
+from typing import Any, Optional
+
+from langchain_core.messages import AIMessage
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from agent import llm as llms
+from agent.prompts import correction_prompt
+from debug_config import DebugConfig
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*\n?(.*?)(?:```|$)", re.S)
+_WRAPPER_KEYS = {"properties", "arguments", "parameters", "data", "result", "output", "response"}
+_MAX_SALVAGE_ROUNDS = 5
+_MAX_CUT_ATTEMPTS = 64
+
+
+class StructuredOutputError(ValueError):
+    """The model's answer could not be turned into the schema, even after a correction round."""
+
+
+# --- lenient JSON -------------------------------------------------------------
+def loads_lenient(text: str) -> Any:
+    """
+    Parse the first JSON object or array in `text`, tolerating fences, prose,
+    trailing commas and truncation. Raises ValueError when nothing usable is left.
+    """
+    fenced = _FENCE.search(text)
+    if fenced and fenced.group(1).strip():
+        text = fenced.group(1)
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        raise ValueError("no JSON object in the answer")
+    text = _drop_trailing_commas(text[min(starts):])
+    try:
+        return json.JSONDecoder().raw_decode(text)[0]
+    except json.JSONDecodeError:
+        pass
+    for candidate in _closed_prefixes(text):
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+    raise ValueError("the answer is not valid JSON and could not be completed")
+
+
+def _drop_trailing_commas(text: str) -> str:
+    out: list[str] = []
+    in_string = escaped = False
+    for ch in text:
+        if in_string:
+            escaped, in_string = (False, True) if escaped else (ch == "\\", ch != '"')
+        elif ch == '"':
+            in_string = True
+        elif ch in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+        out.append(ch)
+    return "".join(out)
+
+
+def _closes_items(stack: list[str]) -> bool:
+    """Whether closing `stack` would close an object inside an array: a half-written item."""
+    return "]" in stack and "}" in stack[stack.index("]"):]
+
+
+def _closed_prefixes(text: str):
+    """
+    Truncated JSON made whole: cut before the last complete item's comma (or
+    just after an opening bracket) and close every open bracket. Never inside
+    a list item, so an unfinished item is dropped, not closed. Latest cut first.
+    """
+    cuts: list[tuple[int, str]] = []
+    stack: list[str] = []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            escaped, in_string = (False, True) if escaped else (ch == "\\", ch != '"')
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            if not _closes_items(stack):
+                cuts.append((i + 1, "".join(reversed(stack))))
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            if not stack:
+                return  # a complete value: truncation is not the problem
+            if not _closes_items(stack):
+                cuts.append((i + 1, "".join(reversed(stack))))
+        elif ch == "," and not _closes_items(stack):
+            cuts.append((i, "".join(reversed(stack))))
+    for end, closers in reversed(cuts[-_MAX_CUT_ATTEMPTS:]):
+        yield text[:end].rstrip().rstrip(",") + closers
+
+
+# --- coercion -----------------------------------------------------------------
+def _norm(key: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", key.lower())
+
+
+def _is_model(annotation: Any) -> bool:
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel)
+
+
+def _list_item(annotation: Any) -> Optional[Any]:
+    """The item type of a `list[...]` annotation, else None."""
+    return typing.get_args(annotation)[0] if typing.get_origin(annotation) is list else None
+
+
+def _unoptional(annotation: Any) -> Any:
+    """`X` for `Optional[X]` / `X | None`."""
+    if typing.get_origin(annotation) not in (typing.Union, types.UnionType):
+        return annotation
+    args = [a for a in typing.get_args(annotation) if a is not type(None)]
+    return args[0] if len(args) == 1 else annotation
+
+
+def _coerce_value(annotation: Any, value: Any) -> Any:
+    annotation = _unoptional(annotation)
+    item = _list_item(annotation)
+    if item is not None:
+        if value is None:
+            return []
+        if isinstance(value, str):
+            if _is_model(item):
+                try:
+                    value = loads_lenient(value)
+                except ValueError:
+                    return value
+            else:
+                value = [line.strip().lstrip("-*• ").strip() for line in value.splitlines()]
+                value = [line for line in value if line]
+        if isinstance(value, dict):
+            value = [value]
+        return [_coerce_value(item, v) for v in value] if isinstance(value, list) else value
+    if _is_model(annotation):
+        return _coerce(annotation, value)
+    if annotation is str:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        if isinstance(value, list) and all(isinstance(v, (str, int, float)) for v in value):
+            return "\n".join(str(v) for v in value)
+        if isinstance(value, dict):
+            return json.dumps(value)
+    return value
+
+
+def _coerce(schema: type[BaseModel], data: Any) -> Any:
+    """`data` reshaped towards `schema`; what cannot be fixed is left for validation to report."""
+    if isinstance(data, str):
+        try:
+            data = loads_lenient(data)
+        except ValueError:
+            return data
+    fields = schema.model_fields
+    if isinstance(data, list):
+        lists = [name for name, f in fields.items()
+                 if f.is_required() and _list_item(f.annotation) is not None]
+        if len(lists) == 1:
+            data = {lists[0]: data}
+    if not isinstance(data, dict):
+        return data
+    names = {_norm(name) for name in fields}
+    while len(data) == 1:
+        (key, inner), = data.items()
+        if _norm(key) in names or _norm(key) not in _WRAPPER_KEYS | {_norm(schema.__name__)}:
+            break
+        data = inner if isinstance(inner, dict) else _coerce(schema, inner)
+        if not isinstance(data, dict):
+            return data
+    # A tool call written out as text
+    if set(data) == {"name", "arguments"} and "name" not in fields:
+        return _coerce(schema, data["arguments"])
+    by_key = {_norm(k): v for k, v in data.items()}
+    out: dict[str, Any] = {}
+    for name, field in fields.items():
+        if _norm(name) in by_key:
+            out[name] = _coerce_value(field.annotation, by_key[_norm(name)])
+        elif field.is_required() and _list_item(field.annotation) is str:
+            out[name] = []  # e.g. `features` cut off by truncation: not worth another call
+    if schema.model_config.get("extra") == "allow":
+        out.update({k: v for k, v in data.items() if _norm(k) not in names})
+    return out
+
+
+# --- validation and salvage ---------------------------------------------------
+@cache
+def _adapter(schema: type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(schema)
+
+
+def prebuild_validators(schemas: list[type[BaseModel]]) -> None:
+    """Compile the validators up front, like the structured-output runnables."""
+    for schema in schemas:
+        _adapter(schema)
+
+
+def _drop_invalid_items(data: Any, errors: list[dict[str, Any]]) -> bool:
+    """
+    Remove every list item an error points into; False if an error is outside
+    any list or is a missing field (only the model knows e.g. a file's purpose).
+    """
+    doomed: dict[int, tuple[list, set[int]]] = {}
+    for error in errors:
+        loc = error["loc"]
+        last = max((i for i, part in enumerate(loc) if isinstance(part, int)), default=None)
+        if last is None or error["type"] == "missing":
+            return False
+        container = data
+        try:
+            for part in loc[:last]:
+                container = container[part]
+        except (KeyError, IndexError, TypeError):  # a location that is not a path into the data
+            return False
+        doomed.setdefault(id(container), (container, set()))[1].add(loc[last])
+    for container, indices in doomed.values():
+        for index in sorted(indices, reverse=True):
+            del container[index]
+    return True
+
+
+def _has_content(schema: type[BaseModel], value: BaseModel) -> bool:
+    """Every required list of objects still has an item: an empty plan is no salvage."""
+    return all(
+        getattr(value, name)
+        for name, field in schema.model_fields.items()
+        if field.is_required() and _is_model(_list_item(field.annotation))
+    )
+
+
+def _problems(error: ValidationError, limit: int = 8) -> list[str]:
+    problems = [f"{'.'.join(str(p) for p in e['loc']) or '(root)'}: {e['msg']}"
+                for e in error.errors()[:limit]]
+    if error.error_count() > limit:
+        problems.append(f"... and {error.error_count() - limit} more")
+    return problems
+
+
+def repair(schema: type[BaseModel], answer: Any) -> tuple[Optional[BaseModel], list[str]]:
+    """
+    Validate `answer` (a dict, JSON-ish text or an AIMessage) as `schema`,
+    repairing what can be repaired. Returns the model, or None with the
+    problems that remain (for the correction prompt).
+    """
+    problems: list[str] = []
+    for candidate in _candidates(answer):
+        data = _coerce(schema, candidate)
+        for _ in range(_MAX_SALVAGE_ROUNDS):
+            try:
+                value = _adapter(schema).validate_python(data)
+            except ValidationError as e:
+                if not _drop_invalid_items(data, e.errors()):
+                    problems = _problems(e)
+                    break
+                continue
+            if _has_content(schema, value):
+                return value, []
+            problems = ["every item failed validation; nothing usable is left"]
+            break
+        else:
+            problems = ["too many invalid items"]
+        if isinstance(data, str):
+            problems = ["the answer is not valid JSON"]
+    return None, problems or ["the answer contained no tool call or JSON"]
+
+
+def _candidates(answer: Any) -> list[Any]:
+    """Everything in an answer that might hold the arguments, most specific first."""
+    if not isinstance(answer, AIMessage):
+        return [answer] if answer else []
+    candidates: list[Any] = [call["args"] for call in answer.tool_calls]
+    candidates += [call["args"] for call in answer.invalid_tool_calls if call.get("args")]
+    if isinstance(answer.content, str) and answer.content.strip():
+        candidates.append(answer.content)
+    return candidates
+
+
+def _answer_text(answer: Any) -> str:
+    if isinstance(answer, AIMessage):
+        for call in answer.tool_calls:
+            return json.dumps(call["args"])
+        for call in answer.invalid_tool_calls:
+            return call.get("args") or ""
+        return answer.content if isinstance(answer.content, str) else json.dumps(answer.content)
+    return answer if isinstance(answer, str) else json.dumps(answer, default=str)
+
+
+# --- invocation ---------------------------------------------------------------
+class RepairStats:
+    """
+    Per-schema counters. Each call ends in exactly one outcome: valid as
+    returned, repaired locally, valid after a correction prompt (`reask_ok`)
+    or failed. `reasked` counts the correction prompts sent.
+    """
+
+    def __init__(self) -> None:
+        self.counters: dict[str, dict[str, int]] = defaultdict(
+            lambda: {"calls": 0, "valid": 0, "repaired": 0, "reask_ok": 0, "failed": 0,
+                     "reasked": 0}
+        )
+        self._lock = threading.Lock()
+
+    def record(self, schema: str, *outcomes: str) -> None:
+        with self._lock:
+            for outcome in outcomes:
+                self.counters[schema][outcome] += 1
+
+    def report(self) -> dict[str, dict[str, int]]:
+        with self._lock:
+            return {schema: dict(counts) for schema, counts in self.counters.items()}
+
+
+repair_stats = RepairStats()
+
+
+def _failed_generation(error: Exception) -> Optional[str]:
+    """The rejected generation from Groq's 400 `tool_use_failed` error, if that is what this is."""
+    body = getattr(error, "body", None)
+    if isinstance(body, dict):
+        body = body.get("error", body)
+    if isinstance(body, dict) and isinstance(body.get("failed_generation"), str):
+        return body["failed_generation"]
+    return None
+
+
+def _ask(schema: type[BaseModel], model: Any, prompt: str) -> tuple[Optional[BaseModel], Any]:
+    try:
+        out = llms.structured(schema, model).invoke(prompt)
+    except Exception as e:
+        failed = _failed_generation(e)
+        if failed is None:
+            raise
+        return None, failed
+    return out["parsed"], out["raw"]
+
+
+def invoke_structured(schema: type[BaseModel], model: Any, prompt: str) -> BaseModel:
+    """
+    `schema` from `model` for `prompt`: as parsed, else repaired locally, else
+    after up to STRUCTURED_REPAIR_RETRIES correction prompts. Raises
+    StructuredOutputError when none of that yields a valid value.
+    """
+    name = schema.__name__
+    repair_stats.record(name, "calls")
+    parsed, raw = _ask(schema, model, prompt)
+    if parsed is not None:
+        repair_stats.record(name, "valid")
+        return parsed
+    for attempt in range(1 + DebugConfig.STRUCTURED_REPAIR_RETRIES):
+        value, problems = repair(schema, raw)
+        if value is not None:
+            repair_stats.record(name, "repaired")
+            return value
+        if attempt == DebugConfig.STRUCTURED_REPAIR_RETRIES:
+            break
+        repair_stats.record(name, "reasked")
+        answer = _answer_text(raw)[: DebugConfig.STRUCTURED_REPAIR_ANSWER_CHARS]
+        parsed, raw = _ask(schema, model, correction_prompt(prompt, answer, problems))
+        if parsed is not None:
+            repair_stats.record(name, "reask_ok")
+            return parsed
+    repair_stats.record(name, "failed")
+    raise StructuredOutputError(f"{name} could not be repaired: {'; '.join(problems)}")
+
+
+def repair_metrics() -> dict[str, dict[str, int]]:
+    """Per-schema structured-output outcomes in this process."""
+    return repair_stats.report()
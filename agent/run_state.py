@@ -0,0 +1,122 @@
+# agent/run_state.py
+"""
+What a run leaves behind.
+
+Inside the graph the state stays a LangGraph `AgentState` dict. Whatever
+outlives the graph uses a `RunState`: the refine record (the run's
+checkpoint), the job result and the debug reports. It is a slotted dataclass
+that holds only what those readers use. Its compact JSON form omits empty
+fields and model defaults, as well as the copy of the plan the architect
+attaches to the task plan. `summary()` is the one line printed in place of
+the full final state.
+"""
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from typing import Any, Mapping, Optional
+
+from agent.states import Plan, TaskPlan
+
+
+@dataclass(slots=True)
+class RunState:
+    prompt: str = ""
+    plan: Optional[Plan] = None
+    task_plan: Optional[TaskPlan] = None
+    status: str = ""
+    steps_done: int = 0
+    validation_attempts: int = 0
+    validation_issues: dict[str, list[str]] = field(default_factory=dict)
+    architect_report: dict[str, Any] = field(default_factory=dict)
+    refine_report: dict[str, Any] = field(default_factory=dict)
+    budget_status: dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_graph(cls, state: Mapping[str, Any]) -> RunState:
+        """The parts of a graph state or final result worth keeping; shared, not copied."""
+        coder_state = state.get("coder_state")
+        return cls(
+            prompt=state.get("user_prompt") or "",
+            plan=state.get("plan"),
+            task_plan=state.get("task_plan"),
+            status=state.get("status") or "",
+            steps_done=coder_state.current_step_idx if coder_state is not None else 0,
+            validation_attempts=state.get("validation_attempts") or 0,
+            validation_issues=state.get("validation_issues") or {},
+            architect_report=state.get("architect_report") or {},
+            refine_report=state.get("refine_report") or {},
+            budget_status=state.get("budget_status") or {},
+        )
+
+    def to_record(self) -> dict[str, Any]:
+        record: dict[str, Any] = {
+            "prompt": self.prompt,
+            "status": self.status,
+            "steps_done": self.steps_done,
+            "validation_attempts": self.validation_attempts,
+            "validation_issues": self.validation_issues,
+        }
+        if self.plan is not None:
+            record["plan"] = self.plan.model_dump(exclude_defaults=True)
+        if self.task_plan is not None:
+            record["task_plan"] = {"implementation_steps": [
+                s.model_dump(exclude_defaults=True) for s in self.task_plan.implementation_steps
+            ]}
+        return {k: v for k, v in record.items() if v}
+
+    def dumps(self) -> str:
+        return json.dumps(self.to_record(), separators=(",", ":"), ensure_ascii=False)
+
+    @classmethod
+    def from_record(cls, record: Mapping[str, Any]) -> RunState:
+        """
+        Inverse of `to_record`; also reads records written before it existed
+        (plan and task plan only).
+        """
+        return cls(
+            prompt=record.get("prompt", ""),
+            plan=Plan.model_validate(record["plan"]) if "plan" in record else None,
+            task_plan=(TaskPlan.model_validate(record["task_plan"])
+                       if "task_plan" in record else None),
+            status=record.get("status", ""),
+            steps_done=record.get("steps_done", 0),
+            validation_attempts=record.get("validation_attempts", 0),
+            validation_issues=record.get("validation_issues", {}),
+        )
+
+    @classmethod
+    def loads(cls, text: str | bytes) -> RunState:
+        return cls.from_record(json.loads(text))
+
+    def brief(self) -> dict[str, Any]:
+        """Counts and names only: cheap enough for every debug transition and every job result."""
+        steps = self.task_plan.implementation_steps if self.task_plan is not None else []
+        brief: dict[str, Any] = {
+            "files": len(self.plan.files) if self.plan is not None else 0,
+            "steps": len(steps),
+            "steps_done": self.steps_done,
+            "status": self.status,
+            "validation_issues": sum(len(v) for v in self.validation_issues.values()),
+        }
+        if self.plan is not None:
+            brief["plan"] = self.plan.name
+            brief["techstack"] = self.plan.techstack
+        return brief
+
+    def summary(self) -> str:
+        """One line for people: what was planned and how far the run got."""
+        if self.plan is None:
+            return f"Run: no plan ({self.status or 'not started'})"
+        b = self.brief()
+        line = (
+            f"Run: {b['plan']!r} ({b['techstack']}), {b['files']} files, "
+            f"{b['steps_done']}/{b['steps']} steps, status {b['status'] or 'unknown'}"
+        )
+        if b["validation_issues"]:
+            line += (f", {b['validation_issues']} validation issue(s) "
+                     f"in {len(self.validation_issues)} file(s)")
+        if self.budget_status:
+            line += (f", {self.budget_status.get('input_tokens', 0)} input / "
+                     f"{self.budget_status.get('output_tokens', 0)} output tokens")
+        return line
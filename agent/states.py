@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, TypedDict
 
 from pydantic import BaseModel, Field, ConfigDict
 
@@ -17,12 +17,88 @@ class Plan(BaseModel):
 class ImplementationTask(BaseModel):
     filepath: str = Field(description="The path to the file to be modified")
     task_description: str = Field(description="A detailed description of the task to be performed on the file, e.g. 'add user authentication', 'implement data processing logic', etc.")
+    optional: bool = Field(
+        False,
+        description="True for nice-to-have polish (animations, extra styling) "
+                    "that the app works without",
+    )
 
 class TaskPlan(BaseModel):
     implementation_steps: list[ImplementationTask] = Field(description="A list of steps to be taken to implement the task")
     model_config = ConfigDict(extra="allow")
     
+class FileContract(BaseModel):
+    path: str = Field(description="The file this entry is about, exactly as in the plan")
+    defines: list[str] = Field(
+        description="Names this file defines that other files rely on, with signatures, "
+                    "e.g. 'function addTodo(text)', '#todo-list', '.todo-item.done'"
+    )
+    uses: list[str] = Field(
+        description="Names this file uses from other files, as 'name (from path)'"
+    )
+
+class Contract(BaseModel):
+    data_flow: str = Field(
+        description="A few sentences on how data and control flow between the files"
+    )
+    files: list[FileContract] = Field(description="One entry per file in the plan")
+    build_order: list[str] = Field(
+        description="Every file path, dependencies before the files that use them"
+    )
+
 class CoderState(BaseModel):
     task_plan: TaskPlan = Field(description="The plan for the task to be implemented")
     current_step_idx: int = Field(0, description="The index of the current step in the implementation steps")
-    current_file_content: Optional[str] = Field(None, description="The content of the file currently being edited or created")
\ No newline at end of file
+    current_file_content: Optional[str] = Field(None, description="The content of the file currently being edited or created")
+
+class PlanDiff(BaseModel):
+    added_files: list[str] = Field(
+        default_factory=list, description="Files present only in the new plan"
+    )
+    removed_files: list[str] = Field(
+        default_factory=list, description="Files present only in the previous plan"
+    )
+    changed_files: list[str] = Field(
+        default_factory=list, description="Files whose purpose changed between plans"
+    )
+    unchanged_files: list[str] = Field(
+        default_factory=list, description="Files identical in both plans"
+    )
+    added_features: list[str] = Field(
+        default_factory=list, description="Features present only in the new plan"
+    )
+    removed_features: list[str] = Field(
+        default_factory=list, description="Features present only in the previous plan"
+    )
+    feature_files: list[str] = Field(
+        default_factory=list, description="Unchanged files that carry an added or removed feature"
+    )
+    unmapped_features: list[str] = Field(
+        default_factory=list,
+        description="Added or removed features no file carries, which invalidate every file",
+    )
+    techstack_changed: bool = Field(
+        False, description="Whether the tech stack changed, which invalidates every file"
+    )
+
+    @property
+    def affected_files(self) -> list[str]:
+        if self.techstack_changed or self.unmapped_features:
+            return self.added_files + self.changed_files + self.unchanged_files
+        return self.added_files + self.changed_files + self.feature_files
+
+class AgentState(TypedDict, total=False):
+    """Graph state shared by all nodes; each node returns only the keys it updates."""
+    user_prompt: str
+    plan: Plan
+    task_plan: TaskPlan
+    coder_state: CoderState
+    status: str
+    validation_attempts: int
+    validation_issues: dict[str, list[str]]
+    previous_plan: Plan
+    previous_task_plan: TaskPlan
+    plan_diff: PlanDiff
+    refine_report: dict
+    architect_report: dict
+    budget_status: dict
@@ -1,16 +1,47 @@
 # agent/tools.py
 from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
-from typing import List
+from datetime import datetime
+from typing import Iterator, List, Optional
 
 from langchain_core.tools import tool
 
+from agent.cancellation import check_cancelled
+from agent.file_index import index_for
+from agent.profiling import profiled
+from agent.workspace import atomic_write_text
+from debug_config import DebugConfig
+
 # All generated files live here (served at /preview)
 PROJECT_ROOT = Path.cwd() / "generated_site"
 
+# Per-run override so concurrent jobs each write into their own workspace.
+# Context variables follow the run into LangGraph/LangChain worker threads.
+_project_root: ContextVar[Path] = ContextVar("project_root", default=PROJECT_ROOT)
+
+
+def get_project_root() -> Path:
+    """The workspace the current run writes into (PROJECT_ROOT unless overridden)."""
+    return _project_root.get()
+
+
+@contextmanager
+def use_project_root(root: Path) -> Iterator[Path]:
+    """Point the file tools at `root` for the duration of the block."""
+    token = _project_root.set(Path(root))
+    try:
+        yield Path(root)
+    finally:
+        _project_root.reset(token)
+
 
 def _ensure_root() -> None:
-    PROJECT_ROOT.mkdir(parents=True, exist_ok=True)
+    root = get_project_root()
+    if root.is_symlink() and not root.exists():
+        root.unlink()  # its release was removed; start from an empty directory
+    root.mkdir(parents=True, exist_ok=True)
 
 
 def init_project_root() -> None:
@@ -24,26 +55,32 @@ def _safe_join(path: str) -> Path:
     Prevents path traversal.
     """
     _ensure_root()
-    p = (PROJECT_ROOT / path).resolve()
-    if PROJECT_ROOT not in p.parents and p != PROJECT_ROOT:
+    root = get_project_root().resolve()
+    p = (root / path).resolve()
+    if root not in p.parents and p != root:
         raise ValueError("Invalid path: must be inside project root")
     return p
 
 
 @tool("write_file")
+@profiled("write_file", kind="tool")
 def write_file(path: str, content: str) -> str:
     """
     Write a UTF-8 text file at `path` (relative to the project root) with `content`.
     Creates parent folders as needed and overwrites if the file exists.
     Returns the absolute file path string on success.
     """
+    check_cancelled()  # a cancelled or timed-out step must not change the workspace
     p = _safe_join(path)
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(content, encoding="utf-8")
+    # Temp file + rename: readers never see a half-written file, and hardlinked
+    # snapshots of the workspace keep their old content.
+    atomic_write_text(p, content)
+    index_for(get_project_root()).note_write(p)
     return str(p)
 
 
 @tool("read_file")
+@profiled("read_file", kind="tool")
 def read_file(path: str) -> str:
     """
     Read and return the UTF-8 text content of the file at `path`
@@ -60,22 +97,60 @@ def read_file(path: str) -> str:
 
 
 @tool("list_files")
-def list_files() -> str:
+@profiled("list_files", kind="tool")
+def list_files(
+    pattern: str = "",
+    max_depth: Optional[int] = None,
+    offset: int = 0,
+    limit: int = DebugConfig.LIST_FILES_PAGE_SIZE,
+    details: bool = False,
+) -> str:
     """
-    Return a newline-separated list of all files (relative paths) in the project root.
+    List files (relative paths) in the project root, one per line.
+    Optional: `pattern` glob filter (e.g. "*.js", "css/*.css"), `max_depth`
+    (1 = top level only), `offset`/`limit` to page through long listings,
+    `details=True` to add size in bytes and modification time.
+    Dependency/build folders and .gitignore'd paths are skipped.
     """
     _ensure_root()
-    files: List[str] = []
-    for fp in PROJECT_ROOT.rglob("*"):
-        if fp.is_file():
-            files.append(str(fp.relative_to(PROJECT_ROOT)))
-    return "\n".join(sorted(files))
+    index = index_for(get_project_root())
+    matches = index.query(pattern or None, max_depth)
+    offset, limit = max(0, offset), max(1, limit)
+    page = matches[offset: offset + limit]
+
+    lines: List[str] = []
+    used = 0
+    for rel, size, mtime in page:
+        line = rel
+        if details:
+            line = f"{rel}\t{size} B\t{datetime.fromtimestamp(mtime).isoformat(timespec='seconds')}"
+        if used + len(line) + 1 > DebugConfig.LIST_FILES_MAX_CHARS:
+            break
+        lines.append(line)
+        used += len(line) + 1
+
+    notes: List[str] = []
+    shown_end = offset + len(lines)
+    if shown_end < len(matches):
+        notes.append(
+            f"[truncated: showing {offset + 1}-{shown_end} of {len(matches)} files; "
+            f"call again with offset={shown_end}, or narrow with pattern/max_depth]"
+        )
+    if pattern and not matches:
+        notes.append(f"[no files match {pattern!r}]")
+    if index.pruned and not pattern:
+        skipped = sorted(index.pruned)
+        more = f" and {len(skipped) - 5} more" if len(skipped) > 5 else ""
+        listed = ", ".join(d + "/" for d in skipped[:5])
+        notes.append(f"[ignored directories not listed: {listed}{more}]")
+    return "\n".join(lines + notes)
 
 
 @tool("get_current_directory")
+@profiled("get_current_directory", kind="tool")
 def get_current_directory() -> str:
     """
     Return the absolute path to the project root where files are written.
     """
     _ensure_root()
-    return str(PROJECT_ROOT)
+    return str(get_project_root())
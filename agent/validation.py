@@ -0,0 +1,295 @@
+# agent/validation.py
+"""
+Fast, local static checks for a generated site.
+
+Nothing here calls the LLM: HTML is parsed with the stdlib parser, JS and CSS
+are scanned for unbalanced brackets / unterminated strings and comments,
+local references from HTML pages are resolved against the files on disk, and
+DOM ids used by scripts are checked against the ids the pages define.
+
+The result maps a relative file path to the list of problems found in it, so
+the graph can re-queue only the failing files to the coder.
+"""
+from __future__ import annotations
+
+import re
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+# Elements that never have a closing tag.
+_VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+    "meta", "param", "source", "track", "wbr",
+}
+# Elements the HTML spec lets you leave open; don't report them.
+_OPTIONAL_END_TAGS = {"li", "p", "td", "th", "tr", "thead", "tbody", "tfoot", "option", "dt", "dd"}
+# (tag, attribute) pairs that load a local resource.
+_REF_ATTRS = {
+    ("link", "href"), ("script", "src"), ("img", "src"), ("audio", "src"),
+    ("video", "src"), ("source", "src"), ("iframe", "src"), ("a", "href"),
+}
+_EXTERNAL_PREFIXES = (
+    "http:", "https:", "//", "data:", "mailto:", "tel:", "javascript:", "#", "blob:",
+)
+
+_JS_ID_LOOKUPS = (
+    re.compile(r"getElementById\(\s*(['\"`])([\w-]+)\1\s*\)"),
+    re.compile(r"querySelector(?:All)?\(\s*(['\"`])#([\w-]+)[^'\"`]*\1\s*\)"),
+    re.compile(r"\$\(\s*(['\"`])#([\w-]+)\1\s*\)"),
+)
+# Ids created from script (`el.id = "x"`, `setAttribute("id", "x")`, `id="x"` in templates).
+_JS_ID_DEFINITIONS = (
+    re.compile(r"\.id\s*=\s*(['\"`])([\w-]+)\1"),
+    re.compile(r"setAttribute\(\s*(['\"])id\1\s*,\s*(['\"`])([\w-]+)\2"),
+    re.compile(r"\bid\s*=\s*(\\?['\"])([\w-]+)\\?['\"]"),
+)
+
+_CLOSERS = {")": "(", "]": "[", "}": "{"}
+
+
+class _PageParser(HTMLParser):
+    """Collects ids, local references, inline scripts and tag-nesting errors."""
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.ids: set[str] = set()
+        self.refs: list[tuple[str, int]] = []
+        self.scripts: list[str] = []
+        self.errors: list[str] = []
+        self._stack: list[tuple[str, int]] = []
+        self._in_script = False
+        self._script_buf: list[str] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        line = self.getpos()[0]
+        values = {k: (v or "") for k, v in attrs}
+        if values.get("id"):
+            self.ids.add(values["id"])
+        for attr in ("href", "src"):
+            if (tag, attr) in _REF_ATTRS and values.get(attr):
+                self.refs.append((values[attr], line))
+        if tag == "script" and "src" not in values:
+            self._in_script = True
+            self._script_buf = []
+        if tag not in _VOID_TAGS:
+            self._stack.append((tag, line))
+
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        self.handle_starttag(tag, attrs)
+        if tag not in _VOID_TAGS and self._stack and self._stack[-1][0] == tag:
+            self._stack.pop()
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "script" and self._in_script:
+            self._in_script = False
+            self.scripts.append("".join(self._script_buf))
+        if tag in _VOID_TAGS:
+            return
+        open_tags = [t for t, _ in self._stack]
+        if tag not in open_tags:
+            self.errors.append(
+                f"line {self.getpos()[0]}: closing </{tag}> has no matching opening tag"
+            )
+            return
+        while self._stack:
+            open_tag, line = self._stack.pop()
+            if open_tag == tag:
+                break
+            if open_tag not in _OPTIONAL_END_TAGS:
+                self.errors.append(f"line {line}: <{open_tag}> is never closed")
+
+    def handle_data(self, data: str) -> None:
+        if self._in_script:
+            self._script_buf.append(data)
+
+    def finish(self) -> None:
+        self.close()
+        for tag, line in self._stack:
+            if tag not in _OPTIONAL_END_TAGS and tag not in ("html", "body", "head"):
+                self.errors.append(f"line {line}: <{tag}> is never closed")
+
+
+def _scan_brackets(source: str, *, js: bool) -> list[str]:
+    """
+    Walk `source` skipping strings and comments and report unbalanced brackets.
+    With `js=True`, template literals and regex literals are understood as well.
+    """
+    errors: list[str] = []
+    stack: list[tuple[str, int]] = []
+    i, n, line = 0, len(source), 1
+    prev_significant = ""
+    while i < n:
+        ch = source[i]
+        if ch == "\n":
+            line += 1
+            i += 1
+            continue
+        if source.startswith("/*", i):
+            end = source.find("*/", i + 2)
+            if end == -1:
+                errors.append(f"line {line}: unterminated /* comment")
+                break
+            line += source.count("\n", i, end)
+            i = end + 2
+            continue
+        if js and source.startswith("//", i):
+            end = source.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        if ch in "'\"" or (js and ch == "`"):
+            start_line = line
+            i += 1
+            while i < n and source[i] != ch:
+                if source[i] == "\\":
+                    i += 1
+                elif source[i] == "\n":
+                    if ch != "`":
+                        break
+                    line += 1
+                i += 1
+            if i >= n or source[i] != ch:
+                errors.append(f"line {start_line}: unterminated string literal")
+                if i >= n:
+                    break
+            i += 1
+            prev_significant = ch
+            continue
+        if js and ch == "/" and (not prev_significant
+                                 or prev_significant in "(,=:[!&|?{};+-*%<>~^"):
+            # Regex literal: skip to the closing slash (honouring escapes and classes).
+            j, in_class = i + 1, False
+            while j < n and source[j] != "\n":
+                c = source[j]
+                if c == "\\":
+                    j += 1
+                elif c == "[":
+                    in_class = True
+                elif c == "]":
+                    in_class = False
+                elif c == "/" and not in_class:
+                    break
+                j += 1
+            if j < n and source[j] == "/":
+                i = j + 1
+                prev_significant = "/"
+                continue
+        if ch in "([{":
+            stack.append((ch, line))
+        elif ch in _CLOSERS:
+            if not stack or stack[-1][0] != _CLOSERS[ch]:
+                errors.append(f"line {line}: unexpected '{ch}'")
+                break
+            stack.pop()
+        if not ch.isspace():
+            prev_significant = ch
+        i += 1
+    for opener, opened_at in stack[-3:]:
+        errors.append(f"line {opened_at}: '{opener}' is never closed")
+    return errors
+
+
+def check_js(source: str) -> list[str]:
+    """Lightweight JS syntax check: balanced brackets, strings, comments."""
+    return _scan_brackets(source, js=True)
+
+
+def check_css(source: str) -> list[str]:
+    """Lightweight CSS syntax check: balanced braces, strings, comments."""
+    return _scan_brackets(source, js=False)
+
+
+def _local_ref(ref: str) -> str | None:
+    """Return the path part of a local reference, or None for external/anchor links."""
+    ref = ref.strip()
+    if not ref or ref.lower().startswith(_EXTERNAL_PREFIXES):
+        return None
+    path = unquote(urlsplit(ref).path)
+    return path or None
+
+
+def _similar_files(root: Path, missing: str) -> list[str]:
+    """Existing files with the extension of a missing reference (e.g. style.css vs styles.css)."""
+    suffix = Path(missing).suffix
+    if not suffix:
+        return []
+    return sorted(p.relative_to(root).as_posix() for p in root.rglob(f"*{suffix}") if p.is_file())
+
+
+def _js_ids(source: str, patterns: tuple[re.Pattern[str], ...]) -> set[str]:
+    found: set[str] = set()
+    for pattern in patterns:
+        for m in pattern.finditer(source):
+            found.add(m.group(m.lastindex or 0))
+    return found
+
+
+def validate_project(root: Path) -> dict[str, list[str]]:
+    """
+    Run every static check over the site rooted at `root`.
+    Returns {relative_path: [problem, ...]} for files that need fixing.
+    """
+    issues: dict[str, list[str]] = {}
+
+    def report(rel: str, message: str) -> None:
+        issues.setdefault(rel, []).append(message)
+
+    if not root.exists():
+        return issues
+
+    files = {p.relative_to(root).as_posix(): p for p in root.rglob("*") if p.is_file()}
+    defined_ids: set[str] = set()
+    # Script file -> pages that load it; inline scripts are keyed by their page.
+    scripts: dict[str, str] = {}
+
+    for rel, path in sorted(files.items()):
+        suffix = path.suffix.lower()
+        try:
+            text = path.read_text(encoding="utf-8")
+        except (UnicodeDecodeError, OSError):
+            continue
+        if suffix in (".html", ".htm"):
+            parser = _PageParser()
+            parser.feed(text)
+            parser.finish()
+            for err in parser.errors:
+                report(rel, f"HTML: {err}")
+            defined_ids |= parser.ids
+            for i, inline in enumerate(parser.scripts, 1):
+                for err in check_js(inline):
+                    report(rel, f"inline <script> #{i}: {err}")
+                scripts.setdefault(rel, "")
+                scripts[rel] += "\n" + inline
+            for ref, line in parser.refs:
+                local = _local_ref(ref)
+                if local is None:
+                    continue
+                base = root if local.startswith("/") else path.parent
+                target = base / local.lstrip("/")
+                if target.is_dir():
+                    target = target / "index.html"
+                if not target.exists():
+                    msg = f"line {line}: references '{ref}' but that file does not exist"
+                    candidates = [c for c in _similar_files(root, local) if c != rel]
+                    if candidates:
+                        msg += f" (existing files: {', '.join(candidates)})"
+                    report(rel, msg)
+        elif suffix in (".js", ".mjs"):
+            for err in check_js(text):
+                report(rel, f"JS: {err}")
+            scripts[rel] = text
+            defined_ids |= _js_ids(text, _JS_ID_DEFINITIONS)
+        elif suffix == ".css":
+            for err in check_css(text):
+                report(rel, f"CSS: {err}")
+
+    if defined_ids or any(f.endswith((".html", ".htm")) for f in files):
+        for rel, source in scripts.items():
+            missing = sorted(_js_ids(source, _JS_ID_LOOKUPS) - defined_ids)
+            if missing:
+                report(
+                    rel,
+                    "uses DOM ids that no page defines: "
+                    + ", ".join(f"#{m}" for m in missing),
+                )
+    return issues
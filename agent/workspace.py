@@ -0,0 +1,230 @@
+# agent/workspace.py
+"""
+Atomic file writes and a double-buffered output directory.
+
+The served output directory (`generated_site`, a job's `site/`) is a symlink
+to an immutable release. A run writes into a private staging directory and
+`publish()` hardlinks a snapshot of it into a new release, then swaps the
+symlink with a single rename, so the preview and the ZIP only ever see
+complete trees. Because every writer replaces files by rename
+(`atomic_write_text`), a hardlinked snapshot is never changed by later writes
+to staging. Old releases and abandoned staging directories are renamed aside
+and deleted on a background thread, never on the request path.
+
+A served build can differ from what the run wrote (the build optimizer
+minifies and bundles): `derive()` gives a hardlinked copy to rewrite, and
+`publish(staging, build)` serves the build while keeping the staging snapshot
+beside the release as its source. The next refine starts from that source, so
+generated files are never re-edited in their optimized form.
+
+The same property makes change detection free: a file that did not change
+since the previous release is the same inode in both, so `publish()` reports
+exactly the paths that changed (to `on_publish`, e.g. for live reload).
+
+    ws = Workspace(root)
+    with ws.staged(fresh=True) as staging, use_project_root(staging):
+        ...              # coder steps call publish_step() as they finish
+        ws.publish(staging)
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+
+def atomic_write_text(path: Path, content: str, encoding: str = "utf-8") -> None:
+    """Write `content` to a temp file beside `path`, then rename it over `path`."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)  # mkstemp creates 0600
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def remove_later(path: Path) -> None:
+    """Rename `path` aside (instant) and delete it on a background thread."""
+    path = Path(path)
+    if not path.exists() and not path.is_symlink():
+        return
+    trash = path
+    if not path.name.startswith(".trash-"):
+        trash = path.with_name(f".trash-{path.name}-{uuid.uuid4().hex[:8]}")
+        try:
+            os.rename(path, trash)
+        except OSError:
+            trash = path
+    if trash.is_symlink() or trash.is_file():
+        trash.unlink(missing_ok=True)
+        return
+    threading.Thread(target=shutil.rmtree, args=(trash, True), name="workspace-rm",
+                     daemon=True).start()
+
+
+def _link_tree(src: Path, dst: Path) -> None:
+    """Snapshot `src` into `dst` with hardlinks (copies where linking is not possible)."""
+    dst.mkdir(parents=True, exist_ok=True)
+    for dirpath, dirnames, filenames in os.walk(src):
+        rel = Path(dirpath).relative_to(src)
+        for d in dirnames:
+            (dst / rel / d).mkdir(exist_ok=True)
+        for name in filenames:
+            if name.endswith(".tmp") and name.startswith("."):
+                continue  # a write in progress; its rename lands in the next snapshot
+            source, target = Path(dirpath) / name, dst / rel / name
+            try:
+                os.link(source, target)
+            except FileNotFoundError:
+                continue  # replaced or removed mid-walk
+            except OSError:
+                shutil.copyfile(source, target)  # not copy2: a read-only blob's mode stays behind
+                os.chmod(target, 0o644)
+
+
+def _changed_files(previous: Optional[Path], release: Path) -> list[str]:
+    """Relative paths added, replaced or removed in `release` compared with `previous`."""
+    def inodes(tree: Optional[Path]) -> dict[str, int]:
+        found: dict[str, int] = {}
+        if tree is None:
+            return found
+        for dirpath, _, filenames in os.walk(tree):
+            for name in filenames:
+                path = Path(dirpath) / name
+                try:
+                    found[path.relative_to(tree).as_posix()] = path.stat().st_ino
+                except FileNotFoundError:
+                    continue
+        return found
+
+    before, after = inodes(previous), inodes(release)
+    return sorted(rel for rel in before.keys() | after.keys() if before.get(rel) != after.get(rel))
+
+
+def _source_of(release: Path) -> Path:
+    """Where the unoptimized tree a release was built from is kept."""
+    return release.with_name(f"{release.name}.source")
+
+
+class Workspace:
+    """A served directory whose content is swapped in atomically from staging."""
+
+    def __init__(self, root: Path, on_publish: Optional[Callable[[list[str]], None]] = None):
+        self.root = Path(root)
+        self.releases = self.root.parent / f".{self.root.name}.releases"
+        # Called with the changed paths after each swap that changed something
+        self.on_publish = on_publish
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[Path]:
+        """The directory currently being served, if any."""
+        if self.root.is_symlink():
+            target = self.root.resolve()
+            return target if target.is_dir() else None
+        return self.root if self.root.is_dir() else None
+
+    def source(self) -> Optional[Path]:
+        """The tree the current release was built from (the release itself unless derived)."""
+        current = self.current()
+        if current is None:
+            return None
+        source = _source_of(current)
+        return source if source.is_dir() else current
+
+    def begin(self, fresh: bool) -> Path:
+        """A new staging directory: empty, or seeded from the current source when refining."""
+        self.releases.mkdir(parents=True, exist_ok=True)
+        for leftover in self.releases.glob(".trash-*"):  # interrupted background deletes
+            remove_later(leftover)
+        staging = self.releases / f"staging-{uuid.uuid4().hex[:8]}"
+        source = self.source()
+        if fresh or source is None:
+            staging.mkdir()
+        else:
+            _link_tree(source, staging)
+        return staging
+
+    def derive(self, staging: Path) -> Path:
+        """A private hardlinked copy of `staging` for a build step to rewrite (by rename)."""
+        build = self.releases / f"build-{uuid.uuid4().hex[:8]}"
+        _link_tree(staging, build)
+        return build
+
+    def publish(self, staging: Path, build: Optional[Path] = None) -> Path:
+        """
+        Snapshot `staging` as a new release and atomically make it the served directory.
+        With `build` (from `derive()`), the build is served and `staging` kept as its source.
+        """
+        with self._lock:
+            release = self.releases / f"r-{time.time_ns()}"
+            if build is not None:
+                _link_tree(staging, _source_of(release))
+            _link_tree(build if build is not None else staging, release)
+            previous = self.current()
+            changed = _changed_files(previous, release) if self.on_publish is not None else []
+            self._swap(release)
+            if previous is not None and previous.parent.resolve() == self.releases.resolve():
+                remove_later(previous)
+                remove_later(_source_of(previous))
+        if changed:
+            self.on_publish(changed)
+        return release
+
+    def _swap(self, release: Path) -> None:
+        legacy = None
+        if self.root.exists() and not self.root.is_symlink():
+            # A plain directory (older runs, or no symlink support): move it aside.
+            legacy = self.releases / f"legacy-{uuid.uuid4().hex[:8]}"
+            os.rename(self.root, legacy)
+        link = self.root.with_name(f".{self.root.name}.{uuid.uuid4().hex[:8]}.link")
+        try:
+            os.symlink(os.path.relpath(release, self.root.parent), link, target_is_directory=True)
+            os.replace(link, self.root)
+        except OSError:
+            # No symlinks (e.g. Windows without the privilege): rename-swap, briefly missing.
+            link.unlink(missing_ok=True)
+            os.rename(release, self.root)
+        if legacy is not None:
+            remove_later(legacy)
+
+    def discard(self, staging: Path) -> None:
+        remove_later(staging)
+
+    @contextmanager
+    def staged(self, fresh: bool) -> Iterator[Path]:
+        """
+        Stage a run; `publish_step()` inside the block publishes progress.
+        Staging is always discarded.
+        """
+        staging = self.begin(fresh)
+        token = _active.set((self, staging))
+        try:
+            yield staging
+        finally:
+            _active.reset(token)
+            self.discard(staging)
+
+
+_active: ContextVar[Optional[tuple[Workspace, Path]]] = ContextVar("active_workspace", default=None)
+
+
+def publish_step() -> None:
+    """Publish the active run's staging directory (no-op outside `Workspace.staged`)."""
+    active = _active.get()
+    if active is not None:
+        workspace, staging = active
+        workspace.publish(staging)
@@ -4,145 +4,139 @@ import os
 
 os.environ["no_proxy"] = "localhost,127.0.0.1,::1"
 
-import shutil
-import time
-import zipfile
+import asyncio
+import hashlib
+import hmac
+import json
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Literal, Optional
 
 import gradio as gr
-from fastapi import FastAPI, Response
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from pydantic import BaseModel, Field
 
 # --- your agent + tools ---
-from agent.graph import agent
 from agent.tools import PROJECT_ROOT, init_project_root
+from artifacts import ArtifactStore
+from debug_config import DebugConfig
+from jobs import (
+    CANCELLED, PARTIAL, SUCCEEDED, TERMINAL, JobManager, JobStore, QueueFull, site_dir,
+    workspace_for,
+)
+from scheduler import BATCH, INTERACTIVE
 
 
 # -----------------------
-# Helpers
+# Jobs (the Gradio UI is one client of the job API)
 # -----------------------
-def _reset_output_dir() -> None:
-    if PROJECT_ROOT.exists():
-        shutil.rmtree(PROJECT_ROOT, ignore_errors=True)
-    PROJECT_ROOT.mkdir(parents=True, exist_ok=True)
-
-def _zip_project(dir_path: Path) -> str:
-    zip_path = (dir_path.parent / f"{dir_path.name}.zip").resolve()
-    if zip_path.exists():
-        try:
-            zip_path.unlink()
-        except Exception:
-            pass
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(dir_path):
-            for fn in files:
-                full = Path(root) / fn
-                zf.write(full, arcname=str(full.relative_to(dir_path)))
-    return str(zip_path)
-
-def _dir_has_files(dir_path: Path) -> bool:
-    for _, _, files in os.walk(dir_path):
-        if files:
-            return True
-    return False
-
-def _ensure_placeholder_index(dir_path: Path) -> None:
-    index_path = dir_path / "index.html"
-    if index_path.exists():
-        return
-    items = []
-    for root, _, files in os.walk(dir_path):
-        for fn in sorted(files):
-            full = Path(root) / fn
-            rel = full.relative_to(dir_path).as_posix()
-            if rel == "index.html":
-                continue
-            items.append(f'<li><a href="{rel}" target="_blank" rel="noopener">{rel}</a></li>')
-    listing = "\n".join(items) or "<li>(No files found)</li>"
-    html = f"""<!doctype html>
-<html><head>
-  <meta charset="utf-8" />
-  <title>Generated Output (Fallback)</title>
-  <style>
-    body {{ font-family: system-ui, Arial, sans-serif; margin: 24px; }}
-    .note {{ background: #fff8e1; border: 1px solid #ffe082; padding: 12px; border-radius: 8px; margin-bottom: 16px; }}
-    a {{ color: #2563eb; }}
-  </style>
-</head>
-<body>
-  <h1>Generated Output (Fallback)</h1>
-  <div class="note">No <code>index.html</code> was generated by the pipeline, so this fallback page lists all files created.</div>
-  <ul>{listing}</ul>
-</body></html>"""
-    index_path.write_text(html, encoding="utf-8")
-
-def _invoke_agent_with_retries(user_prompt: str, recursion_limit: int) -> None:
-    recursion_limit = int(max(5, min(recursion_limit, 40)))
-    max_retries = 3
-    base_delay = 8
-    for attempt in range(1, max_retries + 1):
-        try:
-            agent.invoke({"user_prompt": user_prompt}, {"recursion_limit": recursion_limit})
-            return
-        except Exception as e:
-            msg = str(e).lower()
-            retryable = ("429" in msg) or ("rate limit" in msg) or ("tpm" in msg)
-            if attempt < max_retries and retryable:
-                time.sleep(base_delay * attempt)
-                recursion_limit = max(5, recursion_limit - 5)
-                continue
-            raise
+job_store = JobStore(Path(DebugConfig.JOBS_DIR) / "jobs.sqlite3")
+jobs = JobManager(job_store)
+_session_jobs: dict[str, str] = {}  # Gradio session -> the job it is currently watching
+
+def _tenant(headers, client_host: Optional[str]) -> str:
+    """
+    Scheduling identity: a configured API key (hashed, never stored raw), else
+    the client address. Both headers are client-controlled, so an unknown key
+    is ignored and X-Forwarded-For is only read behind a trusted proxy.
+    """
+    key = headers.get("x-api-key")
+    if key and any(hmac.compare_digest(key.encode(), k.encode()) for k in DebugConfig.JOB_API_KEYS):
+        return "key:" + hashlib.sha256(key.encode()).hexdigest()[:12]
+    host = client_host
+    if host in DebugConfig.TRUSTED_PROXIES:
+        # The nearest hop our proxies did not add is the client; anything left of it may be forged.
+        hops = [h.strip() for h in headers.get("x-forwarded-for", "").split(",") if h.strip()]
+        host = next((h for h in reversed(hops) if h not in DebugConfig.TRUSTED_PROXIES), host)
+    return "ip:" + (host or "unknown")
 
 def _iframe(url: str, h: int = 700) -> str:
     return f'<iframe src="{url}" style="width:100%;height:{h}px;border:1px solid #ddd;border-radius:8px;"></iframe>'
 
-def run_generation(prompt: str, recursion_limit: int = 20):
+def _preview_html(url: str) -> str:
+    return (
+        "<div style='margin-bottom:10px'>"
+        f"<a href='{url}' target='_blank' rel='noopener'>Open Preview in new tab</a>"
+        "</div>" + _iframe(url)
+    )
+
+def run_generation(
+    prompt: str,
+    max_input_tokens: int = DebugConfig.BUDGET_MAX_INPUT_TOKENS,
+    max_output_tokens: int = DebugConfig.BUDGET_MAX_OUTPUT_TOKENS,
+    max_minutes: float = DebugConfig.BUDGET_MAX_SECONDS / 60,
+    refine_from: str | None = None,
+    tenant: str = "anonymous",
+    session: str | None = None,
+):
+    """
+    Submit an interactive job and yield (logs, zip_path, preview_html, job_id)
+    as it progresses. A newer submission from the same `session` cancels this
+    one, and so does closing the generator (the client went away).
+    """
     logs = []
     try:
-        logs.append("🚧 Preparing output folder…")
-        _reset_output_dir()
+        job_id, wait = jobs.submit(
+            prompt,
+            tenant=tenant,
+            priority=INTERACTIVE,
+            max_input_tokens=int(max_input_tokens),
+            max_output_tokens=int(max_output_tokens),
+            max_seconds=float(max_minutes) * 60,
+            refine_from=refine_from,
+        )
+    except QueueFull as e:
+        yield f"⏳ {e}", None, "<div style='color:#b45309'>Server busy.</div>", refine_from
+        return
 
-        logs.append("🤖 Running LangGraph pipeline (planner → architect → coder)…")
-        _invoke_agent_with_retries(prompt, recursion_limit)
+    if session is not None:
+        superseded = _session_jobs.get(session)
+        _session_jobs[session] = job_id
+        if superseded is not None:
+            jobs.cancel(superseded)
 
-        if not _dir_has_files(PROJECT_ROOT):
-            logs.append("⚠️ Pipeline finished but wrote no files.")
-            return "\n".join(logs), None, "<div style='color:#b45309'>No files were generated.</div>"
+    def superseded() -> bool:
+        return session is not None and _session_jobs.get(session) != job_id
 
-        _ensure_placeholder_index(PROJECT_ROOT)
+    try:
+        logs.append(f"🧾 Job {job_id} queued" + (f" (about {wait:.0f}s wait)." if wait else "."))
+        # Rendered once: the page inside live-reloads as files are published.
+        preview = _preview_html(f"/jobs/{job_id}/preview/index.html")
+        yield "\n".join(logs), None, preview, refine_from
+        for event in jobs.follow(job_id):
+            if superseded():
+                break
+            if event["kind"] == "log":
+                logs.append(event["data"]["message"])
+                yield "\n".join(logs), None, gr.update(), refine_from
+    finally:
+        replaced = superseded()
+        if session is not None and not replaced:
+            del _session_jobs[session]
+        job = job_store.get(job_id)
+        if job is not None and job["status"] not in TERMINAL:
+            jobs.cancel(job_id)  # nobody is watching any more (disconnect or superseded)
+    if replaced:
+        return  # the newer run owns the outputs now
 
-        logs.append("🧩 Build complete. Creating ZIP…")
-        zip_path = _zip_project(PROJECT_ROOT)
+    job = job_store.get(job_id)
+    result = (job or {}).get("result") or {}
+    if job is None or (job["status"] not in (SUCCEEDED, PARTIAL) and not result.get("zip_url")):
+        return_job = refine_from
+        html = "<div style='color:red'>Generation failed.</div>"
+        if job is not None and job["status"] == CANCELLED:
+            html = "<div style='color:#b45309'>Generation cancelled.</div>"
+        yield "\n".join(logs), None, html, return_job
+        return
 
-        preview_url = "/preview/index.html"
-        logs.append(f"🌐 Preview ready at {preview_url}")
-        logs.append("✅ Done.")
-        preview_html = (
-            "<div style='margin-bottom:10px'>"
-            "<a href='/preview/index.html' target='_blank' rel='noopener'>Open Preview in new tab</a>"
-            "</div>" + _iframe(preview_url)
-        )
-        return "\n".join(logs), zip_path, preview_html
-
-    except Exception as e:
-        emsg = str(e)
-        friendly = [f"❌ Error: {emsg}"]
-        if any(k in emsg.lower() for k in ["429", "rate limit", "tpm"]):
-            friendly.append("💡 Tip: Rate limit hit. Retry later or lower Recursion Limit.")
-        if _dir_has_files(PROJECT_ROOT):
-            friendly.append("⚠️ Partial output detected. Zipping what exists…")
-            _ensure_placeholder_index(PROJECT_ROOT)
-            zip_path = _zip_project(PROJECT_ROOT)
-            preview_url = "/preview/index.html"
-            friendly.append(f"🌐 Preview (partial) at {preview_url}")
-            preview_html = (
-                "<div style='margin-bottom:10px'>"
-                "<a href='/preview/index.html' target='_blank' rel='noopener'>Open Preview in new tab</a>"
-                "</div>" + _iframe(preview_url)
-            )
-            return "\n".join(friendly), zip_path, preview_html
-        friendly.append("🛑 No files were generated.")
-        return "\n".join(friendly), None, "<div style='color:red'>Generation failed.</div>"
+    preview_url = result["preview_url"]
+    label = {SUCCEEDED: "Preview", CANCELLED: "Preview (cancelled, partial)"}.get(
+        job["status"], "Preview (partial)")
+    logs.append(f"🌐 {label} ready at {preview_url}")
+    zip_path = str(workspace_for(job_id) / "site.zip") if result.get("zip_url") else None
+    yield "\n".join(logs), zip_path, gr.update(), job_id  # the iframe already shows the final files
 
 # -----------------------
 # Build the Gradio UI
@@ -157,18 +151,39 @@ with gr.Blocks(analytics_enabled=False) as demo:
             value="HTML、CSS、JavaScriptを用いて、モダンなデザインのTODOアプリを構築してください。",
         )
     with gr.Row():
-        recursion = gr.Slider(5, 40, value=20, step=5, label="Recursion Limit (lower = fewer tokens)")
+        max_input = gr.Number(value=DebugConfig.BUDGET_MAX_INPUT_TOKENS, precision=0,
+                              label="Max input tokens")
+        max_output = gr.Number(value=DebugConfig.BUDGET_MAX_OUTPUT_TOKENS, precision=0,
+                               label="Max output tokens")
+        max_minutes = gr.Number(value=DebugConfig.BUDGET_MAX_SECONDS / 60, label="Max minutes")
+        refine = gr.Checkbox(value=False,
+                             label="Refine previous result (only regenerate changed files)")
     with gr.Row():
         run_btn = gr.Button("Generate", variant="primary")
     logs = gr.Textbox(label="Logs", lines=14)
     zip_btn = gr.DownloadButton(label="Download ZIP", value=None)
     preview = gr.HTML()
+    last_job = gr.State(None)  # job to refine from
+
+    def on_click(p, mi, mo, mm, f, job_id, request: gr.Request):
+        tenant = _tenant(request.headers, request.client.host if request.client else None)
+        yield from run_generation(p, mi, mo, mm, job_id if f else None, tenant,
+                                  request.session_hash)
 
-    def on_click(p, r):
-        out_logs, out_zip, out_iframe = run_generation(p, r)
-        return out_logs, out_zip, out_iframe
+    def on_unload(request: gr.Request):
+        job_id = _session_jobs.pop(request.session_hash, None)
+        if job_id is not None:
+            jobs.cancel(job_id)
 
-    run_btn.click(on_click, [prompt, recursion], [logs, zip_btn, preview])
+    # Handlers only follow jobs (workers do the work), so a second click runs
+    # at once and supersedes the first instead of queueing behind it.
+    run_btn.click(
+        on_click,
+        [prompt, max_input, max_output, max_minutes, refine, last_job],
+        [logs, zip_btn, preview, last_job],
+        concurrency_limit=None,
+    )
+    demo.unload(on_unload)  # tab closed: stop spending tokens on a run nobody will see
 
 # -----------------------
 # ONE FastAPI app for everything
@@ -176,7 +191,16 @@ with gr.Blocks(analytics_enabled=False) as demo:
 init_project_root()
 PROJECT_ROOT.mkdir(parents=True, exist_ok=True)  # ensure dir exists for mount
 
-fastapi_app = FastAPI()
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Started here rather than at import: spawned worker processes re-import this module.
+    jobs.start()
+    try:
+        yield
+    finally:
+        jobs.shutdown()
+
+fastapi_app = FastAPI(lifespan=lifespan)
 
 # Static preview (points to PROJECT_ROOT)
 fastapi_app.mount("/preview", StaticFiles(directory=str(PROJECT_ROOT), html=True), name="preview")
@@ -194,6 +218,181 @@ def manifest_route():
         "icons": [],
     }
 
+# -----------------------
+# Job API
+# -----------------------
+class JobRequest(BaseModel):
+    prompt: str = Field(min_length=1)
+    max_input_tokens: Optional[int] = Field(None, gt=0)
+    max_output_tokens: Optional[int] = Field(None, gt=0)
+    max_seconds: Optional[float] = Field(None, gt=0)
+    refine_from: Optional[str] = Field(None, description="Job id whose result should be refined")
+    optimize: Optional[bool] = Field(
+        None, description="Minify, bundle and dedupe the site (default: OPTIMIZE_BUILD)")
+    priority: Literal["interactive", "batch"] = BATCH
+
+def _job_or_404(job_id: str) -> dict:
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def _public_job(job: dict) -> dict:
+    return {k: job[k] for k in ("id", "status", "priority", "prompt", "options", "result", "error",
+                                "created_at", "started_at", "finished_at")}
+
+def _resolve_file(root: Path, rel: str) -> Optional[Path]:
+    base = root.resolve()
+    target = (base / rel).resolve()
+    if base not in target.parents and target != base:
+        raise HTTPException(status_code=404)
+    if target.is_dir():
+        target = target / "index.html"
+    return target if target.is_file() else None
+
+def _serve_file(root: Path, rel: str) -> FileResponse:
+    target = _resolve_file(root, rel)
+    if target is None:
+        raise HTTPException(status_code=404)
+    # Revalidate: files change during a run
+    return FileResponse(target, headers={"Cache-Control": "no-cache"})
+
+# Injected into preview pages while their job runs: reload CSS in place, the page for anything else.
+_LIVE_RELOAD = """<script>(function () {
+  var base = new URL("%(base)s", location.href);
+  var events = new EventSource("%(events)s");
+  events.addEventListener("files", function (e) {
+    var changed = JSON.parse(e.data).changed || [];
+    var css = changed.filter(function (p) { return /\.css$/i.test(p); });
+    if (!changed.length || css.length < changed.length) { location.reload(); return; }
+    var paths = css.map(function (p) { return new URL(p, base).pathname; });
+    document.querySelectorAll('link[rel~="stylesheet"]').forEach(function (link) {
+      var url = new URL(link.getAttribute("href"), location.href);
+      if (paths.indexOf(url.pathname) >= 0) {
+        url.search = "v=" + e.lastEventId;
+        link.href = url.href;
+      }
+    });
+  });
+  events.addEventListener("status", function (e) {
+    if (%(terminal)s.indexOf(JSON.parse(e.data).status) >= 0) { events.close(); }
+  });
+})();</script>"""
+
+_WAITING_PAGE = """<!doctype html>
+<html><head><meta charset="utf-8"><title>Generating…</title></head>
+<body style="font-family: system-ui, Arial, sans-serif; color: #555; margin: 24px">
+<p>⏳ Waiting for the first files…</p></body></html>"""
+
+def _live_preview(job_id: str, path: str) -> Optional[HTMLResponse]:
+    """
+    While a job runs, its HTML pages carry the live-reload script. A page (or
+    directory) that does not exist yet gets a placeholder that reloads; any
+    other missing file is left to 404, never answered with HTML.
+    """
+    target = _resolve_file(site_dir(job_id), path)
+    if target is None:
+        if Path(path).suffix.lower() not in ("", ".html", ".htm"):
+            return None
+    elif target.suffix.lower() not in (".html", ".htm"):
+        return None
+    html = (_WAITING_PAGE if target is None
+            else target.read_text(encoding="utf-8", errors="replace"))
+    # Only changes published after this page was rendered should reload it.
+    after = job_store.last_event_seq(job_id)
+    script = _LIVE_RELOAD % {
+        "base": f"/jobs/{job_id}/preview/",
+        "events": f"/jobs/{job_id}/events?after={after}",
+        "terminal": json.dumps(list(TERMINAL)),
+    }
+    cut = html.lower().rfind("</body>")
+    html = html[:cut] + script + html[cut:] if cut >= 0 else html + script
+    return HTMLResponse(html, headers={"Cache-Control": "no-store"})
+
+@fastapi_app.post("/jobs", status_code=202)
+def create_job_route(req: JobRequest, request: Request):
+    if req.refine_from is not None:
+        _job_or_404(req.refine_from)
+    tenant = _tenant(request.headers, request.client.host if request.client else None)
+    try:
+        job_id, wait = jobs.submit(req.prompt, tenant=tenant, **req.model_dump(exclude={"prompt"}))
+    except QueueFull as e:
+        headers = {"Retry-After": str(max(1, round(e.retry_after)))} if e.retry_after else None
+        detail = {"error": str(e), "retry_after": e.retry_after,
+                  "estimated_wait_seconds": e.estimated_wait}
+        raise HTTPException(status_code=429, detail=detail, headers=headers) from e
+    return {
+        "id": job_id,
+        "estimated_wait_seconds": wait,
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+    }
+
+@fastapi_app.get("/jobs/{job_id}")
+def get_job_route(job_id: str):
+    return _public_job(_job_or_404(job_id))
+
+@fastapi_app.get("/jobs/{job_id}/events")
+async def job_events_route(job_id: str, request: Request, after: int = 0):
+    _job_or_404(job_id)
+    last = request.headers.get("last-event-id", "")
+    # A reconnecting EventSource resumes where it was
+    after = int(last) if last.isdigit() else after
+
+    async def stream():
+        nonlocal after
+        while not await request.is_disconnected():
+            job = await asyncio.to_thread(job_store.get, job_id)
+            for event in await asyncio.to_thread(job_store.events, job_id, after):
+                after = event["seq"]
+                yield f"id: {after}\nevent: {event['kind']}\ndata: {json.dumps(event['data'])}\n\n"
+            if job is None or job["status"] in TERMINAL:
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@fastapi_app.delete("/jobs/{job_id}")
+def delete_job_route(job_id: str):
+    _job_or_404(job_id)
+    status = jobs.delete(job_id)
+    if status == "running":
+        return Response(status_code=202, content=json.dumps({"id": job_id, "status": "cancelling"}),
+                        media_type="application/json")
+    return Response(status_code=204)
+
+@fastapi_app.get("/jobs/{job_id}/zip")
+def job_zip_route(job_id: str):
+    _job_or_404(job_id)
+    zip_path = workspace_for(job_id) / "site.zip"
+    if not zip_path.is_file():
+        raise HTTPException(status_code=404, detail="No ZIP for this job")
+    return FileResponse(zip_path, filename=f"{job_id}.zip", media_type="application/zip")
+
+@fastapi_app.get("/jobs/{job_id}/preview/{path:path}")
+def job_preview_route(job_id: str, path: str):
+    job = _job_or_404(job_id)
+    if job["status"] not in TERMINAL:
+        live = _live_preview(job_id, path)
+        if live is not None:
+            return live
+    jobs.restore(job_id)  # near-instant hardlink restore if the workspace was cleaned up
+    return _serve_file(site_dir(job_id), path)
+
+@fastapi_app.get("/metrics/scheduler")
+def scheduler_metrics_route():
+    return jobs.scheduler.latency_report()
+
+@fastapi_app.get("/metrics/artifacts")
+def artifact_metrics_route():
+    return ArtifactStore().report()
+
+@fastapi_app.get("/metrics/llm-http")
+def llm_http_metrics_route():
+    # Provider calls happen in the worker processes; each reports its own pool.
+    return {"workers": jobs.worker_status()}
+
 @fastapi_app.get("/favicon.ico")
 def favicon_route():
     return Response(b"", media_type="image/x-icon")
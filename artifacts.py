@@ -0,0 +1,243 @@
+"""
+Content-addressed artifact store for finished runs.
+
+Every file is stored once under `blobs/<sha256[:2]>/<sha256>`, and a run is
+just a manifest (`manifests/<run_id>.json`) mapping relative paths to blob
+hashes. Identical `index.html`/`style.css` files across thousands of runs
+therefore cost the disk once. Workspaces are materialized by hardlinking blobs
+(falling back to a reflink, then a plain copy across filesystems), so
+restoring a past run is near-instant.
+
+Blobs are read-only. The agent's tools replace files by rename
+(`agent.workspace.atomic_write_text`), so a hardlinked workspace can be edited
+without touching the store; `writable=True` gives private copies (reflink or
+copy) for anything that might write in place. Only the links share the
+blobs' 0444 mode: copies are made 0644, and ZIPs record 0644 whatever the
+mode on disk.
+`gc()` removes blobs no manifest references; `report()` gives the dedup ratio.
+
+    python artifacts.py import generated_site generated_site1 ... [--relink]
+    python artifacts.py report
+    python artifacts.py restore <run_id> <dest>
+    python artifacts.py gc
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from debug_config import DebugConfig
+
+_CHUNK = 1024 * 1024
+_FICLONE = 0x40049409  # Linux ioctl: share extents on btrfs/xfs (copy-on-write)
+
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _clone(src: Path, dst: Path, writable: bool = False) -> str:
+    """Make `dst` a copy of `src` as cheaply as the filesystem allows; returns how."""
+    if not writable:
+        try:
+            os.link(src, dst)
+            return "link"
+        except OSError:
+            pass
+    try:
+        import fcntl
+
+        with src.open("rb") as s, dst.open("wb") as d:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        how = "reflink"
+    except (ImportError, OSError):
+        shutil.copyfile(src, dst)
+        how = "copy"
+    dst.chmod(0o644)
+    return how
+
+
+class ArtifactStore:
+    """Blobs keyed by SHA-256 plus one manifest per archived run."""
+
+    def __init__(self, root: Optional[Path] = None):
+        self.root = Path(root or DebugConfig.ARTIFACTS_DIR)
+        self.blobs = self.root / "blobs"
+        self.manifests = self.root / "manifests"
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.manifests.mkdir(parents=True, exist_ok=True)
+
+    def blob_path(self, sha: str) -> Path:
+        return self.blobs / sha[:2] / sha
+
+    def _manifest_path(self, run_id: str) -> Path:
+        return self.manifests / f"{run_id}.json"
+
+    def _put(self, path: Path, sha: str) -> Path:
+        blob = self.blob_path(sha)
+        if blob.exists():
+            os.utime(blob)  # fresh mtime keeps it out of a concurrent gc's reach
+            return blob
+        blob.parent.mkdir(exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=blob.parent, prefix=".tmp-")
+        os.close(fd)
+        tmp_path = Path(tmp)
+        try:
+            shutil.copyfile(path, tmp_path)
+            tmp_path.chmod(0o444)
+            with contextlib.suppress(FileExistsError):
+                os.link(tmp_path, blob)  # first writer wins; identical content either way
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return blob
+
+    # --- runs ---
+    def archive(self, run_id: str, src: Path, meta: Optional[dict[str, Any]] = None,
+                relink: bool = True) -> dict[str, Any]:
+        """
+        Store every file under `src` and write the run's manifest. With
+        `relink`, files in `src` are replaced by hardlinks to their blobs so the
+        workspace itself stops holding a private copy.
+        """
+        src = Path(src)
+        files: dict[str, dict[str, Any]] = {}
+        for path in sorted(p for p in src.rglob("*") if p.is_file() and not p.is_symlink()):
+            sha = _hash_file(path)
+            blob = self._put(path, sha)
+            files[path.relative_to(src).as_posix()] = {"sha256": sha, "size": path.stat().st_size}
+            if relink and not path.samefile(blob):
+                tmp = path.with_name(f".{path.name}.relink")
+                tmp.unlink(missing_ok=True)
+                try:
+                    os.link(blob, tmp)
+                    os.replace(tmp, path)
+                except OSError:
+                    tmp.unlink(missing_ok=True)  # other filesystem: keep the private copy
+        manifest = {"run_id": run_id, "created_at": time.time(), "meta": meta or {}, "files": files}
+        target = self._manifest_path(run_id)
+        tmp = target.with_name(f".{target.name}.tmp")
+        tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        os.replace(tmp, target)
+        return manifest
+
+    def has(self, run_id: str) -> bool:
+        return self._manifest_path(run_id).exists()
+
+    def manifest(self, run_id: str) -> Optional[dict[str, Any]]:
+        path = self._manifest_path(run_id)
+        if not path.exists():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def runs(self) -> Iterator[dict[str, Any]]:
+        for path in sorted(self.manifests.glob("*.json")):
+            yield json.loads(path.read_text(encoding="utf-8"))
+
+    def materialize(self, run_id: str, dest: Path, writable: bool = False) -> dict[str, int]:
+        """Recreate a run's files under `dest`; returns how many were linked, reflinked, copied."""
+        manifest = self.manifest(run_id)
+        if manifest is None:
+            raise KeyError(f"No archived run {run_id!r}")
+        dest = Path(dest)
+        counts = {"link": 0, "reflink": 0, "copy": 0}
+        for rel, entry in manifest["files"].items():
+            target = dest / rel
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.unlink(missing_ok=True)
+            counts[_clone(self.blob_path(entry["sha256"]), target, writable)] += 1
+        return counts
+
+    def delete(self, run_id: str) -> None:
+        """Drop a run's manifest; its blobs go at the next gc() if nothing else uses them."""
+        self._manifest_path(run_id).unlink(missing_ok=True)
+
+    # --- maintenance ---
+    def gc(self, grace_seconds: Optional[float] = None) -> dict[str, int]:
+        """Remove blobs no manifest references (sparing ones touched within the grace period)."""
+        grace = DebugConfig.ARTIFACT_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+        live = {entry["sha256"] for run in self.runs() for entry in run["files"].values()}
+        cutoff = time.time() - grace
+        removed = freed = 0
+        for blob in self.blobs.glob("*/*"):
+            if blob.name.startswith(".tmp-") or blob.name in live:
+                continue
+            stat = blob.stat()
+            if stat.st_mtime > cutoff:
+                continue
+            blob.unlink(missing_ok=True)
+            removed += 1
+            freed += stat.st_size
+        return {"blobs_removed": removed, "bytes_freed": freed}
+
+    def report(self) -> dict[str, Any]:
+        """Logical (sum over runs) vs physical (unique blobs) size and the resulting dedup ratio."""
+        runs = files = logical = 0
+        referenced: set[str] = set()
+        for run in self.runs():
+            runs += 1
+            for entry in run["files"].values():
+                files += 1
+                logical += entry["size"]
+                referenced.add(entry["sha256"])
+        blobs = [p for p in self.blobs.glob("*/*") if not p.name.startswith(".tmp-")]
+        physical = sum(p.stat().st_size for p in blobs)
+        return {
+            "runs": runs,
+            "files": files,
+            "blobs": len(blobs),
+            "unreferenced_blobs": sum(1 for p in blobs if p.name not in referenced),
+            "logical_bytes": logical,
+            "physical_bytes": physical,
+            "dedup_ratio": round(logical / physical, 2) if physical else None,
+        }
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(description="Content-addressed artifact store")
+    parser.add_argument("--root", default=None,
+                        help="Store directory (default: DebugConfig.ARTIFACTS_DIR)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import",
+                         help="Archive existing output directories (run id = directory name)")
+    imp.add_argument("dirs", nargs="+")
+    imp.add_argument("--relink", action="store_true",
+                     help="Replace the source files with (read-only) hardlinks to their blobs")
+    sub.add_parser("report", help="Show the dedup report")
+    restore = sub.add_parser("restore", help="Materialize an archived run")
+    restore.add_argument("run_id")
+    restore.add_argument("dest")
+    restore.add_argument("--writable", action="store_true",
+                         help="Private copies instead of hardlinks")
+    gc = sub.add_parser("gc", help="Delete unreferenced blobs")
+    gc.add_argument("--grace", type=float, default=None,
+                    help="Seconds to spare recently written blobs")
+    args = parser.parse_args()
+
+    store = ArtifactStore(Path(args.root) if args.root else None)
+    if args.command == "import":
+        for d in args.dirs:
+            manifest = store.archive(Path(d).name, Path(d), relink=args.relink)
+            print(f"📦 {d}: {len(manifest['files'])} files")
+        print(json.dumps(store.report(), indent=2))
+    elif args.command == "report":
+        print(json.dumps(store.report(), indent=2))
+    elif args.command == "restore":
+        print(json.dumps(store.materialize(args.run_id, Path(args.dest), args.writable)))
+    elif args.command == "gc":
+        print(json.dumps(store.gc(args.grace)))
+
+
+if __name__ == "__main__":
+    _main()
@@ -9,7 +9,8 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from agent.graph import agent
-from debug_utils import AgentDebugger, check_file_operations, monitor_memory_usage
+from agent.profiling import get_profiler
+from debug_utils import check_file_operations, get_debugger, monitor_memory_usage
 import traceback
 
 def test_agent_with_debugging():
@@ -18,8 +19,8 @@ def test_agent_with_debugging():
     print("🔧 Starting Agent Debug Session")
     print("=" * 50)
     
-    # Initialize debugger
-    debugger = AgentDebugger()
+    # Shared debugger for the whole session (bounded ring buffer)
+    debugger = get_debugger()
     
     # Check system prerequisites
     print("\n📋 Checking System Prerequisites:")
@@ -43,6 +44,10 @@ def test_agent_with_debugging():
     # Monitor initial memory
     initial_memory = monitor_memory_usage()
     print(f"📊 Initial memory usage: {initial_memory:.2f} MB")
+    profiler = get_profiler()
+    if profiler.enabled:
+        print("🔬 Per-node memory profiling enabled (tracemalloc)")
+        profiler.record_run("baseline")
     
     # Test prompts
     test_prompts = [
@@ -76,6 +81,9 @@ def test_agent_with_debugging():
             # Check memory usage
             current_memory = monitor_memory_usage()
             print(f"📊 Memory usage after test {i}: {current_memory:.2f} MB")
+            if profiler.enabled:
+                sample = profiler.record_run(f"test {i}")
+                print(f"🔬 Traced memory after test {i}: {sample['traced_kb']:.1f} KB")
             
         except Exception as e:
             print(f"❌ Test {i} failed: {e}")
@@ -96,6 +104,10 @@ def test_agent_with_debugging():
     final_memory = monitor_memory_usage()
     print(f"📊 Final memory usage: {final_memory:.2f} MB")
     print(f"📈 Memory increase: {final_memory - initial_memory:.2f} MB")
+    if profiler.enabled:
+        leak = profiler.leak_check()
+        status = "⚠️ suspected leak" if leak["suspected_leak"] else "✅ no steady growth"
+        print(f"🔬 Leak check: {status} ({leak['growth_kb']:.1f} KB over {leak['runs']} samples)")
     
     print("\n🎉 Debug session completed!")
     return True
@@ -142,7 +154,7 @@ def interactive_debug():
     print("Enter prompts to test the agent interactively.")
     print("Type 'quit' to exit, 'memory' to check memory, 'help' for commands.")
     
-    debugger = AgentDebugger()
+    debugger = get_debugger()
     
     while True:
         try:
@@ -184,6 +196,10 @@ if __name__ == "__main__":
     print("🐛 Agent Debugging Tool")
     print("=" * 25)
     
+    if "--profile-memory" in sys.argv:
+        sys.argv.remove("--profile-memory")
+        get_profiler().start()
+    
     if len(sys.argv) > 1:
         mode = sys.argv[1].lower()
         
@@ -196,8 +212,10 @@ if __name__ == "__main__":
         else:
             print("❌ Unknown mode. Use: test, components, or interactive")
     else:
-        print("📖 Usage: python debug_agent.py [test|components|interactive]")
+        print("📖 Usage: python debug_agent.py [test|components|interactive] [--profile-memory]")
         print("\nModes:")
         print("  test        - Run comprehensive tests")
         print("  components  - Test individual agent components")
         print("  interactive - Interactive debugging session")
+        print("\nOptions:")
+        print("  --profile-memory - Record per-node/tool tracemalloc stats in the debug report")
@@ -21,19 +21,124 @@ class DebugConfig:
     DEFAULT_RECURSION_LIMIT = 100
     TEST_RECURSION_LIMIT = 50
     MAX_STEPS_PER_AGENT = 10
+    LIST_FILES_PAGE_SIZE = 200  # default `limit` of the list_files tool
+    # Hard cap on one list_files result (keeps the coder's context small)
+    LIST_FILES_MAX_CHARS = 4000
+    LIST_FILES_INDEX_CACHE = 32  # project roots whose file index is kept in memory
+    LIST_FILES_IGNORE = [  # gitignore-style; the project's own .gitignore is added on top
+        ".git/", "node_modules/", "bower_components/", "__pycache__/", ".venv/", "venv/",
+        "dist/", "build/", ".next/", ".cache/", "coverage/", "*.map", ".DS_Store",
+    ]
+    # Plans this large: contract + per-file calls
+    ARCHITECT_FANOUT_MIN_FILES = int(os.getenv("ARCHITECT_FANOUT_MIN_FILES", "6"))
+    ARCHITECT_FANOUT_WORKERS = 8  # per-file architect calls in flight at once
+    # Extra attempts for one file's tasks before a contract-only task is used
+    ARCHITECT_FILE_RETRIES = 2
+    VALIDATION_MAX_RETRIES = 2  # repair rounds the validator may re-queue to the coder
+    # Correction prompts after a plan/task answer fails local repair (agent/repair.py)
+    STRUCTURED_REPAIR_RETRIES = 1
+    # How much of the failed answer a correction prompt quotes
+    STRUCTURED_REPAIR_ANSWER_CHARS = 4000
+    # Run agent/optimizer.py on the site before it is published
+    OPTIMIZE_BUILD = os.getenv("OPTIMIZE_BUILD", "false").lower() == "true"
     
     # LLM settings
     DEFAULT_MODEL = "openai/gpt-oss-120b"
     FALLBACK_MODEL = "llama3-8b-8192"
     MAX_TOKENS = 4000
     TEMPERATURE = 0.1
+
+    # Shared HTTP pool for provider calls
+    HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+    HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+    HTTP_KEEPALIVE_EXPIRY = 120.0  # seconds an idle connection stays in the pool
+    HTTP_CONNECT_TIMEOUT = 10.0
+    HTTP_READ_TIMEOUT = 120.0
+
+    # LLM backends (agent/backends.py): requests are spread over several keys/endpoints,
+    # least-loaded first
+    GROQ_API_KEYS = os.getenv("GROQ_API_KEYS", "")  # e.g. "gsk_a,gsk_b": one endpoint, several keys
+    # e.g. "gsk_a@https://api.groq.com/openai/v1,k@http://127.0.0.1:8001/v1"
+    LLM_BACKENDS = os.getenv("LLM_BACKENDS", "")
+    # Consecutive 5xx/connection errors before a backend leaves the rotation
+    LLM_BACKEND_MAX_FAILURES = 3
+    LLM_BACKEND_COOLDOWN_SECONDS = 20.0  # rest after a 429 without a Retry-After header
+    LLM_HEALTH_CHECK_SECONDS = 15.0  # how often backends out of rotation are probed
+
+    # Request hedging (agent/hedging.py): a second request when a call is slower than the node's p95
+    HEDGE_ENABLED = os.getenv("LLM_HEDGING", "false").lower() == "true"
+    # Hedge with FALLBACK_MODEL
+    HEDGE_TO_FALLBACK = os.getenv("LLM_HEDGE_TO_FALLBACK", "false").lower() == "true"
+    HEDGE_PERCENTILE = 95.0  # per-node latency percentile after which a call is hedged
+    HEDGE_MIN_SAMPLES = 20  # calls a node needs on record before it is hedged
+    HEDGE_WINDOW = 200  # recent latencies kept per node
+    HEDGE_MIN_DELAY_SECONDS = 2.0  # never hedge sooner than this
+    HEDGE_BUDGET_FRACTION = 0.1  # hedges allowed per call in the last minute
+    HEDGE_MAX_THREADS = 16
+
+    # Job API
+    JOBS_DIR = os.getenv("JOBS_DIR", "jobs_data")  # SQLite store + one workspace per job
+    # Worker processes
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", str(min(4, os.cpu_count() or 1))))
+    # Jobs per worker process at once
+    JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "1"))
+    # Recycle a worker after this many (0 = never)
+    JOB_WORKER_MAX_JOBS = int(os.getenv("JOB_WORKER_MAX_JOBS", "20"))
+    JOB_POLL_SECONDS = 0.5  # how often idle workers look for queued jobs
+    # Keep it on the same disk as the workspaces: they are hardlinked into it
+    ARTIFACTS_DIR = os.getenv("ARTIFACTS_DIR", os.path.join(JOBS_DIR, "artifacts"))
+    ARTIFACT_GC_INTERVAL_SECONDS = 3600.0  # how often the server collects unreferenced blobs
+    ARTIFACT_GC_GRACE_SECONDS = 600.0  # never collect blobs written or reused this recently
+
+    # Fair scheduling across tenants (API keys / Gradio clients)
+    # Share of worker slots per priority lane
+    SCHED_LANE_WEIGHTS = {"interactive": 4.0, "batch": 1.0}
+    SCHED_TENANT_WEIGHTS = {  # e.g. SCHED_TENANT_WEIGHTS="key:ab12cd34ef56=2,key:0123abcd4567=0.5"
+        name.strip(): float(weight)
+        for name, weight in (
+            item.split("=", 1)
+            for item in os.getenv("SCHED_TENANT_WEIGHTS", "").split(",")
+            if "=" in item
+        )
+    }
+    # Tokens per window
+    SCHED_TENANT_TOKEN_QUOTA = int(os.getenv("SCHED_TENANT_TOKEN_QUOTA", "1000000"))
+    SCHED_QUOTA_WINDOW_SECONDS = float(os.getenv("SCHED_QUOTA_WINDOW_SECONDS", "3600"))
+    # Below this much quota left, refuse instead of starting a useless run
+    SCHED_MIN_JOB_TOKENS = 20000
+    # Tenant identity: only these API keys name a tenant; X-Forwarded-For is read only from
+    # these proxies
+    JOB_API_KEYS = [k.strip() for k in os.getenv("JOB_API_KEYS", "").split(",") if k.strip()]
+    TRUSTED_PROXIES = [p.strip() for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip()]
+    SCHED_MAX_QUEUED_PER_TENANT = int(os.getenv("SCHED_MAX_QUEUED_PER_TENANT", "10"))
+    # Reject when the estimate is longer
+    SCHED_MAX_WAIT_SECONDS = {"interactive": 120.0, "batch": 1800.0}
+    SCHED_DEFAULT_RUN_SECONDS = 90.0  # wait estimates before any job has finished
+    # Waiting jobs before POST /jobs is refused
+    JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "50"))
+
+    # Per-run budget (replaces recursion_limit as the cost control)
+    BUDGET_MAX_INPUT_TOKENS = int(os.getenv("BUDGET_MAX_INPUT_TOKENS", "200000"))
+    BUDGET_MAX_OUTPUT_TOKENS = int(os.getenv("BUDGET_MAX_OUTPUT_TOKENS", "40000"))
+    BUDGET_MAX_SECONDS = float(os.getenv("BUDGET_MAX_SECONDS", "600"))
+    BUDGET_LOW_FRACTION = 0.5  # at or below this share left: switch to FALLBACK_MODEL
+    BUDGET_CRITICAL_FRACTION = 0.2  # at or below this share left: skip optional tasks
     
     # Debug flags
     LOG_STATE_TRANSITIONS = True
     LOG_LLM_CALLS = True
     LOG_FILE_OPERATIONS = True
     LOG_MEMORY_USAGE = True
+    # Profile every node and tool with tracemalloc
+    PROFILE_MEMORY = os.getenv("PROFILE_MEMORY", "false").lower() == "true"
+    PROFILE_TOP_N = 5  # allocation sites kept per node/tool
+    LEAK_THRESHOLD_KB = 1024  # retained growth across runs that counts as a suspected leak
     SAVE_DEBUG_REPORTS = True
+    # Transitions kept in memory
+    DEBUG_BUFFER_CAPACITY = int(os.getenv("DEBUG_BUFFER_CAPACITY", "1000"))
+    DEBUG_SNAPSHOT_DIR = "debug_logs"
+    DEBUG_SNAPSHOT_MAX_BYTES = 1024 * 1024  # rotate errors.jsonl past this size
+    DEBUG_SNAPSHOT_BACKUPS = 5  # gzipped rotations to keep
     
     # Test settings
     TEST_PROMPTS = [
@@ -43,11 +148,24 @@ class DebugConfig:
         "Create a responsive navigation bar",
         "Build a simple form with validation"
     ]
+    # `python test_debug.py --perf --update-baseline` rewrites it
+    PERF_BASELINE_FILE = "perf_baseline.json"
+    # Fail past baseline * (1 + margin)
+    PERF_REGRESSION_MARGIN = float(os.getenv("PERF_REGRESSION_MARGIN", "0.5"))
+    PERF_MIN_SLACK_SECONDS = 0.005  # absolute allowance, so sub-millisecond metrics do not flap
+    PERF_REPEATS = 5  # a metric is the median of this many runs
     
     # Error handling
     MAX_RETRIES = 3
     RETRY_DELAY = 1  # seconds
-    TIMEOUT_SECONDS = 30
+    # Per LLM call (provider request)
+    TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+    # Past this the planner/architect fail the run and a coder step (one file) is skipped
+    NODE_TIMEOUT_SECONDS = {
+        "planner": float(os.getenv("PLANNER_TIMEOUT_SECONDS", "120")),
+        "architect": float(os.getenv("ARCHITECT_TIMEOUT_SECONDS", "180")),
+        "coder": float(os.getenv("CODER_STEP_TIMEOUT_SECONDS", "240")),
+    }
     
     @classmethod
     def get_llm_config(cls) -> Dict[str, Any]:
@@ -77,8 +195,10 @@ class DebugConfig:
         """Validate configuration"""
         errors = []
         
-        if not cls.GROQ_API_KEY:
-            errors.append("GROQ_API_KEY environment variable not set")
+        if not (cls.GROQ_API_KEY or cls.GROQ_API_KEYS or cls.LLM_BACKENDS):
+            errors.append(
+                "GROQ_API_KEY (or GROQ_API_KEYS / LLM_BACKENDS) environment variable not set"
+            )
         
         if cls.DEFAULT_RECURSION_LIMIT <= 0:
             errors.append("DEFAULT_RECURSION_LIMIT must be positive")
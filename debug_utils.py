@@ -1,12 +1,22 @@
 """
 Debugging utilities for the agentic AI system
 """
+import gzip
 import json
+import os
+import shutil
+import threading
 import traceback
-from typing import Dict, Any
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, Iterator, Optional
 from pathlib import Path
 import logging
 
+from agent.profiling import get_profiler
+from agent.run_state import RunState
+from debug_config import DebugConfig
+
 # Configure logging
 logging.basicConfig(
     level=logging.DEBUG,
@@ -19,12 +29,69 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+
+def _now() -> str:
+    return str(datetime.now())
+
+
+class RotatingJsonlWriter:
+    """Append-only JSONL file that gzips itself into numbered backups when it grows too big"""
+
+    def __init__(self, path: Path, max_bytes: int, backup_count: int):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._lock = threading.Lock()
+
+    def _backup(self, n: int) -> Path:
+        return self.path.with_name(f"{self.path.name}.{n}.gz")
+
+    def _rotate(self):
+        oldest = self._backup(self.backup_count)
+        oldest.unlink(missing_ok=True)
+        for n in range(self.backup_count - 1, 0, -1):
+            if self._backup(n).exists():
+                os.replace(self._backup(n), self._backup(n + 1))
+        if self.backup_count > 0:
+            with open(self.path, "rb") as src, gzip.open(self._backup(1), "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        self.path.unlink(missing_ok=True)
+
+    def write(self, record: Dict[str, Any]):
+        line = json.dumps(record, separators=(",", ":"), default=str) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if self.path.exists() and self.path.stat().st_size + len(line) > self.max_bytes:
+                self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def read(self) -> Iterator[Dict[str, Any]]:
+        """Yield records oldest first, including the compressed backups"""
+        for n in range(self.backup_count, 0, -1):
+            if self._backup(n).exists():
+                with gzip.open(self._backup(n), "rt", encoding="utf-8") as f:
+                    yield from (json.loads(line) for line in f if line.strip())
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                yield from (json.loads(line) for line in f if line.strip())
+
+
 class AgentDebugger:
     """Debugging utilities for agent execution"""
     
-    def __init__(self, log_file: str = "agent_debug.log"):
+    def __init__(self, log_file: str = "agent_debug.log", capacity: Optional[int] = None,
+                 snapshot_dir: Optional[str] = None):
         self.log_file = log_file
-        self.debug_data = []
+        # Ring buffer: only the most recent transitions are kept in memory
+        self.debug_data = deque(maxlen=capacity or DebugConfig.DEBUG_BUFFER_CAPACITY)
+        self.total_transitions = 0
+        self.agents_executed = set()
+        self.errors = RotatingJsonlWriter(
+            Path(snapshot_dir or DebugConfig.DEBUG_SNAPSHOT_DIR) / "errors.jsonl",
+            max_bytes=DebugConfig.DEBUG_SNAPSHOT_MAX_BYTES,
+            backup_count=DebugConfig.DEBUG_SNAPSHOT_BACKUPS,
+        )
     
     def log_state_transition(self, agent_name: str, state: Dict[str, Any], step: str = ""):
         """Log state transitions between agents"""
@@ -32,36 +99,17 @@ class AgentDebugger:
             "agent": agent_name,
             "step": step,
             "state_keys": list(state.keys()),
-            "timestamp": str(pd.Timestamp.now())
+            # Counts and names only: the plan itself is never copied into the buffer
+            "run": RunState.from_graph(state).brief(),
+            "timestamp": _now()
         }
         
-        # Log specific state information
-        if "plan" in state:
-            plan = state["plan"]
-            debug_info["plan_info"] = {
-                "name": plan.name,
-                "description": plan.description,
-                "techstack": plan.techstack,
-                "files_count": len(plan.files)
-            }
-        
-        if "task_plan" in state:
-            task_plan = state["task_plan"]
-            debug_info["task_plan_info"] = {
-                "steps_count": len(task_plan.implementation_steps),
-                "current_step": getattr(task_plan, 'current_step_idx', 'N/A')
-            }
-        
-        if "coder_state" in state:
-            coder_state = state["coder_state"]
-            debug_info["coder_state_info"] = {
-                "current_step_idx": coder_state.current_step_idx,
-                "total_steps": len(coder_state.task_plan.implementation_steps)
-            }
-        
         self.debug_data.append(debug_info)
+        self.total_transitions += 1
+        self.agents_executed.add(agent_name)
         logger.info(f"State transition: {agent_name} - {step}")
-        logger.debug(f"State data: {json.dumps(debug_info, indent=2)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"State data: {json.dumps(debug_info, indent=2)}")
     
     def log_error(self, agent_name: str, error: Exception, context: Dict[str, Any] = None):
         """Log errors with full context"""
@@ -71,15 +119,15 @@ class AgentDebugger:
             "error_message": str(error),
             "traceback": traceback.format_exc(),
             "context": context or {},
-            "timestamp": str(pd.Timestamp.now())
+            "timestamp": _now()
         }
         
         logger.error(f"Error in {agent_name}: {error}")
-        logger.debug(f"Error details: {json.dumps(error_info, indent=2)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Error details: {json.dumps(error_info, indent=2, default=str)}")
         
-        # Save to file for later analysis
-        with open(f"error_{agent_name}_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.json", "w") as f:
-            json.dump(error_info, f, indent=2)
+        # Append to the rotated, compressed error log for later analysis
+        self.errors.write(error_info)
     
     def log_llm_call(self, agent_name: str, prompt: str, response: Any, model: str = "unknown"):
         """Log LLM calls for debugging"""
@@ -88,7 +136,7 @@ class AgentDebugger:
             "model": model,
             "prompt_length": len(prompt),
             "response_type": type(response).__name__,
-            "timestamp": str(pd.Timestamp.now())
+            "timestamp": _now()
         }
         
         logger.debug(f"LLM call in {agent_name}: {model}")
@@ -96,29 +144,50 @@ class AgentDebugger:
         logger.debug(f"Response type: {type(response).__name__}")
     
     def save_debug_report(self, filename: str = None):
-        """Save complete debug report"""
+        """Save complete debug report, streaming records instead of building one big dict"""
         if not filename:
-            filename = f"debug_report_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.json"
+            filename = f"debug_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
         
-        report = {
-            "debug_data": self.debug_data,
-            "summary": {
-                "total_transitions": len(self.debug_data),
-                "agents_executed": list(set(d["agent"] for d in self.debug_data))
-            }
+        summary = {
+            "total_transitions": self.total_transitions,
+            "retained_transitions": len(self.debug_data),
+            "dropped_transitions": self.total_transitions - len(self.debug_data),
+            "agents_executed": sorted(self.agents_executed)
         }
         
         with open(filename, "w") as f:
-            json.dump(report, f, indent=2)
+            f.write('{"debug_data": [')
+            for i, record in enumerate(list(self.debug_data)):
+                f.write(",\n  " if i else "\n  ")
+                f.write(json.dumps(record, default=str))
+            f.write('\n],\n"summary": ')
+            json.dump(summary, f, indent=2)
+            profiler = get_profiler()
+            if profiler.enabled or profiler.stats:
+                f.write(',\n"memory_profile": ')
+                json.dump(profiler.report(), f, indent=2)
+            f.write("}\n")
         
         logger.info(f"Debug report saved to {filename}")
         return filename
 
+
+_shared_debugger: Optional[AgentDebugger] = None
+_shared_lock = threading.Lock()
+
+def get_debugger() -> AgentDebugger:
+    """Return the debugger shared by everything in this run/process"""
+    global _shared_debugger
+    with _shared_lock:
+        if _shared_debugger is None:
+            _shared_debugger = AgentDebugger()
+        return _shared_debugger
+
 def debug_agent_execution(func):
     """Decorator to add debugging to agent functions"""
     def wrapper(*args, **kwargs):
         agent_name = func.__name__.replace("_agent", "").upper()
-        debugger = AgentDebugger()
+        debugger = get_debugger()
         
         try:
             logger.info(f"Starting {agent_name} agent")
@@ -167,23 +236,12 @@ def check_file_operations():
 
 def monitor_memory_usage():
     """Monitor memory usage during execution"""
-    import psutil
     import os
+
+    import psutil
     
     process = psutil.Process(os.getpid())
     memory_info = process.memory_info()
     
     logger.info(f"Memory usage: {memory_info.rss / 1024 / 1024:.2f} MB")
     return memory_info.rss / 1024 / 1024  # Return MB
-
-# Import pandas for timestamp (add to dependencies if needed)
-try:
-    import pandas as pd
-except ImportError:
-    # Fallback to datetime if pandas not available
-    from datetime import datetime
-    class pd:
-        class Timestamp:
-            @staticmethod
-            def now():
-                return datetime.now()
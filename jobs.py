@@ -0,0 +1,649 @@
+"""
+Generation jobs: a persistent SQLite job store and a pool of worker processes.
+
+Jobs are submitted with fire-and-poll semantics. Each job gets its own
+workspace under DebugConfig.JOBS_DIR, its progress is appended to an event
+log in the store (for polling and SSE), and its result links to the job's
+preview and ZIP. More jobs can wait in the queue than there are worker slots.
+
+Generation runs out of process so LLM calls, validation and zipping never
+compete with the web server: the store doubles as the queue, worker processes
+claim queued jobs from it and write events and results back to it. The web
+process only supervises them, replacing workers that exit after
+DebugConfig.JOB_WORKER_MAX_JOBS jobs (bounding memory growth) or that crash
+(failing just the jobs they held).
+"""
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+from agent.cancellation import CancelToken
+from agent.workspace import Workspace, remove_later
+from debug_config import DebugConfig
+
+# choose(queued, running) -> id of the queued job to claim next (see scheduler.Scheduler.pick)
+Chooser = Callable[[list[dict[str, Any]], list[dict[str, Any]]], Optional[str]]
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+PARTIAL = "partial"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TERMINAL = (SUCCEEDED, PARTIAL, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    """Raised when a job is not admitted; `retry_after` is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None,
+                 estimated_wait: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.estimated_wait = estimated_wait
+
+
+class JobStore:
+    """SQLite-backed jobs and their event logs."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    prompt TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    tenant TEXT NOT NULL DEFAULT 'anonymous',
+                    priority TEXT NOT NULL DEFAULT 'batch',
+                    tokens INTEGER,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS events (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                );
+                CREATE TABLE IF NOT EXISTS workers (
+                    id TEXT PRIMARY KEY,
+                    pid INTEGER NOT NULL,
+                    jobs_done INTEGER NOT NULL DEFAULT 0,
+                    metrics TEXT,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+                """
+            )
+            # Stores created by earlier versions lack the worker and scheduling columns.
+            columns = {r["name"] for r in db.execute("PRAGMA table_info(jobs)")}
+            for name, ddl in (
+                ("worker", "TEXT"),
+                ("tenant", "TEXT NOT NULL DEFAULT 'anonymous'"),
+                ("priority", "TEXT NOT NULL DEFAULT 'batch'"),
+                ("tokens", "INTEGER"),
+            ):
+                if name not in columns:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {ddl}")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_tenant ON jobs (tenant, finished_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Autocommit connection per operation, so threads (and later processes) never share one.
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _job(row: Optional[sqlite3.Row]) -> Optional[dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def create(self, prompt: str, options: dict[str, Any], tenant: str = "anonymous",
+               priority: str = "batch") -> str:
+        job_id = uuid.uuid4().hex[:12]
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, prompt, options, tenant, priority, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, prompt, json.dumps(options), tenant, priority, time.time()),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict[str, Any]]:
+        with self._connect() as db:
+            return self._job(db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def list(self, status: Optional[str] = None, limit: int = 100) -> list[dict[str, Any]]:
+        with self._connect() as db:
+            if status:
+                rows = db.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT ?",
+                    (status, limit),
+                )
+            else:
+                rows = db.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+            return [self._job(r) for r in rows]
+
+    def count(self, status: str, tenant: Optional[str] = None,
+              priorities: Optional[tuple[str, ...]] = None) -> int:
+        sql, args = "SELECT COUNT(*) FROM jobs WHERE status = ?", [status]
+        if tenant is not None:
+            sql += " AND tenant = ?"
+            args.append(tenant)
+        if priorities:
+            sql += f" AND priority IN ({','.join('?' * len(priorities))})"
+            args.extend(priorities)
+        with self._connect() as db:
+            return db.execute(sql, args).fetchone()[0]
+
+    def claim(self, worker: str, choose: Optional[Chooser] = None) -> Optional[str]:
+        """
+        Atomically move a queued job to running for `worker`; None if nothing
+        is queued. `choose(queued, running)` picks which one (default: oldest).
+        """
+        with self._connect() as db:
+            queued = db.execute("SELECT 1 FROM jobs WHERE status = ? LIMIT 1", (QUEUED,)).fetchone()
+            if queued is None:
+                return None  # idle polls never take the write lock
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                queued = [dict(r) for r in db.execute(
+                    "SELECT id, tenant, priority, created_at FROM jobs WHERE status = ?"
+                    " ORDER BY created_at LIMIT 500", (QUEUED,)
+                )]
+                job_id = None
+                if queued:
+                    running = [dict(r) for r in db.execute(
+                        "SELECT tenant, priority FROM jobs WHERE status = ?", (RUNNING,)
+                    )]
+                    job_id = choose(queued, running) if choose else queued[0]["id"]
+                if job_id is not None:
+                    db.execute(
+                        "UPDATE jobs SET status = ?, started_at = ?, worker = ? WHERE id = ?",
+                        (RUNNING, time.time(), worker, job_id),
+                    )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def cancel_queued(self, job_id: str) -> bool:
+        """Cancel a job that has not started; False if a worker already picked it up."""
+        with self._connect() as db:
+            cur = db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, time.time(), job_id, QUEUED),
+            )
+            return cur.rowcount == 1
+
+    def finish(self, job_id: str, status: str, result: Optional[dict] = None,
+               error: Optional[str] = None, tokens: Optional[int] = None) -> None:
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, tokens = ?, finished_at = ? "
+                "WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, tokens,
+                 time.time(), job_id),
+            )
+
+    def tenant_usage(self, tenant: str, since: float) -> dict[str, Any]:
+        """Tokens a tenant spent in jobs finished since `since`, and those its open jobs reserve."""
+        with self._connect() as db:
+            used, oldest = db.execute(
+                "SELECT COALESCE(SUM(tokens), 0), MIN(finished_at) FROM jobs"
+                " WHERE tenant = ? AND finished_at >= ?", (tenant, since)
+            ).fetchone()
+            reserved = db.execute(
+                "SELECT COALESCE(SUM(json_extract(options, '$.max_input_tokens')"
+                " + json_extract(options, '$.max_output_tokens')), 0) FROM jobs"
+                " WHERE tenant = ? AND status IN (?, ?)", (tenant, QUEUED, RUNNING)
+            ).fetchone()[0]
+        return {"used": int(used), "reserved": int(reserved), "oldest_finished_at": oldest}
+
+    def timings(self, limit: int = 500) -> list[dict[str, Any]]:
+        """created/started/finished times of the most recently finished jobs that ran."""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT priority, created_at, started_at, finished_at FROM jobs"
+                " WHERE finished_at IS NOT NULL AND started_at IS NOT NULL"
+                " ORDER BY finished_at DESC LIMIT ?", (limit,)
+            )
+            return [dict(r) for r in rows]
+
+    def running_on(self, worker: str) -> list[str]:
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT id FROM jobs WHERE status = ? AND worker = ?", (RUNNING, worker)
+            )
+            return [r["id"] for r in rows]
+
+    def request_cancel(self, job_id: str) -> None:
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+
+    def cancel_requested(self, job_id: str) -> bool:
+        """True if the job was flagged for cancellation (or no longer exists)."""
+        with self._connect() as db:
+            row = db.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is None or bool(row[0])
+
+    def delete(self, job_id: str) -> None:
+        with self._connect() as db:
+            db.execute("DELETE FROM events WHERE job_id = ?", (job_id,))
+            db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def append_event(self, job_id: str, kind: str, data: dict[str, Any]) -> int:
+        # One statement, so the next seq is allocated under SQLite's write lock across processes.
+        with self._connect() as db:
+            return db.execute(
+                """
+                INSERT INTO events (job_id, seq, kind, data, created_at)
+                SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ?, ? FROM events WHERE job_id = ?
+                RETURNING seq
+                """,
+                (job_id, kind, json.dumps(data), time.time(), job_id),
+            ).fetchone()[0]
+
+    def last_event_seq(self, job_id: str) -> int:
+        with self._connect() as db:
+            return db.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM events WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+
+    def events(self, job_id: str, after: int = 0) -> list[dict[str, Any]]:
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT seq, kind, data, created_at FROM events "
+                "WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after),
+            ).fetchall()
+        return [
+            {"seq": r["seq"], "kind": r["kind"], "data": json.loads(r["data"]),
+             "created_at": r["created_at"]}
+            for r in rows
+        ]
+
+    def heartbeat(self, worker: str, jobs_done: int, metrics: dict[str, Any]) -> None:
+        with self._connect() as db:
+            db.execute(
+                """
+                INSERT INTO workers (id, pid, jobs_done, metrics, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    jobs_done = excluded.jobs_done, metrics = excluded.metrics,
+                    updated_at = excluded.updated_at
+                """,
+                (worker, os.getpid(), jobs_done, json.dumps(metrics), time.time()),
+            )
+
+    def workers(self) -> list[dict[str, Any]]:
+        with self._connect() as db:
+            rows = db.execute("SELECT * FROM workers ORDER BY id").fetchall()
+        return [{**dict(r), "metrics": json.loads(r["metrics"]) if r["metrics"] else None}
+                for r in rows]
+
+    def remove_worker(self, worker: str) -> None:
+        with self._connect() as db:
+            db.execute("DELETE FROM workers WHERE id = ?", (worker,))
+
+
+def _tokens(outcome: dict[str, Any]) -> Optional[int]:
+    status = outcome.get("budget_status") or {}
+    if "input_tokens" not in status:
+        return None
+    return int(status["input_tokens"]) + int(status["output_tokens"])
+
+
+def workspace_for(job_id: str) -> Path:
+    """Directory holding a job's generated site (`site/`), ZIP and refine record."""
+    return Path(DebugConfig.JOBS_DIR) / job_id
+
+
+def site_dir(job_id: str) -> Path:
+    return workspace_for(job_id) / "site"
+
+
+def _job_result(job_id: str, outcome: dict[str, Any]) -> dict[str, Any]:
+    result = {k: v for k, v in outcome.items() if k != "zip_path"}
+    result["preview_url"] = f"/jobs/{job_id}/preview/index.html"
+    result["zip_url"] = f"/jobs/{job_id}/zip" if outcome.get("zip_path") else None
+    return result
+
+
+def execute_job(store: JobStore, job_id: str) -> str:
+    """Run one claimed (running) job to completion; returns its final status."""
+    from pipeline import run_pipeline
+
+    job = store.get(job_id)
+    if job is None:
+        return CANCELLED
+    options = job["options"]
+    root = site_dir(job_id)
+    root.parent.mkdir(parents=True, exist_ok=True)
+
+    refine_from = options.get("refine_from")
+    if refine_from:
+        _restore_for_refine(refine_from, root)
+
+    store.append_event(job_id, "status", {"status": RUNNING})
+    token = CancelToken()
+    finished = threading.Event()
+    watcher = threading.Thread(target=_watch_cancel, args=(store, job_id, token, finished),
+                               name=f"cancel-{job_id}", daemon=True)
+    watcher.start()
+    try:
+        outcome = run_pipeline(
+            job["prompt"],
+            root,
+            max_input_tokens=options.get("max_input_tokens"),
+            max_output_tokens=options.get("max_output_tokens"),
+            max_seconds=options.get("max_seconds"),
+            refine=bool(refine_from),
+            optimize=options.get("optimize"),
+            emit=lambda kind, data: store.append_event(job_id, kind, data),
+            cancel=token,
+        )
+    except Exception as e:  # pipeline bugs must not kill the worker
+        _fail(store, job_id, str(e))
+        return FAILED
+    finally:
+        finished.set()
+    status = outcome["status"]
+    if status in (SUCCEEDED, PARTIAL):
+        try:
+            _archive(job, status)
+        except OSError as e:  # the run itself is fine; only dedup is lost
+            store.append_event(job_id, "log", {"message": f"⚠️ Could not archive output: {e}"})
+    result = _job_result(job_id, outcome)
+    store.append_event(job_id, "status", {"status": status, "result": result})
+    store.finish(job_id, status, result=result, error=outcome.get("error"), tokens=_tokens(outcome))
+    return status
+
+
+def _watch_cancel(store: JobStore, job_id: str, token: CancelToken,
+                  finished: threading.Event) -> None:
+    """Turn the store's cancel flag (set by the web process) into a cancelled token."""
+    while not finished.wait(DebugConfig.JOB_POLL_SECONDS):
+        if store.cancel_requested(job_id):
+            token.cancel("Cancelled by request.")
+            return
+
+
+def _archive(job: dict[str, Any], status: str) -> None:
+    """
+    Store a finished job's site, as generated (the base of any refine, not the optimized
+    build), in the artifact store; its workspace becomes hardlinks.
+    """
+    from agent.refine import run_record_path
+    from artifacts import ArtifactStore
+
+    root = site_dir(job["id"])
+    meta = {"prompt": job["prompt"], "status": status, "tenant": job["tenant"]}
+    record = run_record_path(root)
+    if record.exists():
+        meta["run_record"] = json.loads(record.read_text(encoding="utf-8"))
+    ArtifactStore().archive(job["id"], Workspace(root).source() or root, meta=meta)
+
+
+def _restore_for_refine(refine_from: str, root: Path) -> None:
+    """Seed `root` with an earlier job's output and refine record, leaving the original alone."""
+    from agent.refine import run_record_path
+    from agent.workspace import atomic_write_text
+    from artifacts import ArtifactStore
+
+    artifacts = ArtifactStore()
+    manifest = artifacts.manifest(refine_from)
+    if manifest is not None:
+        # Hardlinks are safe: every writer replaces files by rename, never in place.
+        artifacts.materialize(refine_from, root)
+        if "run_record" in manifest["meta"]:
+            atomic_write_text(run_record_path(root), json.dumps(manifest["meta"]["run_record"]))
+    elif site_dir(refine_from).exists():  # finished before runs were archived
+        shutil.copytree(workspace_for(refine_from), root.parent, dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns("*.zip", ".*.releases", ".trash-*"))
+
+
+def _fail(store: JobStore, job_id: str, error: str) -> None:
+    # Event first: followers stop once the job row turns terminal.
+    store.append_event(job_id, "status", {"status": FAILED, "error": error})
+    store.finish(job_id, FAILED, error=error)
+
+
+def worker_main(db_path: str, jobs_dir: str, worker: str, concurrency: int, max_jobs: int,
+                parent_pid: int) -> None:
+    """
+    Entry point of a worker process: claim queued jobs and run up to
+    `concurrency` of them at once. Exits after claiming `max_jobs` (0 = never)
+    once they finish, or when the web process goes away.
+    """
+    DebugConfig.JOBS_DIR = jobs_dir
+    store = JobStore(Path(db_path))
+    from scheduler import Scheduler
+
+    choose = Scheduler(store).pick
+
+    # Pay for the graph, prebuilt runnables and provider connection once per worker.
+    import pipeline  # noqa: F401
+    from agent.graph import agent  # noqa: F401
+    from agent.hedging import hedge_metrics
+    from agent.llm import backend_metrics, connection_metrics, warm_up
+    from agent.repair import repair_metrics
+
+    def metrics() -> dict[str, Any]:
+        return {**connection_metrics(), "hedging": hedge_metrics(), "backends": backend_metrics(),
+                "structured_output": repair_metrics()}
+
+    warm_up()
+    done = 0
+    store.heartbeat(worker, done, metrics())
+
+    def run(job_id: str) -> None:
+        nonlocal done
+        execute_job(store, job_id)
+        done += 1
+        store.heartbeat(worker, done, metrics())
+
+    claimed = 0
+    running: set[Future] = set()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=worker) as pool:
+        while (not max_jobs or claimed < max_jobs) and os.getppid() == parent_pid:
+            running = {f for f in running if not f.done()}
+            if len(running) >= concurrency:
+                wait(running, timeout=DebugConfig.JOB_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                continue
+            job_id = store.claim(worker, choose)
+            if job_id is None:
+                time.sleep(DebugConfig.JOB_POLL_SECONDS)
+                continue
+            claimed += 1
+            running.add(pool.submit(run, job_id))
+
+
+class JobManager:
+    """Supervises the worker processes that run queued jobs."""
+
+    def __init__(self, store: JobStore, workers: Optional[int] = None,
+                 concurrency: Optional[int] = None, max_jobs_per_worker: Optional[int] = None,
+                 max_queued: Optional[int] = None):
+        self.store = store
+        self.workers = workers or DebugConfig.JOB_WORKERS
+        self.concurrency = concurrency or DebugConfig.JOB_WORKER_CONCURRENCY
+        self.max_jobs_per_worker = (
+            DebugConfig.JOB_WORKER_MAX_JOBS if max_jobs_per_worker is None else max_jobs_per_worker
+        )
+        self.max_queued = max_queued or DebugConfig.JOB_MAX_QUEUED
+        from scheduler import Scheduler
+
+        self.scheduler = Scheduler(store, slots=self.workers * self.concurrency)
+        # spawn: workers must not inherit the web server's threads, sockets or locks.
+        self._ctx = multiprocessing.get_context("spawn")
+        self._procs: dict[str, multiprocessing.process.BaseProcess] = {}
+        self._stop = threading.Event()
+        self._supervisor: Optional[threading.Thread] = None
+        self._last_gc = time.monotonic()
+
+    def start(self) -> None:
+        """Recover the store and start the workers (call from the server process only)."""
+        if self._supervisor is not None:
+            return
+        self._recover()
+        for _ in range(self.workers):
+            self._spawn()
+        self._supervisor = threading.Thread(target=self._supervise, name="job-supervisor",
+                                            daemon=True)
+        self._supervisor.start()
+
+    def _recover(self) -> None:
+        """Fail jobs interrupted by the last shutdown; queued ones are simply claimed again."""
+        for job in self.store.list(RUNNING, limit=10_000):
+            _fail(self.store, job["id"], "Interrupted by server restart.")
+        for worker in self.store.workers():
+            self.store.remove_worker(worker["id"])
+
+    def _spawn(self) -> None:
+        worker = f"w{uuid.uuid4().hex[:8]}"
+        proc = self._ctx.Process(
+            target=worker_main,
+            args=(str(self.store.db_path), str(DebugConfig.JOBS_DIR), worker, self.concurrency,
+                  self.max_jobs_per_worker, os.getpid()),
+            name=f"job-{worker}",
+            daemon=True,
+        )
+        proc.start()
+        self._procs[worker] = proc
+
+    def _reap(self, worker: str, reason: str) -> None:
+        for job_id in self.store.running_on(worker):
+            _fail(self.store, job_id, f"Worker {reason} while running this job.")
+        self.store.remove_worker(worker)
+
+    def _supervise(self) -> None:
+        while not self._stop.wait(1.0):
+            for worker, proc in list(self._procs.items()):
+                if proc.is_alive():
+                    continue
+                proc.join()
+                del self._procs[worker]
+                # Exit code 0 is a recycle; anything else is a crash that costs only its own jobs.
+                exited = "exited" if proc.exitcode == 0 else f"crashed (exit code {proc.exitcode})"
+                self._reap(worker, exited)
+                if not self._stop.is_set():
+                    self._spawn()
+            if time.monotonic() - self._last_gc >= DebugConfig.ARTIFACT_GC_INTERVAL_SECONDS:
+                self._last_gc = time.monotonic()
+                from artifacts import ArtifactStore
+
+                ArtifactStore().gc()
+
+    def submit(self, prompt: str, tenant: str = "anonymous", priority: str = "batch",
+               **options: Any) -> tuple[str, float]:
+        """Admit and queue a job; returns its id and estimated queue wait in seconds."""
+        if self.store.count(QUEUED) >= self.max_queued:
+            raise QueueFull(f"{self.max_queued} jobs are already waiting; try again later.",
+                            retry_after=self.scheduler.typical_run_seconds(priority))
+        options, wait = self.scheduler.admit(
+            tenant, priority, {k: v for k, v in options.items() if v is not None}
+        )
+        job_id = self.store.create(prompt, options, tenant=tenant, priority=priority)
+        self.store.append_event(job_id, "status",
+                                {"status": QUEUED, "estimated_wait_seconds": wait})
+        return job_id, wait
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """Cancel a queued job, or flag a running one; returns the resulting status."""
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        if job["status"] == QUEUED and self.store.cancel_queued(job_id):
+            self.store.append_event(job_id, "status", {"status": CANCELLED})
+            return CANCELLED
+        if job["status"] in (QUEUED, RUNNING):
+            self.store.request_cancel(job_id)
+            return RUNNING
+        return job["status"]
+
+    def delete(self, job_id: str) -> Optional[str]:
+        """Cancel if needed, then drop a finished job's record, workspace and archived manifest."""
+        from artifacts import ArtifactStore
+
+        status = self.cancel(job_id)
+        if status in TERMINAL:
+            self.store.delete(job_id)
+            remove_later(workspace_for(job_id))  # big trees are deleted off the request path
+            ArtifactStore().delete(job_id)  # blobs go at the next gc if no other run uses them
+        return status
+
+    def restore(self, job_id: str) -> bool:
+        """Re-materialize a finished job's site from the artifact store if its workspace is gone."""
+        from artifacts import ArtifactStore
+
+        site = site_dir(job_id)
+        if site.exists():
+            return True
+        artifacts = ArtifactStore()
+        if not artifacts.has(job_id):
+            return False
+        if site.is_symlink():
+            site.unlink()  # its release was deleted
+        artifacts.materialize(job_id, site)
+        return True
+
+    def follow(self, job_id: str, after: int = 0, poll: float = 0.3) -> Iterator[dict[str, Any]]:
+        """Yield a job's events as they arrive until it reaches a terminal state."""
+        while True:
+            job = self.store.get(job_id)
+            for event in self.store.events(job_id, after):
+                after = event["seq"]
+                yield event
+            if job is None or job["status"] in TERMINAL:
+                return
+            time.sleep(poll)
+
+    def result(self, job_id: str) -> Optional[dict[str, Any]]:
+        job = self.store.get(job_id)
+        return job["result"] if job else None
+
+    def worker_status(self) -> list[dict[str, Any]]:
+        """Live workers with their pid, jobs done and provider connection metrics."""
+        alive = {w for w, p in self._procs.items() if p.is_alive()}
+        return [w for w in self.store.workers() if w["id"] in alive]
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        for worker, proc in list(self._procs.items()):
+            proc.terminate()
+            proc.join(timeout=5)
+            self._reap(worker, "stopped by server shutdown")
+        self._procs.clear()
@@ -2,23 +2,61 @@ import argparse
 import sys
 import traceback
 
+from agent.budget import RunBudget
 from agent.graph import agent
+from agent.refine import load_run_record, save_run_record
+from agent.run_state import RunState
+from agent.tools import PROJECT_ROOT, use_project_root
+from agent.workspace import Workspace
+from debug_config import DebugConfig
 
 
 def main():
     parser = argparse.ArgumentParser(description="Run engineering project planner")
     parser.add_argument("--recursion-limit", "-r", type=int, default=100,
                         help="Recursion limit for processing (default: 100)")
+    parser.add_argument("--max-input-tokens", type=int, default=None,
+                        help="Input-token budget for the run (default: DebugConfig)")
+    parser.add_argument("--max-output-tokens", type=int, default=None,
+                        help="Output-token budget for the run (default: DebugConfig)")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="Wall-time budget for the run in seconds (default: DebugConfig)")
+    parser.add_argument("--refine", action="store_true",
+                        help="Refine the previous run: "
+                             "only regenerate files the new prompt changes")
+    parser.add_argument("--optimize", action="store_true", default=DebugConfig.OPTIMIZE_BUILD,
+                        help="Minify, bundle and dedupe the generated site before publishing it")
 
     args = parser.parse_args()
 
     try:
         user_prompt = input("Enter your project prompt: ")
-        result = agent.invoke(
-            {"user_prompt": user_prompt},
-            {"recursion_limit": args.recursion_limit}
-        )
-        print("Final State:", result)
+        inputs = {"user_prompt": user_prompt}
+        previous = load_run_record(PROJECT_ROOT) if args.refine else None
+        if previous is not None:
+            inputs["previous_plan"], inputs["previous_task_plan"] = previous
+        budget = RunBudget(args.max_input_tokens, args.max_output_tokens, args.max_seconds)
+        # Write into staging; PROJECT_ROOT is swapped to each finished step and the final tree.
+        workspace = Workspace(PROJECT_ROOT)
+        with workspace.staged(fresh=previous is None) as staging, use_project_root(staging):
+            result = agent.invoke(
+                inputs,
+                budget.run_config(recursion_limit=args.recursion_limit)
+            )
+            build = None
+            if args.optimize:
+                from agent.optimizer import optimize_site, summary
+                # Optimize a copy: staging stays the source the next --refine starts from
+                build = workspace.derive(staging)
+                print(summary(optimize_site(build)))
+            try:
+                workspace.publish(staging, build)
+            finally:
+                if build is not None:
+                    workspace.discard(build)
+        state = RunState.from_graph(result)
+        save_run_record(PROJECT_ROOT, state)
+        print(state.summary())
     except KeyboardInterrupt:
         print("\nOperation cancelled by user.")
         sys.exit(0)
@@ -0,0 +1,307 @@
+"""
+Local OpenAI-compatible mock of the LLM provider, for offline runs and throughput tests.
+
+It serves `POST /v1/chat/completions` (also under `/openai/v1`, the Groq
+SDK's path) and `GET /v1/models`. Each API key gets its own token-bucket rate
+limit, as a real provider does. Responses carry Groq's `x-ratelimit-*`
+headers. Requests over the limit get a 429 with a Retry-After header, so
+aggregate throughput is bounded by `keys x --rpm`. Answers are generated
+from the request. A forced tool call (the planner's Plan, the architect's
+TaskPlan) gets arguments built from the tool's JSON schema. The coder gets a
+`write_file` call for its file and then a final message. A whole pipeline
+therefore runs end to end without network access. Usage reports
+`prompt_tokens_details.cached_tokens` for the prompt prefix shared with a
+recent request, the way providers bill their prompt cache.
+
+    python mock_llm_server.py serve --port 8001 --keys k1,k2,k3 --rpm 30
+    LLM_BACKENDS="k1@http://127.0.0.1:8001/v1,k2@http://127.0.0.1:8001/v1" python main.py
+
+    python mock_llm_server.py bench --keys 1,2,4 --rpm 60 --seconds 20
+
+`bench` starts a server for each key count and points agent.llm's backend
+pool at it. It then calls the model from `--concurrency` threads and reports
+completed requests per minute. These should grow in step with the number of
+keys.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+_PATHS = ("index.html", "style.css", "script.js")
+_CONTENT = {
+    ".html": '<!DOCTYPE html>\n<html><head><link rel="stylesheet" href="style.css"></head>'
+             '<body><h1>Mock app</h1><script src="script.js"></script></body></html>\n',
+    ".css": "body { font-family: sans-serif; }\n",
+    ".js": "document.querySelector('h1').textContent += ' (ready)';\n",
+}
+
+
+class TokenBucket:
+    """`rpm` requests per minute per key, with up to `burst` at once."""
+
+    def __init__(self, rpm: float, burst: int):
+        self.rate = rpm / 60.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> tuple[bool, int, float]:
+        """(allowed, requests left, seconds until the next one is allowed)."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            allowed = self.tokens >= 1
+            if allowed:
+                self.tokens -= 1
+            return allowed, int(self.tokens), max(0.0, 1 - self.tokens) / self.rate
+
+
+class PromptCache:
+    """
+    Prefix caching as providers do it: the part of a prompt matching an
+    earlier one is billed as cached.
+    """
+
+    def __init__(self, size: int = 64):
+        self.recent: list[str] = []
+        self.size = size
+        self._lock = threading.Lock()
+
+    def lookup(self, prompt: str) -> int:
+        """Characters at the start of `prompt` already seen in a recent prompt."""
+        with self._lock:
+            hit = max((len(os.path.commonprefix([prompt, seen])) for seen in self.recent),
+                      default=0)
+            self.recent = ([prompt] + [seen for seen in self.recent if seen != prompt])[:self.size]
+        return hit
+
+
+def _fake(schema: dict[str, Any], name: str = "", index: int = 0) -> Any:
+    """A value that validates against `schema` (the subset pydantic emits for the agent)."""
+    if "$ref" in schema or "anyOf" in schema or "allOf" in schema:
+        options = schema.get("anyOf") or schema.get("allOf") or [{"type": "string"}]
+        return _fake(options[0], name, index)
+    kind = schema.get("type", "string")
+    if kind == "object":
+        props = schema.get("properties", {})
+        required = schema.get("required", props)
+        return {key: _fake(sub, key, index) for key, sub in props.items() if key in required}
+    if kind == "array":
+        return [_fake(schema.get("items", {}), name, i) for i in range(len(_PATHS))]
+    if kind == "boolean":
+        return False
+    if kind in ("integer", "number"):
+        return 0
+    if "path" in name:
+        return _PATHS[index % len(_PATHS)]
+    return f"mock {name or 'text'} {index + 1}"
+
+
+def _inline_refs(schema: Any, defs: dict[str, Any]) -> Any:
+    if isinstance(schema, dict):
+        if "$ref" in schema:
+            return _inline_refs(defs[schema["$ref"].rsplit("/", 1)[-1]], defs)
+        return {k: _inline_refs(v, defs) for k, v in schema.items()}
+    if isinstance(schema, list):
+        return [_inline_refs(v, defs) for v in schema]
+    return schema
+
+
+def reply(request: dict[str, Any]) -> dict[str, Any]:
+    """The assistant message for a chat completion request."""
+    messages = request.get("messages", [])
+    tools = {t["function"]["name"]: t["function"] for t in request.get("tools", [])}
+    choice = request.get("tool_choice")
+    forced = choice.get("function", {}).get("name") if isinstance(choice, dict) else None
+    if forced is None and choice == "required" and tools:
+        forced = next(iter(tools))
+    if forced in tools:
+        params = tools[forced].get("parameters", {})
+        return _tool_call(forced, _fake(_inline_refs(params, params.get("$defs", {}))))
+    if "write_file" in tools and messages and messages[-1].get("role") != "tool":
+        match = re.search(r"File to modify: (\S+)", str(messages[-1].get("content")))
+        path = match.group(1) if match else _PATHS[0]
+        content = _CONTENT.get(os.path.splitext(path)[1], "\n")
+        return _tool_call("write_file", {"path": path, "content": content})
+    return {"role": "assistant", "content": "done"}
+
+
+def _tool_call(name: str, arguments: dict[str, Any]) -> dict[str, Any]:
+    call = {"id": f"call_{name}", "type": "function",
+            "function": {"name": name, "arguments": json.dumps(arguments)}}
+    return {"role": "assistant", "content": "", "tool_calls": [call]}
+
+
+def make_server(port: int = 0, keys: Optional[list[str]] = None, rpm: float = 30.0, burst: int = 1,
+                latency: float = 0.0) -> ThreadingHTTPServer:
+    """A mock provider; with `keys`, only those API keys are accepted, each rate limited apart."""
+    buckets = {key: TokenBucket(rpm, burst) for key in keys or []}
+    lock = threading.Lock()
+    counts = {"ok": 0, "rate_limited": 0}
+    cache = PromptCache()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _key(self) -> Optional[str]:
+            key = self.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+            if keys and key not in buckets:
+                self._send(401, {"error": {"message": "Invalid API Key",
+                                           "type": "invalid_request_error"}})
+                return None
+            return key
+
+        def _send(self, status: int, payload: dict[str, Any],
+                  headers: Optional[dict[str, str]] = None) -> None:
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            if self.path.removeprefix("/openai").rstrip("/") != "/v1/models":
+                return self._send(404, {"error": {"message": "Not found"}})
+            if self._key() is not None:
+                self._send(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if self.path.removeprefix("/openai").rstrip("/") != "/v1/chat/completions":
+                return self._send(404, {"error": {"message": "Not found"}})
+            key = self._key()
+            if key is None:
+                return
+            headers = {}
+            if key in buckets:
+                allowed, remaining, reset = buckets[key].take()
+                if not allowed:
+                    with lock:
+                        counts["rate_limited"] += 1
+                    error = {"message": "Rate limit reached", "type": "rate_limit_exceeded"}
+                    return self._send(429, {"error": error}, {"Retry-After": f"{reset:.2f}"})
+                # The headers Groq sends, so clients can pace themselves.
+                headers = {"x-ratelimit-limit-requests": str(int(rpm)),
+                           "x-ratelimit-remaining-requests": str(remaining),
+                           "x-ratelimit-reset-requests": f"{reset:.2f}s"}
+            time.sleep(latency)
+            message = reply(request)
+            # Tools come before messages in the provider's prompt; ~4 characters per token.
+            prompt = json.dumps([request.get("tools"), request.get("messages")])
+            prompt_tokens, cached_tokens = len(prompt) // 4, cache.lookup(prompt) // 4
+            with lock:
+                counts["ok"] += 1
+            self._send(200, {
+                "id": f"chatcmpl-{counts['ok']}", "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "message": message,
+                             "finish_reason": "tool_calls" if "tool_calls" in message else "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 50,
+                          "total_tokens": prompt_tokens + 50,
+                          "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+            }, headers)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.counts = counts  # type: ignore[attr-defined]
+    return server
+
+
+def bench(key_counts: list[int], rpm: float, seconds: float, concurrency: int,
+          latency: float) -> list[dict]:
+    """Requests per minute through agent.llm for each number of keys."""
+    # The SDK wants one to construct; the pool sets the real one
+    os.environ.setdefault("GROQ_API_KEY", "mock")
+    from agent.backends import Backend
+    from agent.llm import backend_metrics, backend_pool, llm
+
+    results = []
+    for n in key_counts:
+        keys = [f"mock-key-{i}" for i in range(n)]
+        server = make_server(keys=keys, rpm=rpm, latency=latency)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        backend_pool.configure([Backend(url=url, api_key=key) for key in keys])
+        deadline = time.monotonic() + seconds
+        outcome = {"completed": 0, "failed": 0}
+        lock = threading.Lock()
+
+        def worker(deadline: float = deadline, outcome: dict = outcome,
+                   lock: threading.Lock = lock) -> None:
+            while time.monotonic() < deadline:
+                try:
+                    llm.invoke("ping")
+                    key = "completed"
+                except Exception:
+                    key = "failed"
+                with lock:
+                    outcome[key] += 1
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(concurrency) as pool:
+            for _ in range(concurrency):
+                pool.submit(worker)
+        elapsed = time.monotonic() - started
+        server.shutdown()
+        results.append({
+            "keys": n,
+            **outcome,
+            "rate_limited_responses": server.counts["rate_limited"],  # type: ignore[attr-defined]
+            "requests_per_minute": round(60 * outcome["completed"] / elapsed, 1),
+            "per_backend": [b["requests"] for b in backend_metrics()],
+        })
+        print(json.dumps(results[-1]))
+    return results
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock LLM provider")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="Run the mock provider")
+    serve.add_argument("--port", type=int, default=8001)
+    serve.add_argument("--keys", default="",
+                       help="Comma-separated accepted API keys (default: any key, no limit)")
+    serve.add_argument("--rpm", type=float, default=30.0, help="Requests per minute per key")
+    serve.add_argument("--burst", type=int, default=1, help="Requests a key may send at once")
+    serve.add_argument("--latency", type=float, default=0.0, help="Seconds per completion")
+    run = sub.add_parser("bench", help="Measure requests per minute against 1..N keys")
+    run.add_argument("--keys", default="1,2,4", help="Key counts to measure")
+    run.add_argument("--rpm", type=float, default=60.0, help="Requests per minute per key")
+    run.add_argument("--seconds", type=float, default=20.0, help="Duration of each measurement")
+    run.add_argument("--concurrency", type=int, default=16)
+    run.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        keys = [k.strip() for k in args.keys.split(",") if k.strip()]
+        server = make_server(args.port, keys, args.rpm, args.burst, args.latency)
+        print(f"🧪 mock provider on http://127.0.0.1:{args.port}/v1 "
+              f"({len(keys) or 'any'} keys, {args.rpm:g} rpm each)")
+        with contextlib.suppress(KeyboardInterrupt):
+            server.serve_forever()
+    elif args.command == "bench":
+        bench([int(n) for n in args.keys.split(",")], args.rpm, args.seconds, args.concurrency,
+              args.latency)
+
+
+if __name__ == "__main__":
+    _main()
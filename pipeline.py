@@ -0,0 +1,271 @@
+"""
+One generation run, independent of the UI that asked for it.
+
+`run_pipeline` stages a workspace, runs the LangGraph agent with a budget,
+publishes the output atomically and packages it (placeholder index + ZIP).
+Progress is reported through an `emit(kind, data)` callback so the Gradio UI,
+the job API and the CLI can all present it their own way.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import stat
+import zipfile
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from agent.budget import RunBudget
+from agent.cancellation import Cancelled, CancelToken, cancel_callback, current_token, use_token
+from agent.refine import load_run_record, run_record_path, save_run_record
+from agent.run_state import RunState
+from agent.tools import use_project_root
+from agent.workspace import Workspace, atomic_write_text
+from debug_config import DebugConfig
+
+Emit = Callable[[str, dict], None]
+
+
+def _no_emit(kind: str, data: dict) -> None:
+    pass
+
+
+def zip_project(dir_path: Path) -> str:
+    zip_path = (dir_path.parent / f"{dir_path.name}.zip").resolve()
+    # Build beside the target and rename, so a download never gets a half-written ZIP.
+    tmp_path = zip_path.with_name(f".{zip_path.name}.tmp")
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for root, _, files in os.walk(dir_path):
+            for fn in files:
+                full = Path(root) / fn
+                info = zipfile.ZipInfo.from_file(full, arcname=str(full.relative_to(dir_path)))
+                # Archived files are read-only hardlinks; unpacked ones should be editable.
+                info.external_attr = (stat.S_IFREG | 0o644) << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with full.open("rb") as src, zf.open(info, "w") as dst:
+                    shutil.copyfileobj(src, dst)
+    os.replace(tmp_path, zip_path)
+    return str(zip_path)
+
+def dir_has_files(dir_path: Path) -> bool:
+    for _, _, files in os.walk(dir_path):
+        if files:
+            return True
+    return False
+
+def ensure_placeholder_index(dir_path: Path) -> None:
+    index_path = dir_path / "index.html"
+    if index_path.exists():
+        return
+    items = []
+    for root, _, files in os.walk(dir_path):
+        for fn in sorted(files):
+            full = Path(root) / fn
+            rel = full.relative_to(dir_path).as_posix()
+            if rel == "index.html":
+                continue
+            items.append(f'<li><a href="{rel}" target="_blank" rel="noopener">{rel}</a></li>')
+    listing = "\n".join(items) or "<li>(No files found)</li>"
+    html = f"""<!doctype html>
+<html><head>
+  <meta charset="utf-8" />
+  <title>Generated Output (Fallback)</title>
+  <style>
+    body {{ font-family: system-ui, Arial, sans-serif; margin: 24px; }}
+    .note {{ background: #fff8e1; border: 1px solid #ffe082; padding: 12px; border-radius: 8px; margin-bottom: 16px; }}
+    a {{ color: #2563eb; }}
+  </style>
+</head>
+<body>
+  <h1>Generated Output (Fallback)</h1>
+  <div class="note">No <code>index.html</code> was generated by the pipeline, so this fallback page lists all files created.</div>
+  <ul>{listing}</ul>
+</body></html>"""
+    atomic_write_text(index_path, html)
+
+def invoke_agent_with_retries(inputs: dict, budget: RunBudget) -> dict:
+    # Imported here so importing this module (e.g. in a fresh worker) stays cheap.
+    from agent.graph import agent
+
+    # The budget is shared across retries, so tokens spent before a rate limit still count.
+    config = budget.run_config(recursion_limit=DebugConfig.DEFAULT_RECURSION_LIMIT)
+    config["callbacks"].append(cancel_callback)  # no LLM/tool call starts once the run is cancelled
+    token = current_token() or CancelToken()
+    max_retries = 3
+    base_delay = 8
+    for attempt in range(1, max_retries + 1):
+        try:
+            return agent.invoke(inputs, config)
+        except Exception as e:
+            msg = str(e).lower()
+            retryable = ("429" in msg) or ("rate limit" in msg) or ("tpm" in msg)
+            if attempt < max_retries and retryable and not isinstance(e, Cancelled):
+                token.sleep(base_delay * attempt)
+                continue
+            raise
+
+def optimize_build(workspace: Workspace, staging: Path, outcome: dict[str, Any],
+                   log: Callable[[str], None]) -> Optional[Path]:
+    """
+    Optimize a copy of a finished staging tree for serving; staging stays as written, the
+    base of the next refine. None on failure: the unoptimized files are served instead.
+    """
+    from agent.optimizer import optimize_site, summary
+
+    build = workspace.derive(staging)
+    try:
+        report = optimize_site(build)
+    except Exception as e:  # an optimizer bug must not cost the user the generated site
+        workspace.discard(build)
+        log(f"⚠️ Build optimization skipped: {e}")
+        return None
+    outcome["build_report"] = report
+    log(summary(report))
+    return build
+
+
+def budget_line(status: dict) -> str:
+    line = (
+        f"💰 Budget: {status['input_tokens']}/{status['limits']['input_tokens']} input, "
+        f"{status['output_tokens']}/{status['limits']['output_tokens']} output tokens, "
+        f"{status['elapsed_seconds']:.0f}s/{status['limits']['seconds']:.0f}s"
+    )
+    if status.get("cached_input_tokens"):
+        line += (f" · {status['cached_input_tokens']} input tokens cached "
+                 f"({status['cache_hit_rate']:.0%})")
+    if status["model_downgraded"]:
+        line += " · switched to cheaper model"
+    if status["skipped_steps"]:
+        line += f" · skipped {len(status['skipped_steps'])} step(s)"
+    if status["stopped_early"]:
+        line += " · stopped early (partial output)"
+    return line
+
+
+def run_pipeline(
+    prompt: str,
+    root: Path,
+    *,
+    max_input_tokens: Optional[int] = None,
+    max_output_tokens: Optional[int] = None,
+    max_seconds: Optional[float] = None,
+    refine: bool = False,
+    optimize: Optional[bool] = None,
+    emit: Emit = _no_emit,
+    cancel: Optional[CancelToken] = None,
+) -> dict[str, Any]:
+    """
+    Generate a project into `root`. Never raises for pipeline failures: the
+    returned dict has `status` "succeeded", "partial", "cancelled" or "failed".
+
+    The run writes into a staging copy; `root` is swapped to each finished
+    step and to the final tree, so it never shows a half-written project.
+    Cancelling `cancel` stops the run at the next LLM or tool call and
+    publishes whatever complete files it has so far. With `optimize` (default
+    DebugConfig.OPTIMIZE_BUILD) a copy of the finished site is minified,
+    bundled and deduplicated and published instead; the files as generated
+    stay the base for a later refine. See agent/optimizer.py.
+    """
+    root = Path(root)
+    # Each publish tells the preview which files changed (live reload).
+    workspace = Workspace(root, on_publish=lambda changed: emit("files", {"changed": changed}))
+    token = cancel or CancelToken()
+    budget = RunBudget(max_input_tokens, max_output_tokens, max_seconds)
+    outcome: dict[str, Any] = {"status": "failed", "zip_path": None}
+
+    def log(message: str) -> None:
+        emit("log", {"message": message})
+
+    def publish(staging: Path, build: Optional[Path] = None) -> None:
+        ensure_placeholder_index(staging)
+        try:
+            if build is not None:
+                ensure_placeholder_index(build)
+            workspace.publish(staging, build)
+        finally:
+            if build is not None:
+                workspace.discard(build)
+        outcome["zip_path"] = zip_project(root)
+
+    inputs = {"user_prompt": prompt}
+    previous = load_run_record(root) if refine else None
+    if previous is not None:
+        log("♻️ Refining previous project (only changed files are regenerated)…")
+        inputs["previous_plan"], inputs["previous_task_plan"] = previous
+    else:
+        if refine:
+            log("ℹ️ No previous run to refine; generating from scratch.")
+        log("🚧 Preparing a fresh workspace…")
+        run_record_path(root).unlink(missing_ok=True)
+
+    with workspace.staged(fresh=previous is None) as staging:
+        try:
+            log("🤖 Running LangGraph pipeline (planner → architect → coder)…")
+            with use_project_root(staging), use_token(token):
+                # Only the compact run state is held from here on, not the graph's final state.
+                state = RunState.from_graph(invoke_agent_with_retries(inputs, budget))
+            log(budget_line(budget.status()))
+            log(f"📋 {state.summary()}")
+            outcome["run"] = state.brief()
+            if state.plan is not None and state.task_plan is not None:
+                save_run_record(root, state)
+            fanout = state.architect_report
+            if fanout:
+                log(
+                    f"🏗️ Architect planned {fanout['files']} files in parallel "
+                    f"in {fanout['seconds']:.0f}s "
+                    f"(slowest file {fanout['slowest_file_seconds']:.0f}s; "
+                    f"{len(fanout['retried_files'])} retried, "
+                    f"{len(fanout['fallback_files'])} from the contract only)."
+                )
+            report = state.refine_report
+            if report:
+                outcome["refine_report"] = report
+                log(
+                    f"♻️ Regenerated {report['files_regenerated']}/{report['files_total']} files; "
+                    f"skipped {report['steps_skipped']} steps "
+                    f"(~{report['estimated_input_tokens_saved']} input / "
+                    f"~{report['estimated_output_tokens_saved']} output tokens saved)."
+                )
+            outcome["validation_issues"] = state.validation_issues
+
+            if not dir_has_files(staging):
+                log("⚠️ Pipeline finished but wrote no files.")
+                outcome["error"] = "No files were generated."
+                return outcome
+
+            build = None
+            if DebugConfig.OPTIMIZE_BUILD if optimize is None else optimize:
+                build = optimize_build(workspace, staging, outcome, log)
+            log("🧩 Build complete. Creating ZIP…")
+            publish(staging, build)
+            outcome["status"] = "partial" if budget.stopped_early else "succeeded"
+            log("✅ Done.")
+            return outcome
+
+        except Cancelled as e:
+            outcome["status"] = "cancelled"
+            outcome["error"] = str(e) or "Cancelled."
+            log(f"🛑 {outcome['error']}")
+            log(budget_line(budget.status()))
+            if dir_has_files(staging):
+                log("⚠️ Keeping the files finished before cancellation. Zipping what exists…")
+                publish(staging)
+            return outcome
+
+        except Exception as e:
+            emsg = str(e)
+            outcome["error"] = emsg
+            log(f"❌ Error: {emsg}")
+            log(budget_line(budget.status()))
+            if any(k in emsg.lower() for k in ["429", "rate limit", "tpm"]):
+                log("💡 Tip: Rate limit hit. Retry later or lower the token budget.")
+            if dir_has_files(staging):
+                log("⚠️ Partial output detected. Zipping what exists…")
+                publish(staging)
+                outcome["status"] = "partial"
+            else:
+                log("🛑 No files were generated.")
+            return outcome
+        finally:
+            outcome["budget_status"] = budget.status()
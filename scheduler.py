@@ -0,0 +1,167 @@
+"""
+Fair multi-tenant scheduling for generation jobs.
+
+Every job belongs to a tenant (an API key, or a Gradio client) and a priority
+lane: "interactive" for someone watching the preview, "batch" for API work.
+The scheduler sits between the job store and the workers:
+
+- `admit()` runs at submission. It enforces a per-tenant token quota per time
+  window (clamping the job's budget to what is left), caps how many jobs one
+  tenant may queue, and rejects early with an estimated wait when the lane is
+  too far behind.
+- `pick()` runs when a worker claims its next job. It chooses the lane whose
+  running share is lowest relative to its weight, then within that lane the
+  tenant with the fewest running jobs relative to its weight (oldest job
+  first). One tenant with a 30-file project can therefore use idle capacity,
+  but never starve everyone else. The shares are job slots: a claimed job
+  keeps its slot, and its LLM calls are not re-ordered against other jobs'.
+- `latency_report()` gives p50/p95/p99 queue wait and end-to-end latency per lane.
+"""
+from __future__ import annotations
+
+import math
+import time
+from collections import Counter
+from typing import Any, Optional
+
+from debug_config import DebugConfig
+from jobs import QUEUED, RUNNING, JobStore, QueueFull
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+
+class QuotaExceeded(QueueFull):
+    """Raised when a tenant has spent its token quota for the current window."""
+
+
+def _percentile(values: list[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile; None for no samples."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)], 2)
+
+
+class Scheduler:
+    """Admission control, weighted fair picking and per-lane latency for one job store."""
+
+    def __init__(self, store: JobStore, slots: Optional[int] = None):
+        self.store = store
+        # Jobs that can run at once across all workers.
+        self.slots = slots or DebugConfig.JOB_WORKERS * DebugConfig.JOB_WORKER_CONCURRENCY
+
+    @staticmethod
+    def tenant_weight(tenant: str) -> float:
+        return DebugConfig.SCHED_TENANT_WEIGHTS.get(tenant, 1.0)
+
+    @staticmethod
+    def lane_weight(priority: str) -> float:
+        return DebugConfig.SCHED_LANE_WEIGHTS.get(priority, 1.0)
+
+    # --- picking (called inside JobStore.claim's transaction) ---
+    def pick(self, queued: list[dict[str, Any]], running: list[dict[str, Any]]) -> Optional[str]:
+        """Id of the queued job to run next; `queued` is oldest-first."""
+        if not queued:
+            return None
+        by_lane = Counter(r["priority"] for r in running)
+        by_tenant = Counter(r["tenant"] for r in running)
+        lanes = {job["priority"] for job in queued}
+        # Ties go to the interactive lane.
+        lane = min(lanes, key=lambda p: (by_lane[p] / self.lane_weight(p), p != INTERACTIVE))
+        oldest: dict[str, dict[str, Any]] = {}
+        for job in queued:
+            if job["priority"] == lane:
+                oldest.setdefault(job["tenant"], job)
+        best = min(
+            oldest.values(),
+            key=lambda job: (by_tenant[job["tenant"]] / self.tenant_weight(job["tenant"]),
+                             job["created_at"]),
+        )
+        return best["id"]
+
+    # --- admission ---
+    def typical_run_seconds(self, priority: str) -> float:
+        """Median run time of recent jobs in the lane (a default before there is history)."""
+        runs = [t["finished_at"] - t["started_at"]
+                for t in self.store.timings(100) if t["priority"] == priority]
+        return _percentile(runs, 50) or DebugConfig.SCHED_DEFAULT_RUN_SECONDS
+
+    def estimate_wait(self, priority: str) -> float:
+        """Seconds a new job in `priority` would likely queue before a worker picks it up."""
+        # Interactive work only waits behind interactive work; batch waits behind everything.
+        ahead_lanes = (INTERACTIVE,) if priority == INTERACTIVE else PRIORITIES
+        ahead = self.store.count(QUEUED, priorities=ahead_lanes)
+        busy = self.store.count(RUNNING)
+        waves = max(0, busy + ahead + 1 - self.slots) / self.slots
+        return round(waves * self.typical_run_seconds(priority), 1)
+
+    def admit(
+        self, tenant: str, priority: str, options: dict[str, Any]
+    ) -> tuple[dict[str, Any], float]:
+        """
+        Check a submission against quotas and the lane's wait limit. Returns
+        the options with the token budget made explicit (and clamped to the
+        tenant's remaining quota) and the estimated wait; raises QueueFull /
+        QuotaExceeded to reject.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}; expected one of {PRIORITIES}")
+
+        if self.store.count(QUEUED, tenant=tenant) >= DebugConfig.SCHED_MAX_QUEUED_PER_TENANT:
+            raise QueueFull(
+                f"You already have {DebugConfig.SCHED_MAX_QUEUED_PER_TENANT} jobs waiting.",
+                retry_after=self.typical_run_seconds(priority),
+            )
+
+        max_input = options.get("max_input_tokens") or DebugConfig.BUDGET_MAX_INPUT_TOKENS
+        max_output = options.get("max_output_tokens") or DebugConfig.BUDGET_MAX_OUTPUT_TOKENS
+        window = DebugConfig.SCHED_QUOTA_WINDOW_SECONDS
+        usage = self.store.tenant_usage(tenant, since=time.time() - window)
+        remaining = DebugConfig.SCHED_TENANT_TOKEN_QUOTA - usage["used"] - usage["reserved"]
+        if remaining < DebugConfig.SCHED_MIN_JOB_TOKENS:
+            # Quota frees up when spent tokens age out of the window or open jobs finish.
+            hints = []
+            if usage["oldest_finished_at"]:
+                hints.append(usage["oldest_finished_at"] + window - time.time())
+            if usage["reserved"]:
+                hints.append(self.typical_run_seconds(priority))
+            retry = min(hints) if hints else window
+            raise QuotaExceeded(
+                f"Token quota of {DebugConfig.SCHED_TENANT_TOKEN_QUOTA} per {window:.0f}s used up.",
+                retry_after=max(1.0, round(retry, 1)),
+            )
+        if max_input + max_output > remaining:
+            # Shrink both limits proportionally so this job cannot overrun the quota.
+            scale = remaining / (max_input + max_output)
+            max_input, max_output = int(max_input * scale), int(max_output * scale)
+
+        wait = self.estimate_wait(priority)
+        limit = DebugConfig.SCHED_MAX_WAIT_SECONDS.get(priority)
+        if limit is not None and wait > limit:
+            raise QueueFull(
+                f"The {priority} queue is about {wait:.0f}s behind (limit {limit:.0f}s); "
+                "try again later.",
+                retry_after=round(wait - limit, 1),
+                estimated_wait=wait,
+            )
+        return {**options, "max_input_tokens": max_input, "max_output_tokens": max_output}, wait
+
+    # --- reporting ---
+    def latency_report(self, limit: int = 500) -> dict[str, Any]:
+        """p50/p95/p99 queue wait and end-to-end latency (seconds) per priority lane."""
+        report: dict[str, Any] = {}
+        timings = self.store.timings(limit)
+        for priority in PRIORITIES:
+            lane = [t for t in timings if t["priority"] == priority]
+            waits = [t["started_at"] - t["created_at"] for t in lane]
+            totals = [t["finished_at"] - t["created_at"] for t in lane]
+            report[priority] = {
+                "jobs": len(lane),
+                "queue_wait": {f"p{q}": _percentile(waits, q) for q in (50, 95, 99)},
+                "end_to_end": {f"p{q}": _percentile(totals, q) for q in (50, 95, 99)},
+                "queued": self.store.count(QUEUED, priorities=(priority,)),
+                "running": self.store.count(RUNNING, priorities=(priority,)),
+            }
+        return report